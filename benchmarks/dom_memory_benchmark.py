@@ -0,0 +1,107 @@
+"""
+Measures how much memory the nodes of a parsed document take, in bytes per node.
+
+    python -m benchmarks.dom_memory_benchmark --size 5
+
+The tree is built twice from the same parsed document:
+    dict nodes    - nodes the way they used to be, with a '__dict__' each, an empty children list and style
+                    dict for every node, and a copy of their tag name
+    slotted nodes - the nodes 'HTMLParser' builds ('browser_html.html_nodes')
+
+The attribute dictionaries and the text are the same in both, so the difference is the cost of the nodes themselves.
+The peak memory of 'HTMLParser.parse' is printed as well.
+"""
+
+import argparse
+import gc
+import tracemalloc
+from typing import Callable
+from benchmarks.html_parser_benchmark import markup_document
+from browser_html.html_nodes import Element, Node, Text
+from browser_html.html_parser import HTMLParser
+from loguru import logger
+
+
+class DictNode:
+    def __init__(self, parent: "DictNode | None") -> None:
+        self.parent = parent
+        self.children: list[DictNode] = []
+        self.style: dict[str, str] = {}
+
+
+class DictText(DictNode):
+    def __init__(self, text: str, parent: DictNode | None) -> None:
+        super().__init__(parent)
+        self.text = text
+
+
+class DictElement(DictNode):
+    def __init__(self, tag: str, attributes: dict[str, str], parent: DictNode | None) -> None:
+        super().__init__(parent)
+        # Every tag used to be its own string, sliced out of the document
+        self.tag = "".join(tag)
+        self.attributes = attributes
+
+
+def clone_to_dict_nodes(node: Node, parent: DictNode | None = None) -> DictNode:
+    if isinstance(node, Text):
+        return DictText(node.text, parent)
+    assert isinstance(node, Element)
+    clone = DictElement(node.tag, node.attributes, parent)
+    clone.children = [clone_to_dict_nodes(child, clone) for child in node.children]
+    return clone
+
+
+def clone_to_slotted_nodes(node: Node, parent: Node | None = None) -> Node:
+    if isinstance(node, Text):
+        return Text(node.text, parent)
+    assert isinstance(node, Element)
+    clone = Element(node.tag, node.attributes, parent)
+    clone.children = [clone_to_slotted_nodes(child, clone) for child in node.children]
+    return clone
+
+
+def count_nodes(node: Node) -> int:
+    return 1 + sum(count_nodes(child) for child in node.children)
+
+
+def measure(build: Callable[[], object]) -> tuple[object, int, int]:
+    """
+    Returns what 'build' returned, the memory it still holds, and the most it held at once.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, retained, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=float, default=5, help="MB of the generated document")
+    args = parser.parse_args()
+
+    # The parser logs the whole tree at the debug level
+    logger.remove()
+    document = markup_document(int(args.size * 1024 * 1024))
+    tree, _, parse_peak = measure(lambda: HTMLParser(document).parse())
+    assert isinstance(tree, Node)
+    nodes = count_nodes(tree)
+    print(f"{len(document) / (1024 * 1024):.1f} MB document, {nodes} nodes, parse peak {parse_peak / 2**20:.1f} MB")
+
+    results = {}
+    for name, clone in [("dict nodes", clone_to_dict_nodes), ("slotted nodes", clone_to_slotted_nodes)]:
+        copy, retained, _ = measure(lambda: clone(tree))
+        results[name] = retained / nodes
+        print(f"{name:>13}: {retained / 2**20:.1f} MB, {retained / nodes:.0f} bytes per node")
+        del copy
+
+    saved = 1 - results["slotted nodes"] / results["dict nodes"]
+    print(f"slotted nodes take {saved:.0%} less memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Measures how fast 'HTMLParser' turns large documents into trees, in MB of source per second.
+
+    python -m benchmarks.html_parser_benchmark --size 20 --runs 5 --min-throughput 5
+
+The documents are generated, so that the numbers don't depend on files that aren't in the repository:
+    markup - nested blocks and paragraphs with attributes, inline tags and entities, like an article
+    text   - a few tags around long runs of text, like a log dumped in a '<pre>'
+    attributes - elements with long 'style' and 'data-*' attributes, like the output of a UI framework
+    scripts    - inline scripts and styles full of '<' and '>', between a few paragraphs
+
+With '--min-throughput', the benchmark fails (exit code 1) if a document parses slower than that
+many MB/s, so it can guard against the tokenizer getting slower.
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from browser_html.html_parser import HTMLParser
+from loguru import logger
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "&amp;", "&lt;b&gt;"]
+
+
+def markup_document(size: int, seed: int = 0) -> str:
+    """
+    Roughly 'size' characters of article-like markup.
+    """
+    rng = random.Random(seed)
+    parts = ["<!doctype html><html><head><title>Benchmark</title></head><body>"]
+    length = 0
+    while length < size:
+        words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+        section = (
+            f'<div class="section s{rng.randint(0, 99)}" id="d{length}">'
+            f'<h2>{words[:30]}</h2><p style="color: red; font-size: 12px;">{words} <b>bold</b> '
+            f'<a href="/page/{length}.html">link</a> <i>{words[:20]}</i></p><br><img src="x.png"></div>\n'
+        )
+        parts.append(section)
+        length += len(section)
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def text_document(size: int, seed: int = 0) -> str:
+    """
+    Roughly 'size' characters of log lines in a single '<pre>'.
+    """
+    rng = random.Random(seed)
+    parts = ["<html><body><pre>"]
+    length = 0
+    while length < size:
+        line = f"2024-01-01 12:00:{length % 60:02} INFO worker-{rng.randint(0, 9)} handled request {length}\n"
+        parts.append(line)
+        length += len(line)
+    parts.append("</pre></body></html>")
+    return "".join(parts)
+
+
+def attribute_document(size: int, seed: int = 0) -> str:
+    """
+    Roughly 'size' characters of elements whose attributes are a few KB long.
+    """
+    rng = random.Random(seed)
+    parts = ["<html><body>"]
+    length = 0
+    while length < size:
+        declarations = " ".join(f"margin-{side}: {rng.randint(0, 99)}px;" for side in ["top", "left"] * 100)
+        state = " ".join(rng.choice(WORDS) for _ in range(500))
+        element = (
+            f"<div class=card style=\"{declarations}\" data-state='{state}' data-id={length} hidden>"
+            f'<span title="{state[:200]}">{length}</span></div>\n'
+        )
+        parts.append(element)
+        length += len(element)
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def script_document(size: int, seed: int = 0) -> str:
+    """
+    Roughly 'size' characters of inline scripts (and a few styles) around short paragraphs.
+    """
+    rng = random.Random(seed)
+    parts = ["<html><head><style>" + "div > p { color: red; } " * 200 + "</style></head><body>"]
+    length = 0
+    while length < size:
+        statements = "".join(
+            f"if (i < {rng.randint(0, 99)} && j > i) {{ html += '<li class=\"item\">' + i + '</li>'; }}\n"
+            for _ in range(100)
+        )
+        script = f"<p>{rng.choice(WORDS)}</p><script>for (let i = 0; i < n; i++) {{\n{statements}}}</script>\n"
+        parts.append(script)
+        length += len(script)
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+DOCUMENTS = {
+    "markup": markup_document,
+    "text": text_document,
+    "attributes": attribute_document,
+    "scripts": script_document,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=float, default=10, help="MB of each generated document")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--min-throughput", type=float, default=None, help="MB/s every document has to parse at")
+    args = parser.parse_args()
+
+    # The parser logs the whole tree at the debug level
+    logger.remove()
+    size = int(args.size * 1024 * 1024)
+    failed = False
+    for name, generate in DOCUMENTS.items():
+        document = generate(size)
+        megabytes = len(document) / (1024 * 1024)
+        durations = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            HTMLParser(document).parse()
+            durations.append(time.perf_counter() - start)
+
+        throughput = megabytes / statistics.median(durations)
+        print(
+            f"{name:>10}: {megabytes:.1f} MB, median {statistics.median(durations):.3f}s, "
+            f"best {min(durations):.3f}s, {throughput:.1f} MB/s"
+        )
+        if args.min_throughput is not None and throughput < args.min_throughput:
+            print(f"{name} parsed at {throughput:.1f} MB/s, below the target of {args.min_throughput} MB/s")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
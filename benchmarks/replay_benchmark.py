@@ -0,0 +1,201 @@
+"""
+Measures page loads against recorded traffic, so that the numbers don't depend on live hosts.
+
+Record the pages (and their stylesheets) once:
+    python -m benchmarks.replay_benchmark record pages.json http://browser.engineering/text.html
+
+Then load them from the archive as many times as needed, optionally over a slower network:
+    python -m benchmarks.replay_benchmark replay pages.json --runs 20 --latency 50 --bandwidth 1000
+
+Pages are loaded through 'Tab.load_url' and the real network stack. Layout needs a display (it measures
+text with Tk fonts), so the load stops once the stylesheets have been applied to the document.
+"""
+
+import argparse
+import json
+import ssl
+import statistics
+import time
+from typing import Iterable
+from browser_css.css_parser import CSSParser
+from browser_css.css_rules import sort_rules_by_priority, add_css_to_html_node
+from browser_html.html_parser import HTMLParser, Element, Node
+from browser_network import network
+from browser_network.connection_pool import ConnectionPool
+from browser_network.dns_cache import DNSCache, Resolver
+from browser_network.http_cache import HTTPCache
+from browser_network.in_flight import InFlightRequests
+from browser_network.preload_cache import PreloadCache
+from browser_network.redirect_cache import RedirectCache
+from browser_network.replay_server import ReplayServer, replay_resolver
+from browser_network.tls import TLSSessionCache
+from browser_network.traffic_archive import TrafficArchive, TrafficRecorder
+from browser_tab import Tab, linked_stylesheet
+from utils.utils import tree_to_list
+
+
+class HeadlessTab(Tab):
+    """
+    A tab that stops before layout, so that it can load pages without a display.
+    """
+
+    def render(self, html_tree: Node, stylesheets: Iterable[str | None]) -> None:
+        rules = self.default_style_sheet.copy()
+        for body in stylesheets:
+            if body is not None:
+                rules.extend(CSSParser(body).parse_css_file())
+        add_css_to_html_node(html_tree, sort_rules_by_priority(rules))
+        self.html_tree = html_tree
+
+
+def reset_network(resolver: Resolver | None = None, tls_context: ssl.SSLContext | None = None) -> None:
+    """
+    Starts from empty caches and no open connections, like a browser that was just started.
+    """
+    network.pool.close_all()
+    if resolver is not None:
+        network.dns_cache = DNSCache(resolver)
+    else:
+        network.dns_cache = DNSCache()
+    network.tls_sessions = TLSSessionCache(tls_context)
+    network.pool = ConnectionPool(network.dns_cache, network.tls_sessions)
+    network.cache = HTTPCache(directory=None)
+    network.preloaded = PreloadCache()
+    network.in_flight = InFlightRequests()
+    network.redirects = RedirectCache()
+
+
+def record(archive_file: str, urls: list[str]) -> None:
+    reset_network()
+    archive = TrafficArchive()
+    recorder = TrafficRecorder(archive)
+    for url in urls:
+        final_url, body = recorder.record(url)
+        html_tree = HTMLParser(body.decode("utf8", errors="replace")).parse()
+        for node in tree_to_list(html_tree, []):
+            stylesheet_url = linked_stylesheet(node, final_url) if isinstance(node, Element) else None
+            if stylesheet_url is None:
+                continue
+            try:
+                recorder.record(stylesheet_url)
+            except Exception as e:
+                print(f"Skipping {stylesheet_url}: {e}")
+    archive.save(archive_file)
+    print(f"Recorded {len(archive)} responses to {archive_file}")
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(samples: list[float]) -> dict:
+    """
+    The distribution of the load times, in milliseconds.
+    """
+    milliseconds = [sample * 1000 for sample in samples]
+    return {
+        "runs": len(milliseconds),
+        "min": min(milliseconds),
+        "median": statistics.median(milliseconds),
+        "mean": statistics.mean(milliseconds),
+        "p90": percentile(milliseconds, 0.9),
+        "p95": percentile(milliseconds, 0.95),
+        "max": max(milliseconds),
+        "stdev": statistics.stdev(milliseconds) if len(milliseconds) > 1 else 0.0,
+    }
+
+
+def replay(
+    archive: TrafficArchive,
+    urls: list[str],
+    runs: int,
+    latency: float = 0.0,
+    bandwidth: float | None = None,
+    warm: bool = False,
+    certfile: str | None = None,
+    keyfile: str | None = None,
+) -> dict[str, dict]:
+    """
+    Loads every url 'runs' times from the archive and returns the distribution of the load times per url.
+    Unless 'warm' is set, every load starts from empty caches and no open connections.
+    """
+    https = None
+    client_context = None
+    if certfile is not None:
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(certfile, keyfile)
+        https = ReplayServer(archive, latency, bandwidth, server_context).start()
+        # The stand-in presents the same certificate for every host it replays
+        client_context = ssl.create_default_context(cafile=certfile)
+        client_context.check_hostname = False
+
+    results: dict[str, dict] = {}
+    with ReplayServer(archive, latency, bandwidth) as http:
+        resolver = replay_resolver(http, https)
+        reset_network(resolver, client_context)
+        try:
+            for url in urls:
+                samples = []
+                for _ in range(runs):
+                    if not warm:
+                        reset_network(resolver, client_context)
+                    tab = HeadlessTab()
+                    start = time.perf_counter()
+                    tab.load_url(url)
+                    samples.append(time.perf_counter() - start)
+                results[url] = summarize(samples)
+        finally:
+            network.pool.close_all()
+            if https is not None:
+                https.stop()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Record pages, then benchmark loading them from the recording.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_command = commands.add_parser("record", help="fetch pages from the live hosts into an archive")
+    record_command.add_argument("archive")
+    record_command.add_argument("urls", nargs="+")
+
+    replay_command = commands.add_parser("replay", help="load archived pages and report the load times")
+    replay_command.add_argument("archive")
+    replay_command.add_argument("urls", nargs="*", help="defaults to every html page in the archive")
+    replay_command.add_argument("--runs", type=int, default=10)
+    replay_command.add_argument("--latency", type=float, default=0.0, help="milliseconds added to each response")
+    replay_command.add_argument("--bandwidth", type=float, default=None, help="kilobytes per second per connection")
+    replay_command.add_argument("--warm", action="store_true", help="keep the caches and connections between runs")
+    replay_command.add_argument("--certfile", help="serve the https urls of the archive with this certificate")
+    replay_command.add_argument("--keyfile")
+    replay_command.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.archive, args.urls)
+        return
+
+    archive = TrafficArchive.load(args.archive)
+    urls = args.urls or [
+        response.url
+        for response in archive.responses.values()
+        if response.status == 200 and "html" in response.headers.get("content-type", "")
+    ]
+    bandwidth = args.bandwidth * 1024 if args.bandwidth is not None else None
+    results = replay(archive, urls, args.runs, args.latency / 1000, bandwidth, args.warm, args.certfile, args.keyfile)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'url':<60} {'runs':>5} {'min':>9} {'median':>9} {'mean':>9} {'p90':>9} {'p95':>9} {'max':>9}")
+    for url, summary in results.items():
+        print(
+            f"{url:<60} {summary['runs']:>5} "
+            + " ".join(f"{summary[name]:>7.1f}ms" for name in ["min", "median", "mean", "p90", "p95", "max"])
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,3 +3,63 @@ H_STEP, V_STEP = 13, 18
 SCROLL_STEP = 100
 # Reserved space for the browser chrome
 CHROME_PX = 100
+
+# Persistent HTTP/1.1 connections kept per (scheme, host, port)
+MAX_CONNECTIONS_PER_HOST = 6
+# Seconds an unused connection is kept in the pool before it is closed
+CONNECTION_IDLE_TIMEOUT = 15.0
+
+# Bytes of response bodies kept by the in-memory and on-disk tiers of the HTTP cache
+HTTP_CACHE_MEMORY_BYTES = 32 * 1024 * 1024
+HTTP_CACHE_DISK_BYTES = 256 * 1024 * 1024
+HTTP_CACHE_DIRECTORY = "./cache/http"
+
+# Fetches run by the fetch scheduler at the same time: in total, to a single origin (matching the connection
+# pool), and of the ones that are not needed to render the page (so some slots are always left for those that are)
+FETCH_MAX_TOTAL = 16
+FETCH_MAX_PER_HOST = MAX_CONNECTIONS_PER_HOST
+FETCH_MAX_LOW_PRIORITY = 4
+
+# Seconds a resolved host name (or a failed lookup) is remembered
+DNS_CACHE_TTL = 60.0
+DNS_NEGATIVE_TTL = 5.0
+
+# Threads acting on '<link rel=preconnect|dns-prefetch>' hints
+RESOURCE_HINT_WORKERS = 2
+# Bytes and seconds a preloaded or prefetched response is kept until it is used
+PRELOAD_CACHE_BYTES = 16 * 1024 * 1024
+PRELOAD_CACHE_TTL = 300.0
+
+# Speculative loading of the documents behind links that are hovered or visible
+SPECULATIVE_BUDGET_BYTES = 8 * 1024 * 1024
+SPECULATIVE_VIEWPORT_LINKS = 4
+# Milliseconds the pointer has to rest on a link before its document is prefetched
+HOVER_DELAY_MS = 65
+
+# Redirects followed for a single request before giving up, and permanent redirects remembered
+MAX_REDIRECTS = 20
+REDIRECT_CACHE_ENTRIES = 1024
+
+# Seconds allowed for opening a connection, for each read from it, and for a whole request (including its body)
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 30.0
+REQUEST_TIMEOUT = 60.0
+
+# A request is sent again on another connection if its first byte takes longer than this percentile of
+# the recent times to first byte of its origin ('None' disables hedging)
+HEDGE_PERCENTILE: float | None = 0.95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+HEDGE_MIN_DELAY = 0.01
+
+# Response bodies larger than this are written to a temporary file as they are downloaded, and parsed through
+# a memory-mapped view of it, instead of being held in memory ('None' keeps every body in memory)
+SPILL_THRESHOLD_BYTES: int | None = 16 * 1024 * 1024
+
+# Parsed documents kept by the DOM cache. In memory they are counted in the bytes their trees take, around 8 times
+# the size of the document. Documents of at least 'DOM_CACHE_DISK_THRESHOLD' bytes are also written to disk, which
+# is counted in file bytes ('None' keeps the cache in memory only)
+DOM_CACHE_MEMORY_BYTES = 128 * 1024 * 1024
+DOM_CACHE_DISK_BYTES = 256 * 1024 * 1024
+DOM_CACHE_DISK_THRESHOLD = 512 * 1024
+DOM_CACHE_DIRECTORY: str | None = "./cache/dom"
@@ -1,17 +1,30 @@
 import json
-from typing import Tuple
+from typing import Tuple, TYPE_CHECKING
 from utils.type_hints import CSSPropertyName, CSSPropertyValue, CSSProperties, CSSRule
 from browser_css.css_selectors import *
 from loguru import logger
 
+if TYPE_CHECKING:
+    from browser_network.spill_file import MappedText
+
 
 class CSSParser:
-    def __init__(self, text: str) -> None:
-        self.text = text.strip()  # Remove all trailing white space from the CSS file
+    def __init__(self, text: "str | MappedText") -> None:
+        """
+        The text is either a 'str', or a 'MappedText' for a stylesheet too large to be held in memory,
+        which is read through a memory map instead (so it is never copied, not even to strip it).
+        """
+        self.text = text
         self.index = 0
+        self.end = len(text)
+        # Skip the white space around the CSS file
+        while self.index < self.end and text[self.index].isspace():
+            self.index += 1
+        while self.end > self.index and text[self.end - 1].isspace():
+            self.end -= 1
 
     def is_end(self) -> bool:
-        return self.index >= len(self.text)
+        return self.index >= self.end
 
     def ignore_until(self, chars: list[str]) -> str | None:
         """
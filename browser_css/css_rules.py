@@ -1,6 +1,7 @@
 from typing import TYPE_CHECKING
 from browser_css.css_parser import CSSParser
 from browser_css.css_selectors import *
+from browser_html.html_nodes import EMPTY_STYLE
 from utils.constants import INHERITED_PROPERTIES
 from loguru import logger
 
@@ -99,6 +100,10 @@ def add_css_to_html_node(node: Node, rules: list["CSSRule"], inherited_rules=INH
     3. Style attribute rules.
     """
 
+    # Nodes start with the shared (read-only) empty style, give this one its own
+    if node.style is EMPTY_STYLE:
+        node.style = {}
+
     # Add inherited rules
     for property, default_value in inherited_rules.items():
         if node.parent:
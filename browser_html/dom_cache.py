@@ -0,0 +1,271 @@
+import hashlib
+import json
+import mmap
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from browser_config import DOM_CACHE_MEMORY_BYTES, DOM_CACHE_DISK_BYTES, DOM_CACHE_DISK_THRESHOLD, DOM_CACHE_DIRECTORY
+from browser_html.html_nodes import Element, Node, Text
+from browser_html.html_parser import HTMLParser, paused_gc
+from utils.disk_lru import DiskLRU
+from loguru import logger
+
+# A node of a serialized tree: the index of its parent (-1 for the root), and either its tag and
+# attributes (an element) or its text
+NodeRecord = tuple[int, str, dict[str, str]] | tuple[int, str]
+
+# The memory a node takes on average, without its attributes and text (measured by 'benchmarks.dom_memory_benchmark')
+NODE_BYTES = 119
+
+
+def content_key(document: bytes | mmap.mmap | str) -> str:
+    """
+    Documents are cached by what they contain rather than by their url, so a document that is reloaded,
+    gone back to, or opened in several tabs is found however it was loaded (as long as it hasn't changed).
+    A 'str' is hashed as UTF-8, which is what most documents are served as.
+    """
+    if isinstance(document, str):
+        document = document.encode("utf8")
+    return hashlib.sha256(document).hexdigest()
+
+
+def tree_bytes(tree: Node) -> int:
+    """
+    An estimate of the memory a tree takes: its nodes, their attribute dictionaries and their text. Tag names
+    and attribute names aren't counted, they are interned and shared by every tree.
+    """
+    size = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        size += NODE_BYTES
+        if isinstance(node, Text):
+            size += sys.getsizeof(node.text)
+            continue
+        assert isinstance(node, Element)
+        size += sys.getsizeof(node.attributes) + sum(sys.getsizeof(value) for value in node.attributes.values())
+        stack.extend(node.children)
+    return size
+
+
+def clone_tree(tree: Node) -> Node:
+    """
+    Copies the tags, attributes and text of a tree, but not its style, which the cascade adds to the copy.
+    The tree is walked with a stack instead of recursion, since documents can be nested arbitrarily deep.
+    """
+    with paused_gc():
+        root = clone_node(tree, None)
+        stack = [(tree, root)]
+        while stack:
+            node, clone = stack.pop()
+            for child in node.children:
+                child_clone = clone_node(child, clone)
+                clone.children.append(child_clone)
+                if isinstance(child, Element):
+                    stack.append((child, child_clone))
+    return root
+
+
+def clone_node(node: Node, parent: Node | None) -> Node:
+    if isinstance(node, Text):
+        return Text(node.text, parent)
+    assert isinstance(node, Element)
+    return Element(node.tag, dict(node.attributes), parent)
+
+
+def serialize_tree(tree: Node) -> list[NodeRecord]:
+    """
+    Flattens a tree into its nodes in document order, each pointing to its parent by index. Unlike the nodes
+    themselves, which point to each other, the records can be written as JSON whatever the depth of the tree.
+    """
+    records: list[NodeRecord] = []
+    stack: list[tuple[Node, int]] = [(tree, -1)]
+    while stack:
+        node, parent = stack.pop()
+        index = len(records)
+        if isinstance(node, Text):
+            records.append((parent, node.text))
+            continue
+        assert isinstance(node, Element)
+        records.append((parent, node.tag, node.attributes))
+        # Reversed, so that the first child is the next one to be popped
+        stack.extend((child, index) for child in reversed(node.children))
+    return records
+
+
+def deserialize_tree(records: list[NodeRecord]) -> Node:
+    nodes: list[Node] = []
+    with paused_gc():
+        for record in records:
+            parent = nodes[record[0]] if record[0] >= 0 else None
+            node = Element(record[1], record[2], parent) if len(record) == 3 else Text(record[1], parent)
+            if parent is not None:
+                parent.children.append(node)
+            nodes.append(node)
+    return nodes[0]
+
+
+class DOMCache:
+    """
+    Parsed documents, keyed by a hash of the document (see 'content_key'), so that the same document isn't
+    parsed again when it is reloaded, gone back to, or opened in another tab.
+
+    Recently used trees are kept in an in-memory LRU, which is bounded by an estimate of the memory the trees
+    take (see 'tree_bytes'), several times the size of their documents.
+    Documents of at least 'disk_threshold' bytes (which are the slowest to parse) are also written to disk,
+    as the JSON of their 'serialize_tree' records, so that they survive being evicted from memory. JSON rather
+    than pickle, since loading a pickle runs whatever code the file asks for, and anyone who can write to the
+    cache directory could make the browser do so.
+
+    The cached trees are never handed out: 'store' keeps a copy of the tree, and 'lookup' returns a copy
+    (see 'clone_tree'), which the caller is free to style and change. Trees are copied (and written to disk)
+    on a background thread, so the page they were parsed for doesn't wait for it.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int = DOM_CACHE_MEMORY_BYTES,
+        disk_bytes: int = DOM_CACHE_DISK_BYTES,
+        disk_threshold: int = DOM_CACHE_DISK_THRESHOLD,
+        directory: str | None = DOM_CACHE_DIRECTORY,
+    ) -> None:
+        self.memory_bytes = memory_bytes
+        self.disk_threshold = disk_threshold
+        self.lock = threading.Lock()
+        # A single thread, so a tree is in the cache before the ones stored after it
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dom-cache")
+
+        # key -> (tree, 'tree_bytes' of the tree), ordered from the least to the most recently used
+        self.memory: OrderedDict[str, tuple[Node, int]] = OrderedDict()
+        self.memory_size = 0
+        self.disk = DiskLRU(directory, disk_bytes, [".dom"]) if directory is not None else None
+
+    def lookup(self, key: str) -> Node | None:
+        with self.lock:
+            cached = self.memory.get(key)
+            if cached is not None:
+                self.memory.move_to_end(key)
+            else:
+                tree = self._read_from_disk(key)
+        if cached is not None:
+            logger.debug(f"Reusing the tree of {key[:12]}")
+            return clone_tree(cached[0])
+        if tree is None:
+            return None
+
+        # The tree read from disk isn't shared with anyone yet, so it can be returned as it is
+        self.writer.submit(self._store, key, tree, False)
+        logger.debug(f"Loaded the tree of {key[:12]} from disk")
+        return tree
+
+    def store(self, key: str, size: int, tree: Node) -> None:
+        """
+        'size' is the number of bytes of the document the tree was parsed from, large documents are written to disk.
+
+        The tree is copied on a background thread, while the caller goes on with it. Until then, only its style
+        may change (which is all the cascade does), not its tags, attributes or children.
+        """
+        self.writer.submit(self._store, key, tree, size >= self.disk_threshold)
+
+    def parse(self, document: str) -> Node:
+        """
+        Parses a document, unless it was parsed before.
+        """
+        key = content_key(document)
+        tree = self.lookup(key)
+        if tree is None:
+            tree = HTMLParser(document).parse()
+            self.store(key, len(document), tree)
+        return tree
+
+    def flush(self) -> None:
+        """
+        Waits for the trees that are being stored.
+        """
+        self.writer.submit(lambda: None).result()
+
+    def clear(self) -> None:
+        self.flush()
+        with self.lock:
+            self.memory.clear()
+            self.memory_size = 0
+            if self.disk is not None:
+                self.disk.clear()
+
+    def _store(self, key: str, tree: Node, to_disk: bool) -> None:
+        """
+        Runs on the writer thread.
+        """
+        try:
+            copy = clone_tree(tree)
+            size = tree_bytes(copy)
+            with self.lock:
+                self._store_in_memory(key, copy, size)
+            if to_disk:
+                self._write_to_disk(key, copy)
+        except Exception as e:
+            logger.exception(e)
+
+    def _write_to_disk(self, key: str, tree: Node) -> None:
+        """
+        Runs on the writer thread. Only the index is updated while holding 'self.lock', lookups don't wait for the write.
+        """
+        with self.lock:
+            if self.disk is None or key in self.disk:
+                return
+            (path,) = self.disk.paths(key)
+            directory = self.disk.directory
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Write to a temporary file first, so that a crash never leaves a half written tree behind
+            with open(path + ".tmp", "w") as file:
+                json.dump(serialize_tree(tree), file, separators=(",", ":"))
+            os.replace(path + ".tmp", path)
+            file_size = os.path.getsize(path)
+        except OSError as e:
+            logger.debug(f"Failed to write tree {key[:12]}: {e}")
+            return
+
+        with self.lock:
+            self.disk.add(key, file_size)
+
+    # The methods below must be called while holding 'self.lock'
+
+    def _store_in_memory(self, key: str, tree: Node, size: int) -> None:
+        self._remove_from_memory(key)
+        # A tree that doesn't fit in memory is only kept on disk
+        if size > self.memory_bytes:
+            return
+
+        self.memory[key] = (tree, size)
+        self.memory_size += size
+        while self.memory_size > self.memory_bytes:
+            _, (_, evicted_size) = self.memory.popitem(last=False)
+            self.memory_size -= evicted_size
+
+    def _remove_from_memory(self, key: str) -> None:
+        cached = self.memory.pop(key, None)
+        if cached is not None:
+            self.memory_size -= cached[1]
+
+    def _read_from_disk(self, key: str) -> Node | None:
+        if self.disk is None or key not in self.disk:
+            return None
+
+        (path,) = self.disk.paths(key)
+        try:
+            with open(path, "rb") as file, paused_gc():
+                records = json.load(file)
+            tree = deserialize_tree(records)
+            self.disk.touch(key)
+        except (OSError, ValueError, TypeError, IndexError, AttributeError) as e:
+            logger.debug(f"Dropping unreadable tree {key[:12]}: {e}")
+            self.disk.remove(key)
+            return None
+        return tree
+
+
+dom_cache = DOMCache()
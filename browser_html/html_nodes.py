@@ -1,38 +1,78 @@
+import sys
 from typing import TYPE_CHECKING
 from abc import ABC
-from typing import Dict, Union
+from typing import Dict, NoReturn, Sequence, Union
 
 if TYPE_CHECKING:
     from utils.type_hints import CSSProperties
 
+"""
+A page can have hundreds of thousands of nodes, so they are kept small: their attributes live in slots instead
+of a per-instance '__dict__', and what most nodes would have an empty copy of is shared instead:
+- 'Text' nodes never have children, they all share the same empty tuple.
+- Nodes share an empty (read-only) style until the cascade gives them their own ('add_css_to_html_node').
+"""
+EMPTY_CHILDREN: tuple = ()
+
+
+class EmptyStyle(dict):
+    """
+    The style of a node that hasn't been through the cascade. There is only one ('EMPTY_STYLE'), copying
+    or pickling a tree keeps pointing its nodes to it.
+    """
+
+    def _read_only(self, *args, **kwargs) -> NoReturn:
+        raise AssertionError("The empty style is shared, assign the node a style of its own before changing it")
+
+    __setitem__ = __delitem__ = __ior__ = update = setdefault = pop = popitem = clear = _read_only  # type: ignore[assignment]
+
+    def __copy__(self) -> "EmptyStyle":
+        return self
+
+    def __deepcopy__(self, memo: dict) -> "EmptyStyle":
+        return self
+
+    def __reduce__(self) -> str:
+        return "EMPTY_STYLE"
+
+
+EMPTY_STYLE = EmptyStyle()
+
 
 class Node(ABC):
+    __slots__ = ("parent", "children", "style")
+
     def __init__(self, parent: Union["Node", None]) -> None:
         self.parent = parent
-        self.children: list[Node] = []
-        self.style: "CSSProperties" = {}  # Added by the CSS parser
+        self.children: Sequence[Node] = []
+        self.style: "CSSProperties" = EMPTY_STYLE  # Added by the CSS parser
 
 
 class Text(Node):
+    __slots__ = ("text",)
+
     def __init__(self, text: str, parent: Node | None) -> None:
         self.text = text
         # todo conver to 'super(parent)' call to initialize 'parent' and 'children' and 'style
         self.parent = parent
         # Even though 'Text' nodes never have children, this is added for consistency, to avoid 'isinstance' calls throughout the code
-        self.children: list[Node] = []
-        self.style: "CSSProperties" = {}
+        self.children: Sequence[Node] = EMPTY_CHILDREN
+        self.style: "CSSProperties" = EMPTY_STYLE
 
     def __repr__(self) -> str:
         return repr(self.text)
 
 
 class Element(Node):
+    __slots__ = ("tag", "attributes")
+
     def __init__(self, tag: str, attributes: Dict[str, str], parent: Node | None) -> None:
-        self.tag = tag
+        # Tag names repeat across the document, interning keeps a single copy of each
+        self.tag = sys.intern(tag)
         self.attributes = attributes
         self.parent = parent
         self.children: list[Node] = []
-        self.style: "CSSProperties" = {}
+        self.style: "CSSProperties" = EMPTY_STYLE
 
     def __repr__(self) -> str:
         return f"< {self.tag} attributes={self.attributes} style={self.style} >"
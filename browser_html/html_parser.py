@@ -1,50 +1,180 @@
+import gc
 import html
 import re
+import sys
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Tuple
 from utils.utils import print_tree, stringify_tree
-from utils.constants import SELF_CLOSING_TAGS
+from utils.constants import RAW_TEXT_ELEMENTS, SELF_CLOSING_TAGS
 from browser_html.html_nodes import *
 from loguru import logger
 
+# The characters that start and end a tag
+TAG_DELIMITER = re.compile("[<>]")
+
+# The close tags of the raw text elements, which end at white space, a '/' or the '>'
+RAW_TEXT_CLOSE_TAGS = {tag: re.compile(f"</{tag}(?=[\\s/>])", re.IGNORECASE) for tag in RAW_TEXT_ELEMENTS}
+
+# The name at the start of a tag, which ends at the first white space (or at the '/' of '<br/>')
+TAG_NAME = re.compile(r"/?[^\s/]*")
+
+# The next attribute of a tag and its value, if it has one. Each attribute is matched from where the last one
+# ended, so a tag is scanned once, however long its values are
+ATTRIBUTE = re.compile(
+    r"""[\s/]*(?:(?P<name>[^\s/][^\s/=]*)(?:\s*=\s*(?:"(?P<double>[^"]*)"?|'(?P<single>[^']*)'?|(?P<unquoted>\S*)))?)?"""
+)
+
 
 class HTMLParser:
-    def __init__(self, body: str) -> None:
+    def __init__(self, body: str | Iterable[str] | None = None) -> None:
+        """
+        The body is either the whole document, or an iterable of chunks of the document (ex. a response
+        body as it is being downloaded, or a 'MappedText' that was spilled to disk), in which case tokenizing
+        starts before the last chunk arrives.
+
+        Without a body, the document is pushed to the parser with 'feed' as it arrives, and 'close' returns the tree.
+        """
         self.body = body
-        self.unfinished: list[Node] = []
+        self.unfinished: list[Element] = []
+        # The root of the tree, which grows as the document is fed to the parser
+        self.tree: Node | None = None
+        # Called with every element as soon as it is added to the tree (ex. to start loading a stylesheet
+        # while the rest of the document is still arriving)
+        self.element_listeners: list[Callable[[Element], None]] = []
+        self.in_tag = False
+        # The text after the last '<' or '>' that was fed, which continues in the next chunk
+        self.pending: list[str] = []
+        # The script, style or textarea whose contents are being read, and the end of the last chunk of them
+        self.raw_text_element: Element | None = None
+        self.raw_text_tail = ""
 
     def parse(self):
         """
         Return the text-not-tags content of the HTML document.
         """
-        text = ""
-        in_tag = False
-        for c in self.body:
-            if c == "<":
-                in_tag = True
-                # Parse 'text' (which in this case is a sequence of characters outside a tag) as a 'Text' node
-                if text:
-                    self.parse_raw_text(html.unescape(text))
-                text = ""
-            elif c == ">":
-                in_tag = False
-                # Parse 'text' as a tag and its contents
-                self.parse_tag(text)
-                text = ""
-            else:
-                text += c
+        assert self.body is not None, "Nothing to parse, the document is fed to this parser"
+        chunks = [self.body] if isinstance(self.body, str) else self.body
+        for chunk in chunks:
+            self.feed(chunk)
+        return self.close()
+
+    def feed(self, chunk: str) -> None:
+        """
+        Tokenizes the next part of the document, and adds what it contains to the tree. A tag (or a text)
+        that is cut off at the end of the chunk is completed by the next one.
+
+        The tokenizer jumps from one '<' or '>' to the next with a compiled regex, and hands the text between
+        them to 'parse_raw_text' or 'parse_tag' as a single slice, instead of visiting every character.
+        A '<' ends the text before it (even inside a tag), and a '>' ends a tag (even outside of one).
+
+        The contents of a script, style or textarea are not tokenized, the tokenizer jumps straight to their
+        close tag instead (see 'feed_raw_text').
+        """
+        with paused_gc():
+            start = 0
+            while start < len(chunk):
+                if self.raw_text_element is not None:
+                    start = self.feed_raw_text(chunk, start)
+                    continue
+
+                match = TAG_DELIMITER.search(chunk, start)
+                if match is None:
+                    self.pending.append(chunk[start:])
+                    return
+                end = match.start()
+                text = chunk[start:end]
+                if self.pending:
+                    self.pending.append(text)
+                    text = "".join(self.pending)
+                    self.pending = []
+
+                if chunk[end] == "<":
+                    self.in_tag = True
+                    # Parse 'text' (which in this case is a sequence of characters outside a tag) as a 'Text' node
+                    if text:
+                        self.parse_raw_text(html.unescape(text))
+                else:
+                    self.in_tag = False
+                    # Parse 'text' as a tag and its contents
+                    self.parse_tag(text)
+                start = end + 1
+
+    def feed_raw_text(self, chunk: str, start: int) -> int:
+        """
+        Looks for the close tag of the raw text element with a single search, and adds what came before it to
+        the element. Returns where tokenizing continues, which is the end of the chunk if the close tag
+        hasn't arrived yet.
+
+        The close tag can be split between two chunks, so the last few characters of a chunk are kept
+        in 'raw_text_tail' and searched again with the next one.
         """
-        At the end of the loop, this dumps any accumulated text as a Text object.
+        element = self.raw_text_element
+        assert element is not None
+        carried = len(self.raw_text_tail)
+        text = self.raw_text_tail + chunk[start:]
+        close_tag = RAW_TEXT_CLOSE_TAGS[element.tag].search(text)
+        if close_tag is None:
+            # As long as '</script', so that a close tag cut off by the end of the chunk is found with the next one
+            tail_length = len(element.tag) + 2
+            self.pending.append(text[:-tail_length])
+            self.raw_text_tail = text[-tail_length:]
+            return len(chunk)
+
+        self.pending.append(text[: close_tag.start()])
+        self.raw_text_tail = ""
+        self.end_raw_text()
+        # The close tag is tokenized like any other tag
+        if close_tag.start() < carried:
+            # It started in the previous chunk, so the tokenizer is already inside of it
+            self.in_tag = True
+            self.pending = [text[close_tag.start() + 1 : carried]]
+            return start
+        return start + close_tag.start() - carried
+
+    def close(self) -> Node:
+        """
+        Ends the document, and returns the complete tree.
+        """
+        text = "".join(self.pending)
+        self.pending = []
+        """
+        At the end of the document, this dumps any accumulated text as a Text object.
         Otherwise, if you never saw an angle bracket, you’d return an empty list
         of tokens (This allows you to parse an HTML document that doesn't contain
         any tags as a basic document with text). But unfinished tags,
         like in Hi!<hr, are thrown out.
         """
-        if not in_tag and text:
-            self.parse_raw_text(text)
+        with paused_gc():
+            # The document ended inside of a script, style or textarea
+            if self.raw_text_element is not None:
+                self.pending = [text]
+                self.end_raw_text()
+            elif not self.in_tag and text:
+                self.parse_raw_text(text)
+            html_tree = self.finish()
 
-        html_tree = self.finish()
-        logger.debug(stringify_tree(html_tree))
+        # Printing the tree takes longer than parsing it, so it is only done when the debug log is enabled
+        logger.opt(lazy=True).debug("{}", lambda: stringify_tree(html_tree))
         return html_tree
 
+    def end_raw_text(self) -> None:
+        """
+        Adds the contents of the raw text element, which were collected in 'pending', to the tree.
+        Scripts aren't run, so their contents are thrown away.
+        """
+        element = self.raw_text_element
+        assert element is not None
+        text = "".join(self.pending) + self.raw_text_tail
+        self.pending = []
+        self.raw_text_tail = ""
+        self.raw_text_element = None
+        if element.tag == "textarea":
+            text = html.unescape(text)
+        if element.tag != "script" and text and not text.isspace():
+            element.children.append(Text(text, element))
+        # Its listeners are only told about the element now that it has its contents (ex. a '<style>')
+        self.added(element)
+
     def parse_raw_text(self, text: str):
         """
         A 'Text' node is appended as a child of the last unfinished (i.e. not closed) node.
@@ -69,20 +199,20 @@ class HTMLParser:
         # Throw away the '<!doctype html>' tag and comments
         if tag.startswith("!"):
             return
-        # A close tag removes an unfinished node, and adds it to the next unfinished node
+        # A close tag removes an unfinished node, which is already a child of the next unfinished node
         if tag.startswith("/"):
-            # Handle the special case of the last tag (which will not have unfinished nodes added to it)
+            # Handle the special case of the last tag (the root stays unfinished until the document ends)
             if len(self.unfinished) == 1:
                 return
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
+            self.unfinished.pop()
         # Auto-close special tags
         elif tag in SELF_CLOSING_TAGS:
             parent = self.unfinished[-1]
             node = Element(tag, attributes, parent)
             parent.children.append(node)
-        # An open tag adds an unfinished node to the end of the list
+            self.added(node)
+        # An open tag adds an unfinished node to the end of the list, and to its parent right away so that
+        # the tree can be looked at before the document is complete (ex. its '<head>')
         else:
             # Handle the special case of the first tag (which doesn't have a parent)
             if len(self.unfinished) == 0:
@@ -90,57 +220,78 @@ class HTMLParser:
             else:
                 parent = self.unfinished[-1]
             node = Element(tag, attributes, parent)
+            if parent is None:
+                self.tree = node
+            else:
+                parent.children.append(node)
             self.unfinished.append(node)
+            if tag in RAW_TEXT_ELEMENTS:
+                self.raw_text_element = node
+            else:
+                self.added(node)
 
-    def get_attributes(self, text: str):
-        # todo fix parsing tags and attributes
-        """
-        Since 'text.split()' seperates by whitespace, we get the wrong result when parsing
-
-        text = 'span style="background-color: orange;"'
-        # Results in
-        parts = ['span', 'style="background-color:', 'orange;"']
-        # But the desired result is
-        parts = ['span', 'style="background-color: orange;"']
+    def added(self, element: Element) -> None:
+        for listener in self.element_listeners:
+            listener(element)
 
-        Style declarations are seperated by a semicolon.
+    def get_attributes(self, text: str) -> Tuple[str, Dict[str, str]]:
         """
+        Splits the contents of a tag into its name and its attributes, in a single pass over the text.
 
-        # parts = text.split()
+        Example:
+            text = 'a title=\'Say "hi"\' href=/page.html style="color: red; font-size: 12px;" hidden'
+            tag = 'a'
+            attributes = {'title': 'Say "hi"', 'href': '/page.html', 'style': 'color: red; font-size: 12px;', 'hidden': ''}
 
-        # Pattern to match spaces outside quotes
-        pattern = r'\s+(?=([^"]*"[^"]*")*[^"]*$)'
-        # Split the string using the pattern
-        parts = re.split(pattern, text)
+        Values are double-quoted, single-quoted or unquoted (up to the next white space), and an attribute
+        without a value ('<input disabled>') is an empty string. The name of the tag and of the attributes are
+        lowercase, and when an attribute is repeated the first one is kept.
+        """
+        tag_name = TAG_NAME.match(text)
+        assert tag_name is not None
+        tag = tag_name.group().lower()
+        attributes: Dict[str, str] = {}
+        # The contents of close tags, comments and the '<!doctype html>' are thrown away by 'parse_tag'
+        if tag.startswith(("/", "!")):
+            return tag, attributes
 
-        tag = parts[0].lower()
-        attributes = {}
-        for attr_pair in parts[1:]:
-            # ? Why does the regex pattern return some 'None' values?
-            if attr_pair is None:
+        position = tag_name.end()
+        while position < len(text):
+            attribute = ATTRIBUTE.match(text, position)
+            assert attribute is not None
+            position = attribute.end()
+            # Only white space (or the '/' of a self-closing tag) was left
+            if attribute["name"] is None:
+                break
+            name = sys.intern(attribute["name"].lower())
+            if name in attributes:
                 continue
-            # An unquoted attribute, where an equal sign separates the two
-            if "=" in attr_pair:
-                key, value = attr_pair.split("=", 1)
-                # Strip the quotes from quoted attributes
-                if len(value) > 2 and value[0] in ["'", '"']:
-                    value = value[1:-1]
-
-                attributes[key.lower()] = value
-            # Attributes with omitted values '<input disabled>'
-            else:
-                attributes[attr_pair.lower()] = ""
+            value = attribute["double"] or attribute["single"] or attribute["unquoted"] or ""
+            attributes[name] = value
         return tag, attributes
 
     def finish(self):
         if len(self.unfinished) == 0:
             self.parse_tag("html")
-        # Turn the incomplete three into a complete tree by closing unfinished nodes
-        while len(self.unfinished) > 1:
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
-        return self.unfinished.pop()
+        # Close the unfinished nodes, they are already in the tree
+        root = self.unfinished[0]
+        self.unfinished = []
+        return root
+
+
+@contextmanager
+def paused_gc() -> Iterator[None]:
+    """
+    Collections triggered by the allocation of the nodes would walk the growing tree over and over,
+    and the tree has no garbage in it while it is being built.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+import builtins
+import json
+import pickle
+import time
+from browser_html.dom_cache import DOMCache, clone_tree, content_key, tree_bytes
+from browser_html.html_nodes import EMPTY_STYLE, Element, Text
+from browser_html.html_parser import HTMLParser
+from utils.utils import stringify_tree
+
+DOCUMENT = '<html><head><style>p { color: red; }</style></head><body><p class="a">Hi <b>there</b></p></body></html>'
+
+
+def test_lookup_returns_a_copy_of_the_tree():
+    cache = DOMCache(directory=None)
+    tree = HTMLParser(DOCUMENT).parse()
+    key = content_key(DOCUMENT)
+    cache.store(key, len(DOCUMENT), tree)
+    cache.flush()
+    # Styling the tree that was stored doesn't change the cached one
+    tree.style = {"color": "red"}
+    tree.children[1].children[0].attributes["class"] = "b"
+
+    first, second = cache.lookup(key), cache.lookup(key)
+    assert first is not None and second is not None and first is not second
+    assert stringify_tree(first) == stringify_tree(HTMLParser(DOCUMENT).parse())
+    assert first.style is EMPTY_STYLE
+    assert cache.lookup(content_key(DOCUMENT + " ")) is None
+    # The same bytes have the same key, however they were loaded
+    assert content_key(DOCUMENT) == content_key(DOCUMENT.encode("utf8"))
+
+
+def test_memory_tier_evicts_least_recently_used():
+    tree = HTMLParser(DOCUMENT).parse()
+    cache = DOMCache(memory_bytes=2 * tree_bytes(tree), directory=None)
+
+    cache.store("1", len(DOCUMENT), tree)
+    cache.store("2", len(DOCUMENT), tree)
+    cache.flush()
+    cache.lookup("1")
+    cache.store("3", len(DOCUMENT), tree)
+    cache.flush()
+
+    assert list(cache.memory) == ["1", "3"]
+    assert cache.memory_size == 2 * tree_bytes(tree)
+
+
+def test_memory_is_counted_in_tree_bytes():
+    tree = HTMLParser(DOCUMENT).parse()
+    # A node and its attributes take more memory than the markup they were parsed from
+    assert tree_bytes(tree) > 5 * len(DOCUMENT)
+    cache = DOMCache(memory_bytes=tree_bytes(tree) - 1, directory=None)
+    cache.store(content_key(DOCUMENT), len(DOCUMENT), tree)
+    cache.flush()
+    assert list(cache.memory) == []
+
+
+def test_large_documents_survive_a_restart(tmp_path):
+    # Deeper than the recursion limit, which the serialized form doesn't care about
+    document = "<div>" * 5000 + "deep" + "</div>" * 5000
+    tree = node = Element("div", {}, None)
+    for _ in range(4999):
+        node.children.append(Element("div", {}, node))
+        node = node.children[0]
+    node.children.append(Text("deep", node))
+    cache = DOMCache(disk_threshold=len(document), directory=str(tmp_path))
+    cache.store(content_key(document), len(document), tree)
+    cache.store(content_key(DOCUMENT), len(DOCUMENT), tree)
+    cache.flush()
+    # Only the large document was written to disk
+    assert len(list(tmp_path.glob("*.dom"))) == 1
+
+    cache = DOMCache(disk_threshold=len(document), directory=str(tmp_path))
+    loaded = cache.lookup(content_key(document))
+    cache.flush()
+    assert loaded is not None
+    node = loaded
+    for _ in range(5000):
+        assert node.tag == "div" and len(node.children) == 1
+        node = node.children[0]
+    assert node.text == "deep"
+    # It is in memory from now on
+    assert list(cache.memory) == [content_key(document)]
+
+
+def test_parse_reuses_the_tree():
+    cache = DOMCache(directory=None)
+    first = cache.parse(DOCUMENT)
+    cache.flush()
+    assert list(cache.memory) == [content_key(DOCUMENT)]
+    second = cache.parse(DOCUMENT)
+    assert second is not first and stringify_tree(second) == stringify_tree(first)
+    assert stringify_tree(clone_tree(first)) == stringify_tree(first)
+
+
+class RunsCodeWhenUnpickled:
+    def __reduce__(self):
+        return exec, ("import builtins; builtins.dom_cache_ran_code = True",)
+
+
+def test_unreadable_trees_are_dropped(tmp_path):
+    cache = DOMCache(disk_threshold=0, directory=str(tmp_path))
+    cache.store(content_key(DOCUMENT), len(DOCUMENT), HTMLParser(DOCUMENT).parse())
+    cache.flush()
+    # The trees on disk are plain JSON
+    (path,) = tmp_path.glob("*.dom")
+    assert json.loads(path.read_text())[0] == [-1, "html", {}]
+
+    # A file left in the cache directory is never run, whatever it contains
+    path.write_bytes(pickle.dumps(RunsCodeWhenUnpickled()))
+    cache = DOMCache(disk_threshold=0, directory=str(tmp_path))
+    assert cache.lookup(content_key(DOCUMENT)) is None
+    assert not hasattr(builtins, "dom_cache_ran_code")
+    assert list(tmp_path.glob("*.dom")) == []
+
+
+def test_store_returns_before_the_tree_is_copied():
+    cache = DOMCache(directory=None)
+    cache.writer.submit(time.sleep, 0.2)
+    tree = HTMLParser(DOCUMENT).parse()
+
+    start = time.perf_counter()
+    cache.store(content_key(DOCUMENT), len(DOCUMENT), tree)
+    assert time.perf_counter() - start < 0.1
+    assert cache.lookup(content_key(DOCUMENT)) is None
+
+    cache.flush()
+    assert cache.lookup(content_key(DOCUMENT)) is not None
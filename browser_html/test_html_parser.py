@@ -0,0 +1,194 @@
+import copy
+import html
+import random
+import pytest
+from browser_html.html_parser import HTMLParser
+from browser_html.html_nodes import EMPTY_CHILDREN, EMPTY_STYLE, Element, Text
+from utils.constants import SELF_CLOSING_TAGS
+from utils.utils import stringify_tree
+
+
+class CharacterParser(HTMLParser):
+    """
+    The parser as it used to be: its tokenizer visits one character at a time, and elements are only added
+    to their parent once they are closed. The current parser has to build the same trees.
+    """
+
+    def parse(self):
+        text = ""
+        in_tag = False
+        chunks = [self.body] if isinstance(self.body, str) else self.body
+        for chunk in chunks:
+            for c in chunk:
+                if c == "<":
+                    in_tag = True
+                    if text:
+                        self.parse_raw_text(html.unescape(text))
+                    text = ""
+                elif c == ">":
+                    in_tag = False
+                    self.parse_tag(text)
+                    text = ""
+                else:
+                    text += c
+        if not in_tag and text:
+            self.parse_raw_text(text)
+        return self.finish()
+
+    def parse_tag(self, tag_contents: str):
+        tag, attributes = self.get_attributes(tag_contents)
+        if tag.startswith("!"):
+            return
+        if tag.startswith("/"):
+            if len(self.unfinished) == 1:
+                return
+            node = self.unfinished.pop()
+            self.unfinished[-1].children.append(node)
+        elif tag in SELF_CLOSING_TAGS:
+            parent = self.unfinished[-1]
+            parent.children.append(Element(tag, attributes, parent))
+        else:
+            parent = self.unfinished[-1] if self.unfinished else None
+            self.unfinished.append(Element(tag, attributes, parent))
+
+    def finish(self):
+        if len(self.unfinished) == 0:
+            self.parse_tag("html")
+        while len(self.unfinished) > 1:
+            node = self.unfinished.pop()
+            self.unfinished[-1].children.append(node)
+        return self.unfinished.pop()
+
+
+DOCUMENTS = [
+    "<html><body><p>Hello</p></body></html>",
+    '<!doctype html><div class="a b" style="color: red;"><p>Fish &amp; chips</p><br><img src=x.png></div>',
+    "<p>Escaped &lt;tags&gt; and text</p> after the end &lt;",
+    "<p>Unfinished <b>tag<hr",
+    "<p>1 < 2 and 3 > 2</p>",
+    "<p><a href='/next'>next</a> text after &amp; trailing &amp;",
+    "<<>><p>empty tags</p></>",
+    "<p>\n   \n</p><pre>  spaced\n  lines  </pre>",
+]
+
+
+def split_randomly(text: str, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    cuts = sorted(rng.sample(range(1, len(text)), min(5, len(text) - 1)))
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_trees_match_the_character_tokenizer(document):
+    expected = stringify_tree(CharacterParser(document).parse())
+    assert stringify_tree(HTMLParser(document).parse()) == expected
+
+    # The chunks of a streamed body can end anywhere, including in the middle of a tag
+    for seed in range(5):
+        assert stringify_tree(HTMLParser(split_randomly(document, seed)).parse()) == expected
+    assert stringify_tree(HTMLParser(list(document)).parse()) == expected
+
+
+def test_parse_builds_the_tree():
+    tree = HTMLParser('<html><body><p class="intro">Hi <b>there</b></p><br></body></html>').parse()
+
+    body = tree.children[0]
+    paragraph, line_break = body.children
+    assert isinstance(paragraph, Element) and paragraph.attributes == {"class": "intro"}
+    assert [repr(child) for child in paragraph.children[:1]] == ["'Hi '"]
+    assert isinstance(paragraph.children[1].children[0], Text)
+    assert line_break.tag == "br" and line_break.children == []
+
+
+def test_fed_documents_grow_the_tree():
+    parser = HTMLParser()
+    links = []
+    parser.element_listeners.append(lambda element: links.append(element.attributes) if element.tag == "link" else None)
+
+    parser.feed('<html><head><link rel="stylesheet" hr')
+    assert links == []
+    parser.feed('ef="a.css"></head><body><p>Hel')
+    # The head is in the tree before the rest of the document has arrived
+    assert links == [{"rel": "stylesheet", "href": "a.css"}]
+    assert parser.tree is not None and [child.tag for child in parser.tree.children] == ["head", "body"]
+
+    parser.feed("lo</p>")
+    tree = parser.close()
+    assert tree is parser.tree
+    assert stringify_tree(tree) == stringify_tree(
+        CharacterParser('<html><head><link rel="stylesheet" href="a.css"></head><body><p>Hello</p>').parse()
+    )
+
+
+def test_raw_text_elements_are_not_tokenized():
+    document = (
+        "<html><head><style>p > a { color: red; }</style>"
+        '<script>if (a < b && c > d) { html = "<p>" + a + "</p>"; }</SCRIPT ></head>'
+        "<body><textarea>1 &lt; 2 <b>bold?</b></textarea><p>After</p></body></html>"
+    )
+    styles = []
+    parser = HTMLParser(document)
+    # Listeners get to the raw text elements once their contents are in
+    parser.element_listeners.append(lambda element: styles.append(element.children) if element.tag == "style" else None)
+    tree = parser.parse()
+
+    head, body = tree.children
+    style, script = head.children
+    assert [child.text for child in style.children] == ["p > a { color: red; }"] and styles == [style.children]
+    # Scripts aren't run, so their contents aren't kept
+    assert script.tag == "script" and script.children == []
+    textarea, paragraph = body.children
+    assert [child.text for child in textarea.children] == ["1 < 2 <b>bold?</b>"]
+    assert paragraph.children[0].text == "After"
+
+    # The close tag can be split between chunks, or never come
+    for seed in range(20):
+        assert stringify_tree(HTMLParser(split_randomly(document, seed)).parse()) == stringify_tree(tree)
+    assert stringify_tree(HTMLParser(list(document)).parse()) == stringify_tree(tree)
+    unclosed = HTMLParser("<p>Hi<style>a < b </styl").parse()
+    assert [child.text for child in unclosed.children[1].children] == ["a < b </styl"]
+
+
+@pytest.mark.parametrize(
+    "tag_contents, expected",
+    [
+        ('link rel="stylesheet" href="a.css"', ("link", {"rel": "stylesheet", "href": "a.css"})),
+        ("a title='Say \"hi\"' href=/page/1.html", ("a", {"title": 'Say "hi"', "href": "/page/1.html"})),
+        ('input disabled value="" TYPE = text', ("input", {"disabled": "", "value": "", "type": "text"})),
+        ('p style="color: red; font-size: 12px;"', ("p", {"style": "color: red; font-size: 12px;"})),
+        ("img src=x.png /", ("img", {"src": "x.png"})),
+        ("br/", ("br", {})),
+        ('a id="first" id="second" title="unterminated', ("a", {"id": "first", "title": "unterminated"})),
+        ("/div", ("/div", {})),
+        ("!-- a=b --", ("!--", {})),
+    ],
+)
+def test_get_attributes(tag_contents, expected):
+    assert HTMLParser().get_attributes(tag_contents) == expected
+
+
+def test_long_attributes_are_scanned_once():
+    # Splitting this tag with a lookahead regex took minutes
+    style = "color: red; " * 100_000
+    state = "a b " * 100_000
+    tag, attributes = HTMLParser().get_attributes(f"div style=\"{style}\" data-state='{state}' hidden")
+    assert tag == "div" and attributes == {"style": style, "data-state": state, "hidden": ""}
+
+
+def test_nodes_share_their_empty_parts():
+    tree = HTMLParser('<html><body><p class="a">One</p><p class="b">Two</p></body></html>').parse()
+    body = tree.children[0]
+    first, second = body.children
+    # No '__dict__' per node, and leaves don't have children (or a style) of their own
+    assert not hasattr(first, "__dict__") and not hasattr(first.children[0], "__dict__")
+    assert first.children[0].children is second.children[0].children is EMPTY_CHILDREN
+    assert first.style is second.children[0].style is EMPTY_STYLE
+    # Tag and attribute names are interned, so each is only stored once
+    assert first.tag is second.tag
+    assert next(iter(first.attributes)) is next(iter(second.attributes))
+
+    with pytest.raises(AssertionError):
+        first.style["color"] = "red"
+    # Copies keep sharing the same empty parts
+    clone = copy.deepcopy(first)
+    assert clone.style is EMPTY_STYLE and clone.children[0].children is EMPTY_CHILDREN
@@ -0,0 +1,38 @@
+import asyncio
+from typing import Any, Callable, Dict, Tuple
+from browser_network.fetch_scheduler import Priority, fetch_scheduler
+from browser_network.network import download, request
+from browser_network.request_timing import RequestTiming
+from browser_network.spill_file import MappedText
+
+
+async def async_fetch(priority: Priority, url: str, fn: Callable[..., Any], *args: Any, owner: Any = None) -> Any:
+    """
+    Awaits 'fn(*args)', a fetch of 'url'.
+
+    The sockets of the connection pool are blocking, so the fetch runs on a worker thread of the fetch scheduler,
+    in the order of its priority, while the event loop, and the Tk UI driving it, keeps running. The fetch can be
+    cancelled through the scheduler (with 'owner') until it starts.
+    """
+    return await asyncio.wrap_future(fetch_scheduler.submit(priority, url, fn, *args, owner=owner))
+
+
+async def async_request(
+    url: str, timing: RequestTiming | None = None, priority: Priority = Priority.LOW, owner: Any = None
+) -> Tuple[Dict[str, str], str | MappedText]:
+    """
+    The asyncio counterpart of 'request'.
+
+    The request goes through the same pooled HTTP/1.1 stack (connection pool, HTTP cache, chunked and
+    compressed bodies) as the blocking one.
+    """
+    return await async_fetch(priority, url, request, url, timing, owner=owner)
+
+
+async def async_download(
+    url: str, timing: RequestTiming | None = None, priority: Priority = Priority.LOW, owner: Any = None
+) -> Tuple[str, Dict[str, str], str | MappedText]:
+    """
+    The asyncio counterpart of 'download', which also returns the url the body was served from.
+    """
+    return await async_fetch(priority, url, download, url, timing, owner=owner)
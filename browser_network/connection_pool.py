@@ -0,0 +1,280 @@
+import socket
+import threading
+import time
+from typing import Tuple
+from browser_config import MAX_CONNECTIONS_PER_HOST, CONNECTION_IDLE_TIMEOUT, CONNECT_TIMEOUT, READ_TIMEOUT
+from browser_network.dns_cache import Address, DNSCache
+from browser_network.tls import TLSSessionCache
+from browser_network.request_timing import ConnectTimings
+from browser_network.timeouts import CONNECT, Deadline, NetworkTimeoutError
+from loguru import logger
+
+# scheme, host, port
+ConnectionKey = Tuple[str, str, int]
+
+
+class Connection:
+    """
+    A socket to a single origin that can carry several HTTP/1.1 requests one after the other.
+
+    The socket is wrapped in a binary file so that the response framing (status line, headers and
+    'Content-Length' bytes of body) can be read without losing bytes that belong to the next response.
+    """
+
+    def __init__(
+        self,
+        key: ConnectionKey,
+        sock: socket.socket,
+        connect_timings: ConnectTimings | None = None,
+        read_timeout: float | None = READ_TIMEOUT,
+    ) -> None:
+        self.key = key
+        self.sock = sock
+        # Seconds a single read waits for the server before giving up
+        self.read_timeout = read_timeout
+        self.file = sock.makefile("rb")
+        self.last_used = time.monotonic()
+        # Number of requests sent over this socket, a value above 0 means the socket was reused
+        self.requests_sent = 0
+        # How long opening the socket took, only set until the first request over it has been sent,
+        # since that request is the one that waited for the handshakes
+        self.connect_timings = connect_timings
+
+    @property
+    def is_reused(self) -> bool:
+        return self.requests_sent > 0
+
+    @property
+    def origin(self) -> str:
+        scheme, host, port = self.key
+        return f"{scheme}://{host}:{port}"
+
+    def arm(self, deadline: Deadline, url: str) -> float | None:
+        """
+        Sets the timeout of the next read, which is the read timeout unless the deadline is closer.
+        """
+        deadline.check(url)
+        timeout = deadline.limit(self.read_timeout)
+        self.sock.settimeout(timeout)
+        return timeout
+
+    def close(self) -> None:
+        try:
+            self.file.close()
+        finally:
+            self.sock.close()
+
+    def __repr__(self) -> str:
+        scheme, host, port = self.key
+        return f"< Connection {scheme}://{host}:{port} requests_sent={self.requests_sent} >"
+
+
+class ConnectionPool:
+    """
+    Keeps idle connections around so that requests to the same (scheme, host, port) can skip the
+    TCP (and TLS) handshake.
+
+    At most 'max_per_host' connections (idle and in use) are opened per origin, a caller that asks
+    for another one waits until a connection is released. Idle connections are closed once they
+    have not been used for 'idle_timeout' seconds, since servers drop them after a while anyway.
+
+    Opening a connection (including the TLS handshake) fails with a 'NetworkTimeoutError' after 'connect_timeout'
+    seconds, and reads from it after 'read_timeout' seconds.
+    """
+
+    def __init__(
+        self,
+        dns_cache: DNSCache | None = None,
+        tls: TLSSessionCache | None = None,
+        max_per_host: int = MAX_CONNECTIONS_PER_HOST,
+        idle_timeout: float = CONNECTION_IDLE_TIMEOUT,
+        connect_timeout: float | None = CONNECT_TIMEOUT,
+        read_timeout: float | None = READ_TIMEOUT,
+    ) -> None:
+        self.dns_cache = dns_cache if dns_cache is not None else DNSCache()
+        self.tls = tls if tls is not None else TLSSessionCache()
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle: dict[ConnectionKey, list[Connection]] = {}
+        self.open_count: dict[ConnectionKey, int] = {}
+        self.condition = threading.Condition()
+
+    def acquire(self, scheme: str, host: str, port: int, deadline: Deadline | None = None) -> Connection:
+        """
+        Waits for a connection until the 'deadline', after which a 'NetworkTimeoutError' is raised.
+        """
+        connection = self._acquire(scheme, host, port, deadline if deadline is not None else Deadline(None), wait=True)
+        assert connection is not None
+        return connection
+
+    def try_acquire(self, scheme: str, host: str, port: int, deadline: Deadline | None = None) -> Connection | None:
+        """
+        Returns a connection only if one is free right away (an idle one, or the origin is under 'max_per_host'),
+        without waiting for one to be released. The 'deadline' still bounds opening a new connection.
+        """
+        return self._acquire(scheme, host, port, deadline if deadline is not None else Deadline(None), wait=False)
+
+    def _acquire(self, scheme: str, host: str, port: int, deadline: Deadline, wait: bool) -> Connection | None:
+        key = (scheme, host, port)
+        with self.condition:
+            while True:
+                self._close_expired(key)
+                idle = self.idle.get(key)
+                if idle:
+                    # Reuse the most recently released connection, the server is the least likely to have dropped it
+                    connection = idle.pop()
+                    logger.debug(f"Reusing {connection}")
+                    return connection
+                if self.open_count.get(key, 0) < self.max_per_host:
+                    self.open_count[key] = self.open_count.get(key, 0) + 1
+                    break
+                if not wait:
+                    return None
+                deadline.check(f"{scheme}://{host}:{port}")
+                self.condition.wait(deadline.remaining())
+
+        # Connect outside of the lock, so that a slow handshake doesn't block requests to other hosts
+        try:
+            connection = self.connect(scheme, host, port, deadline.limit(self.connect_timeout))
+        except BaseException as e:
+            with self.condition:
+                self.open_count[key] -= 1
+                self.condition.notify_all()
+            if isinstance(e, NetworkTimeoutError):
+                raise deadline.timeout_error(e.url, CONNECT, self.connect_timeout) from e
+            raise
+
+        logger.debug(f"Opened a new connection to {scheme}://{host}:{port}")
+        return connection
+
+    def preconnect(self, scheme: str, host: str, port: int) -> None:
+        """
+        Opens a connection ahead of time and parks it in the pool, unless there already is an idle one.
+        """
+        key = (scheme, host, port)
+        with self.condition:
+            self._close_expired(key)
+            if self.idle.get(key) or self.open_count.get(key, 0) >= self.max_per_host:
+                return
+            self.open_count[key] = self.open_count.get(key, 0) + 1
+
+        try:
+            connection = self.connect(scheme, host, port)
+        except BaseException:
+            with self.condition:
+                self.open_count[key] -= 1
+                self.condition.notify_all()
+            raise
+
+        # The handshakes happened ahead of time, the request that ends up using the connection didn't wait for them
+        connection.connect_timings = None
+        logger.debug(f"Preconnected to {scheme}://{host}:{port}")
+        with self.condition:
+            self.idle.setdefault(key, []).append(connection)
+            self.condition.notify_all()
+
+    def release(self, connection: Connection, reusable: bool) -> None:
+        """
+        Returns a connection to the pool once its response has been fully read. Connections that can't
+        carry another request (ex. the server sent 'Connection: close') are closed instead.
+        """
+        connection.requests_sent += 1
+        connection.connect_timings = None
+        scheme, host, port = connection.key
+        if scheme == "https":
+            self.tls.remember(connection.sock, host, port)
+
+        with self.condition:
+            if reusable:
+                connection.last_used = time.monotonic()
+                self.idle.setdefault(connection.key, []).append(connection)
+            else:
+                connection.close()
+                self.open_count[connection.key] -= 1
+            self.condition.notify_all()
+
+    def connect(self, scheme: str, host: str, port: int, timeout: float | None = None) -> Connection:
+        """
+        Opens a new connection, timing the DNS lookup, the TCP handshake and the TLS handshake separately.
+        The handshakes have to be done within 'timeout' seconds (by default the pool's 'connect_timeout').
+        """
+        timeout = timeout if timeout is not None else self.connect_timeout
+        start = time.perf_counter()
+        addresses = self.dns_cache.resolve(host, port)
+        resolved = time.perf_counter()
+        try:
+            s = self.connect_tcp(host, port, addresses, timeout)
+        except TimeoutError as e:
+            raise NetworkTimeoutError(f"{scheme}://{host}:{port}", CONNECT, timeout or 0) from e
+        connected = time.perf_counter()
+        tls_seconds = None
+        try:
+            if scheme == "https":
+                s = self.tls.wrap(s, host, port)
+                tls_seconds = time.perf_counter() - connected
+            s.settimeout(self.read_timeout)
+        except TimeoutError as e:
+            s.close()
+            raise NetworkTimeoutError(f"{scheme}://{host}:{port}", CONNECT, timeout or 0) from e
+        except BaseException:
+            s.close()
+            raise
+        connect_timings = ConnectTimings(resolved - start, connected - resolved, tls_seconds)
+        return Connection((scheme, host, port), s, connect_timings, self.read_timeout)
+
+    def connect_tcp(
+        self, host: str, port: int, addresses: list[Address] | None = None, timeout: float | None = None
+    ) -> socket.socket:
+        """
+        Connects to the first address (from the DNS cache, unless the 'addresses' were already resolved)
+        of the host that accepts the connection.
+        """
+        if addresses is None:
+            addresses = self.dns_cache.resolve(host, port)
+        assert addresses, f"No addresses found for {host}"
+
+        error: OSError | None = None
+        for family, address in addresses:
+            s = socket.socket(family=family, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP)
+            s.settimeout(timeout)
+            try:
+                s.connect(address)
+                return s
+            except OSError as e:
+                s.close()
+                error = e
+            except BaseException:
+                s.close()
+                raise
+        assert error is not None
+        raise error
+
+    def close_all(self) -> None:
+        with self.condition:
+            for key, connections in self.idle.items():
+                for connection in connections:
+                    connection.close()
+                self.open_count[key] -= len(connections)
+            self.idle.clear()
+            self.condition.notify_all()
+
+    def _close_expired(self, key: ConnectionKey) -> None:
+        """
+        Must be called while holding 'self.condition'.
+        """
+        idle = self.idle.get(key)
+        if not idle:
+            return
+
+        now = time.monotonic()
+        alive = []
+        for connection in idle:
+            if now - connection.last_used > self.idle_timeout:
+                logger.debug(f"Closing idle {connection}")
+                connection.close()
+                self.open_count[key] -= 1
+            else:
+                alive.append(connection)
+        self.idle[key] = alive
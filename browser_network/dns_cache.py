@@ -0,0 +1,72 @@
+import socket
+import threading
+import time
+from typing import Any, Callable, List, Tuple
+from browser_config import DNS_CACHE_TTL, DNS_NEGATIVE_TTL
+from loguru import logger
+
+# family, sockaddr (ex. (AF_INET, ("93.184.216.34", 80)))
+Address = Tuple[socket.AddressFamily, Tuple[Any, ...]]
+# Same signature and return value as 'socket.getaddrinfo(host, port)'
+Resolver = Callable[[str, int], List[Tuple[Any, ...]]]
+
+
+def system_resolver(host: str, port: int) -> List[Tuple[Any, ...]]:
+    return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP)
+
+
+class DNSCache:
+    """
+    Remembers the addresses a host name resolved to, so that the system resolver is only asked
+    once per 'ttl' seconds for a host, instead of once per request.
+
+    'getaddrinfo' doesn't expose the TTL of the DNS records, so every successful lookup is kept
+    for the same amount of time. Failed lookups are remembered as well, for the (shorter) 'negative_ttl',
+    so that a page full of resources on a host that doesn't exist fails fast.
+
+    The resolver and the clock can be swapped out, which allows testing without network access.
+    """
+
+    def __init__(
+        self,
+        resolver: Resolver = system_resolver,
+        ttl: float = DNS_CACHE_TTL,
+        negative_ttl: float = DNS_NEGATIVE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.resolver = resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (host, port) -> (expires_at, addresses or the error the lookup failed with)
+        self.entries: dict[Tuple[str, int], Tuple[float, List[Address] | OSError]] = {}
+
+    def resolve(self, host: str, port: int) -> List[Address]:
+        key = (host, port)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if self.clock() < expires_at:
+                if isinstance(result, OSError):
+                    raise result
+                return result
+
+        # Resolve outside of the lock, a slow lookup shouldn't block lookups of other hosts
+        try:
+            addresses = [(info[0], info[4]) for info in self.resolver(host, port)]
+        except OSError as e:
+            logger.debug(f"Failed to resolve {host}: {e}")
+            with self.lock:
+                self.entries[key] = (self.clock() + self.negative_ttl, e)
+            raise
+
+        logger.debug(f"Resolved {host} to {addresses}")
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, addresses)
+        return addresses
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,191 @@
+import itertools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import IntEnum
+from typing import Any, Callable, Hashable
+from browser_config import FETCH_MAX_TOTAL, FETCH_MAX_PER_HOST, FETCH_MAX_LOW_PRIORITY
+from browser_network import network
+from browser_network.local_urls import is_local_url, url_scheme
+from loguru import logger
+
+
+class Priority(IntEnum):
+    """
+    Fetches with a lower value are started first.
+    """
+
+    # The document being navigated to
+    DOCUMENT = 0
+    # Stylesheets, the page can't be rendered until they are loaded
+    RENDER_BLOCKING = 1
+    # Resources the page doesn't need to render (ex. images and preloads)
+    LOW = 2
+    # Resources that may never be used (ex. prefetches and speculatively loaded documents)
+    SPECULATIVE = 3
+
+
+class ScheduledFetch:
+    def __init__(
+        self,
+        priority: Priority,
+        sequence: int,
+        origin: Hashable,
+        fn: Callable[..., Any],
+        args: tuple,
+        owner: Any,
+    ) -> None:
+        self.priority = priority
+        # Fetches of the same priority start in the order they were submitted
+        self.sequence = sequence
+        self.origin = origin
+        self.fn = fn
+        self.args = args
+        self.owner = owner
+        self.future: Future = Future()
+
+    @property
+    def is_critical(self) -> bool:
+        return self.priority <= Priority.RENDER_BLOCKING
+
+    def __lt__(self, other: "ScheduledFetch") -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def __repr__(self) -> str:
+        return f"< ScheduledFetch {self.priority.name} origin={self.origin} >"
+
+
+class FetchScheduler:
+    """
+    Decides when each fetch gets to run, so that what the current page needs to render is never stuck
+    behind work that may turn out to be useless.
+
+    Queued fetches are started in priority order (then submission order), while at most 'max_total' fetches
+    run at the same time, and at most 'max_per_host' of them to the same origin (which matches the number of
+    connections the pool opens per origin, so a started fetch never waits on the pool).
+
+    Fetches that are not critical (below 'Priority.RENDER_BLOCKING') are further limited to 'max_low_priority'
+    at the same time, and never take the last free slot of an origin, so a document or stylesheet that
+    arrives while they are running can always start right away.
+
+    A fetch is submitted on behalf of an 'owner' (ex. a tab), 'cancel' drops every queued fetch of an owner
+    when it navigates away. Fetches that already started run to completion.
+    """
+
+    def __init__(
+        self,
+        max_total: int = FETCH_MAX_TOTAL,
+        max_per_host: int = FETCH_MAX_PER_HOST,
+        max_low_priority: int = FETCH_MAX_LOW_PRIORITY,
+    ) -> None:
+        assert max_low_priority < max_total, "Some slots have to be left for the critical fetches"
+        self.max_total = max_total
+        self.max_per_host = max_per_host
+        self.max_low_priority = max_low_priority
+        self.executor = ThreadPoolExecutor(max_workers=max_total, thread_name_prefix="fetch")
+        self.lock = threading.Lock()
+        self.queue: list[ScheduledFetch] = []
+        self.sequence = itertools.count()
+        self.running = 0
+        self.running_low_priority = 0
+        self.running_per_origin: dict[Hashable, int] = {}
+
+    def submit(self, priority: Priority, url: str, fn: Callable[..., Any], *args: Any, owner: Any = None) -> Future:
+        """
+        Queues 'fn(*args)', a fetch of 'url', and returns the future of its result.
+        """
+        try:
+            origin = self.origin(url)
+        except Exception as e:
+            future: Future = Future()
+            future.set_exception(e)
+            return future
+
+        fetch = ScheduledFetch(priority, next(self.sequence), origin, fn, args, owner)
+        with self.lock:
+            self.queue.append(fetch)
+            self._dispatch()
+        return fetch.future
+
+    def cancel(self, owner: Any) -> int:
+        """
+        Cancels the queued fetches of the owner, and returns how many were cancelled.
+        """
+        with self.lock:
+            cancelled = [fetch for fetch in self.queue if fetch.owner is owner]
+            self.queue = [fetch for fetch in self.queue if fetch.owner is not owner]
+        for fetch in cancelled:
+            fetch.future.cancel()
+        if cancelled:
+            logger.debug(f"Cancelled {len(cancelled)} queued fetches of {owner}")
+        return len(cancelled)
+
+    @staticmethod
+    def origin(url: str) -> Hashable:
+        """
+        The fetches of an origin are limited together. Local urls don't use connections, the ones of the
+        same scheme are counted as one origin so that they don't take every slot either.
+        """
+        if is_local_url(url):
+            return (url_scheme(url), "", 0)
+        scheme, host, port, path = network.parse_url(url)
+        return (scheme, host, port)
+
+    @property
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.queue)
+
+    def _can_start(self, fetch: ScheduledFetch) -> bool:
+        """
+        Must be called while holding 'self.lock'.
+        """
+        if self.running >= self.max_total:
+            return False
+        running_to_origin = self.running_per_origin.get(fetch.origin, 0)
+        if fetch.is_critical:
+            return running_to_origin < self.max_per_host
+        return self.running_low_priority < self.max_low_priority and running_to_origin < max(self.max_per_host - 1, 1)
+
+    def _dispatch(self) -> None:
+        """
+        Starts every queued fetch that fits within the limits, highest priority first. Must be called
+        while holding 'self.lock'.
+        """
+        waiting = []
+        for fetch in sorted(self.queue):
+            # Cancelled through its future (ex. by the speculative loader)
+            if fetch.future.cancelled():
+                continue
+            if not self._can_start(fetch):
+                waiting.append(fetch)
+                continue
+
+            self.running += 1
+            self.running_per_origin[fetch.origin] = self.running_per_origin.get(fetch.origin, 0) + 1
+            if not fetch.is_critical:
+                self.running_low_priority += 1
+            self.executor.submit(self._run, fetch)
+        self.queue = waiting
+
+    def _run(self, fetch: ScheduledFetch) -> None:
+        try:
+            if fetch.future.set_running_or_notify_cancel():
+                try:
+                    result = fetch.fn(*fetch.args)
+                except BaseException as e:
+                    fetch.future.set_exception(e)
+                else:
+                    fetch.future.set_result(result)
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.running_per_origin[fetch.origin] -= 1
+                if not self.running_per_origin[fetch.origin]:
+                    del self.running_per_origin[fetch.origin]
+                if not fetch.is_critical:
+                    self.running_low_priority -= 1
+                self._dispatch()
+
+
+# Shared by every tab, so that the limits apply to the whole browser
+fetch_scheduler = FetchScheduler()
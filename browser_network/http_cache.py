@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict
+from browser_config import HTTP_CACHE_MEMORY_BYTES, HTTP_CACHE_DISK_BYTES, HTTP_CACHE_DIRECTORY
+from utils.disk_lru import DiskLRU
+from loguru import logger
+
+# Headers that describe how the body was sent over the wire, they don't apply to the decoded body that is cached
+HOP_BY_HOP_HEADERS = ["content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"]
+
+
+def parse_cache_control(value: str) -> Dict[str, str]:
+    """
+    'Cache-Control: max-age=60, must-revalidate' -> {"max-age": "60", "must-revalidate": ""}
+    """
+    directives = {}
+    for directive in value.split(","):
+        directive = directive.strip()
+        if not directive:
+            continue
+        if "=" in directive:
+            name, argument = directive.split("=", 1)
+            directives[name.strip().lower()] = argument.strip().strip('"')
+        else:
+            directives[directive.lower()] = ""
+    return directives
+
+
+class CacheEntry:
+    """
+    A stored response. 'body' is the decoded body (after any 'Content-Encoding' has been removed).
+
+    'max_age' is the number of seconds after 'stored_at' during which the entry can be used without asking
+    the server, after that it has to be revalidated using its validators ('ETag' and 'Last-Modified').
+    """
+
+    def __init__(self, url: str, headers: Dict[str, str], body: bytes, stored_at: float, max_age: float) -> None:
+        self.url = url
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+        self.max_age = max_age
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+    def is_fresh(self, now: float) -> bool:
+        return now - self.stored_at < self.max_age
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """
+        The request headers that let the server answer '304 Not Modified' instead of resending the body.
+        """
+        headers = {}
+        if "etag" in self.headers:
+            headers["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["last-modified"]
+        return headers
+
+    def metadata(self) -> dict:
+        return {"url": self.url, "headers": self.headers, "stored_at": self.stored_at, "max_age": self.max_age}
+
+    def __repr__(self) -> str:
+        return f"< CacheEntry url={self.url} size={self.size} max_age={self.max_age} >"
+
+
+class HTTPCache:
+    """
+    A two tier HTTP cache: recently used entries are kept in an in-memory LRU, and every entry is also
+    written to disk, so that it survives the entry being evicted from memory (or the browser being restarted).
+
+    Both tiers are bounded by the number of body bytes they hold, and evict the least recently used
+    entries first. Only successful responses that allow it ('no-store') and that can either be reused
+    for a while ('max-age') or be revalidated ('ETag', 'Last-Modified') are stored.
+    """
+
+    def __init__(
+        self,
+        memory_bytes: int = HTTP_CACHE_MEMORY_BYTES,
+        disk_bytes: int = HTTP_CACHE_DISK_BYTES,
+        directory: str | None = HTTP_CACHE_DIRECTORY,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.memory_bytes = memory_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        self.memory: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.memory_size = 0
+        # Counted in body bytes, the metadata is small
+        self.disk = DiskLRU(directory, disk_bytes, [".body", ".json"]) if directory is not None else None
+
+    def lookup(self, url: str) -> CacheEntry | None:
+        with self.lock:
+            entry = self.memory.get(url)
+            if entry is not None:
+                self.memory.move_to_end(url)
+                return entry
+
+            entry = self._read_from_disk(url)
+            if entry is not None:
+                self._store_in_memory(entry)
+            return entry
+
+    def store(self, url: str, headers: Dict[str, str], body: bytes) -> CacheEntry | None:
+        """
+        Stores a '200 OK' response, unless its headers say it shouldn't be stored.
+        """
+        max_age = self._max_age(headers)
+        if max_age is None:
+            return None
+
+        headers = {name: value for name, value in headers.items() if name not in HOP_BY_HOP_HEADERS}
+        entry = CacheEntry(url, headers, body, self.clock(), max_age)
+        with self.lock:
+            self._store_in_memory(entry)
+            self._write_to_disk(entry)
+        logger.debug(f"Stored {entry}")
+        return entry
+
+    def refresh(self, entry: CacheEntry, headers: Dict[str, str]) -> CacheEntry:
+        """
+        Updates an entry after the server answered a conditional request with '304 Not Modified'.
+        """
+        updated = {name: value for name, value in headers.items() if name not in HOP_BY_HOP_HEADERS}
+        merged = {**entry.headers, **updated}
+        max_age = self._max_age(merged)
+        refreshed = CacheEntry(entry.url, merged, entry.body, self.clock(), max_age if max_age is not None else 0)
+        with self.lock:
+            if max_age is None:
+                self._remove(entry.url)
+            else:
+                self._store_in_memory(refreshed)
+                self._write_to_disk(refreshed)
+        logger.debug(f"Revalidated {refreshed}")
+        return refreshed
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return entry.is_fresh(self.clock())
+
+    def clear(self) -> None:
+        with self.lock:
+            for url in list(self.memory):
+                self._remove(url)
+            if self.disk is not None:
+                self.disk.clear()
+
+    def _max_age(self, headers: Dict[str, str]) -> float | None:
+        """
+        Returns for how many seconds the response can be used without revalidation, or 'None' if it can't be stored.
+        """
+        directives = parse_cache_control(headers.get("cache-control", ""))
+        if "no-store" in directives:
+            return None
+
+        has_validator = "etag" in headers or "last-modified" in headers
+        if "no-cache" in directives:
+            return 0 if has_validator else None
+
+        if "max-age" in directives:
+            try:
+                return max(float(directives["max-age"]), 0)
+            except ValueError:
+                pass
+
+        # Without an explicit lifetime the entry is only useful if it can be revalidated
+        return 0 if has_validator else None
+
+    # The methods below must be called while holding 'self.lock'
+
+    def _store_in_memory(self, entry: CacheEntry) -> None:
+        self._remove_from_memory(entry.url)
+        # An entry that doesn't fit in memory is only kept on disk
+        if entry.size > self.memory_bytes:
+            return
+
+        self.memory[entry.url] = entry
+        self.memory_size += entry.size
+        while self.memory_size > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= evicted.size
+
+    def _remove_from_memory(self, url: str) -> None:
+        entry = self.memory.pop(url, None)
+        if entry is not None:
+            self.memory_size -= entry.size
+
+    def _remove(self, url: str) -> None:
+        self._remove_from_memory(url)
+        if self.disk is not None:
+            self.disk.remove(self._disk_key(url))
+
+    def _disk_key(self, url: str) -> str:
+        return hashlib.sha256(url.encode("utf8")).hexdigest()
+
+    def _read_from_disk(self, url: str) -> CacheEntry | None:
+        key = self._disk_key(url)
+        if self.disk is None or key not in self.disk:
+            return None
+
+        body_path, metadata_path = self.disk.paths(key)
+        try:
+            with open(metadata_path, "r") as file:
+                metadata = json.load(file)
+            with open(body_path, "rb") as file:
+                body = file.read()
+            self.disk.touch(key)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Dropping unreadable cache entry for {url}: {e}")
+            self.disk.remove(key)
+            return None
+
+        return CacheEntry(metadata["url"], metadata["headers"], body, metadata["stored_at"], metadata["max_age"])
+
+    def _write_to_disk(self, entry: CacheEntry) -> None:
+        if self.disk is None or entry.size > self.disk.max_bytes:
+            return
+
+        key = self._disk_key(entry.url)
+        self.disk.remove(key)
+        body_path, metadata_path = self.disk.paths(key)
+        try:
+            os.makedirs(self.disk.directory, exist_ok=True)
+            # Write to temporary files first, so that a crash never leaves a half written entry behind
+            with open(body_path + ".tmp", "wb") as file:
+                file.write(entry.body)
+            with open(metadata_path + ".tmp", "w") as file:
+                json.dump(entry.metadata(), file)
+            os.replace(metadata_path + ".tmp", metadata_path)
+            os.replace(body_path + ".tmp", body_path)
+        except OSError as e:
+            logger.debug(f"Failed to write cache entry for {entry.url}: {e}")
+            return
+
+        self.disk.add(key, entry.size)
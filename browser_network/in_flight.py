@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import Future
+from typing import Dict, Tuple
+
+# The url (after redirects), the headers and the decoded body of a completed response
+SharedResult = Tuple[str, Dict[str, str], bytes]
+
+
+class InFlightRequests:
+    """
+    Tracks the requests that are currently being downloaded, so that concurrent fetches of the same
+    url (ex. several tabs loading the same site's stylesheet) share one network operation.
+
+    The first caller for a url becomes its leader and performs the request. Every caller that arrives
+    while the leader's download is still in flight waits on the same future and gets the leader's result,
+    or an error if the leader can't share it (then it makes its own request).
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests: dict[str, "Future[SharedResult]"] = {}
+
+    def join(self, url: str) -> Tuple["Future[SharedResult]", bool]:
+        """
+        Returns the future of the request for the url and whether the caller is its leader (and has to perform it).
+        """
+        with self.lock:
+            future = self.requests.get(url)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.requests[url] = future
+            return future, True
+
+    def finish(self, url: str, future: "Future[SharedResult]", result: SharedResult) -> None:
+        self._remove(url, future)
+        future.set_result(result)
+
+    def fail(self, url: str, future: "Future[SharedResult]", exception: BaseException) -> None:
+        self._remove(url, future)
+        future.set_exception(exception)
+
+    def _remove(self, url: str, future: "Future[SharedResult]") -> None:
+        with self.lock:
+            if self.requests.get(url) is future:
+                del self.requests[url]
@@ -0,0 +1,106 @@
+import base64
+import mimetypes
+import mmap
+import os
+from typing import Dict, Tuple
+from urllib.parse import unquote_to_bytes
+from urllib.request import pathname2url, url2pathname
+from browser_network.request_timing import RequestTiming
+from browser_network.response import Response
+from loguru import logger
+
+# Urls that are answered without going over the network
+LOCAL_SCHEMES = ["file", "data"]
+
+# The media type of a 'data:' url that doesn't declare one
+DEFAULT_DATA_MEDIA_TYPE = "text/plain;charset=US-ASCII"
+
+
+def url_scheme(url: str) -> str:
+    return url.split(":", 1)[0].lower() if ":" in url else ""
+
+
+def is_local_url(url: str) -> bool:
+    return url_scheme(url) in LOCAL_SCHEMES
+
+
+def file_url(file_name: str) -> str:
+    """
+    './examples/parse.html' -> 'file:///<current directory>/examples/parse.html'
+    """
+    return "file://" + pathname2url(os.path.abspath(file_name))
+
+
+def file_path(url: str) -> str:
+    """
+    'file:///home/user/my%20page.html' -> '/home/user/my page.html'
+    """
+    assert url_scheme(url) == "file", f"Not a file url: {url}"
+    location = url.split(":", 1)[1]
+    assert location.startswith("//"), f"Malformed file url: {url}"
+    host, _, path = location[2:].partition("/")
+    assert host in ["", "localhost"], f"Only local files can be loaded, received {url}"
+    # The query and the fragment are not part of the file name
+    path = path.split("#", 1)[0].split("?", 1)[0]
+    return url2pathname("/" + path)
+
+
+def parse_data_url(url: str) -> Tuple[Dict[str, str], bytes]:
+    """
+    Url structure:
+        data:[<media type>][;base64],<data>
+        data:text/css,p%20%7B%20color%3A%20red%3B%20%7D
+        data:text/html;charset=utf-8;base64,PHA+SGk8L3A+
+
+    Returns the headers the body would have been served with, and the body.
+    """
+    assert url_scheme(url) == "data", f"Not a data url: {url[:64]}"
+    metadata, separator, data = url.split(":", 1)[1].partition(",")
+    assert separator, f"Malformed data url, it has no ',': {url[:64]}"
+
+    parameters = [parameter.strip() for parameter in metadata.split(";")]
+    is_base64 = len(parameters) > 1 and parameters[-1].lower() == "base64"
+    if is_base64:
+        parameters.pop()
+    media_type = ";".join(parameters)
+    if not media_type:
+        media_type = DEFAULT_DATA_MEDIA_TYPE
+    # Only parameters (ex. 'data:;charset=utf-8,...'), the type defaults to plain text
+    elif media_type.startswith(";"):
+        media_type = "text/plain" + media_type
+
+    body = unquote_to_bytes(data)
+    if is_base64:
+        body = base64.b64decode(body)
+    return {"content-type": media_type, "content-length": str(len(body))}, body
+
+
+def open_local(url: str, timing: RequestTiming | None = None) -> Response:
+    """
+    Answers a 'file:' or 'data:' url with a response that has its whole body, so it can be read the same
+    ways as a network response.
+
+    A file is memory-mapped instead of being read, so the parts of a large file are only paged in
+    as they are parsed (see 'Response.read_text'), rather than being copied into memory up front.
+    """
+    scheme = url_scheme(url)
+    assert scheme in LOCAL_SCHEMES, f"Not a local url: {url}"
+    if scheme == "data":
+        headers, body = parse_data_url(url)
+        response = Response(url, "200", "OK", headers, body=body, timing=timing)
+    else:
+        path = file_path(url)
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            # An empty file can't be mapped. The map stays valid once the file is closed
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        headers = {"content-length": str(size)}
+        content_type, _ = mimetypes.guess_type(path)
+        if content_type is not None:
+            headers["content-type"] = content_type
+        logger.debug(f"Mapped {size} bytes of {path}")
+        response = Response(url, "200", "OK", headers, body=mapped, timing=timing)
+
+    if timing is not None:
+        timing.source = scheme
+    return response
@@ -1,16 +1,56 @@
-import socket
-import ssl
 import json
+import select
+import ssl
+import time
+from typing import Dict, Tuple
+from browser_config import MAX_REDIRECTS, REQUEST_TIMEOUT
+from browser_network.connection_pool import Connection, ConnectionPool
+from browser_network.dns_cache import DNSCache
+from browser_network.tls import TLSSessionCache
+from browser_network.http_cache import HTTPCache
+from browser_network.in_flight import InFlightRequests
+from browser_network.local_urls import is_local_url, open_local
+from browser_network.preload_cache import PreloadCache
+from browser_network.redirect_cache import RedirectCache
+from browser_network.request_timing import RequestTiming
+from browser_network.response import Response, SUPPORTED_CONTENT_ENCODINGS, parse_headers
+from browser_network.spill_file import MappedText
+from browser_network.timeouts import READ, TOTAL, Deadline, HedgingPolicy, NetworkTimeoutError
 from loguru import logger
 
+# Shared by every tab, so that a host is resolved once for all the resources that are fetched from it
+dns_cache = DNSCache()
+# Shared by every tab, so that reconnecting to a host resumes the previous TLS session
+tls_sessions = TLSSessionCache()
+# Shared by every tab, so that all requests to the same host can reuse the same connections
+pool = ConnectionPool(dns_cache, tls_sessions)
+# Shared by every tab, so that a stylesheet used across a site is only downloaded once
+cache = HTTPCache()
+# Responses fetched ahead of time because of '<link rel=preload>' and '<link rel=prefetch>'
+preloaded = PreloadCache()
+# Shared by every tab, so that tabs loading the same url at the same time share a single download
+in_flight = InFlightRequests()
+# Shared by every tab, so that a url that has moved permanently is only requested at its new location
+redirects = RedirectCache()
+# Shared by every tab, so that the hedging delay of an origin is based on all the requests made to it
+hedging = HedgingPolicy()
+
+REDIRECT_STATUSES = ["301", "302", "303", "307", "308"]
+# Redirects that apply to every later request for the url, not just this one
+PERMANENT_REDIRECT_STATUSES = ["301", "308"]
+
 
 def resolve_url(relative_url: str, host_url: str) -> str:
     """
     Converts a relative URL into a full URL.
     """
-    # Full URL
-    if "://" in relative_url:
+    # Full URL, 'data:' urls have no '//'
+    if "://" in relative_url or relative_url.startswith("data:"):
         return relative_url
+    # A scheme-relative URL, reuses the same scheme, starts with '//'
+    elif relative_url.startswith("//"):
+        scheme, _ = host_url.split("://", 1)
+        return scheme + ":" + relative_url
     # A host-relative URL, reuses the same scheme and host, starts with a '/'
     elif relative_url.startswith("/"):
         scheme, hostpath = host_url.split("://", 1)
@@ -62,50 +102,412 @@ def parse_url(url: str):
     return scheme, host, port, path
 
 
-def request(url: str):
+def request(url: str, timing: RequestTiming | None = None, timeout: float | None = REQUEST_TIMEOUT):
     """
     Url structure:
         Scheme://Hostname:Port/Path
         http://example.org:8080/index.html
+
+    Requests are sent as HTTP/1.1 over a pooled connection, so that fetching several resources from
+    the same host (ex. the stylesheets of a page) reuses a warm socket instead of reconnecting.
+
+    When a 'timing' is given, it is filled in with where the time of the request went (see 'RequestTiming').
+    A request that isn't done within 'timeout' seconds fails with a 'NetworkTimeoutError'.
+    """
+    final_url, headers, body = download(url, timing, timeout)
+    return headers, body
+
+
+def download(
+    url: str, timing: RequestTiming | None = None, timeout: float | None = REQUEST_TIMEOUT
+) -> Tuple[str, Dict[str, str], str | MappedText]:
+    """
+    Like 'request', but also returns the url the body was served from, which is not 'url' if the request was redirected.
+
+    Bodies larger than 'SPILL_THRESHOLD_BYTES' are returned as a 'MappedText' (see 'Response.read_text').
+    """
+    with stream(url, timing, timeout) as response:
+        body = response.read_text()
+
+    logger.debug(f"\nBody: {body}\n")
+
+    return response.url, response.headers, body
+
+
+def stream(url: str, timing: RequestTiming | None = None, timeout: float | None = REQUEST_TIMEOUT) -> Response:
+    """
+    Sends the request and returns as soon as the status line and headers have been read, the body
+    can then be consumed as it arrives with 'Response.iter_bytes' or 'Response.iter_text'.
+
+    The 'timeout' covers the whole request, reading the body included.
+
+    'file:' and 'data:' urls are answered locally (see 'open_local'), without the caches in front of the network.
+    """
+    try:
+        if is_local_url(url):
+            return open_local(url, timing)
+        return join_or_fetch(url, timing, Deadline(timeout))
+    except BaseException as e:
+        if timing is not None:
+            timing.fail(e)
+        raise
+
+
+def join_or_fetch(url: str, timing: RequestTiming | None, deadline: Deadline) -> Response:
+    """
+    If the same url is already being downloaded, this waits for that download and returns its result
+    instead of sending another request.
+
+    Only bodies of at most 'SPILL_THRESHOLD_BYTES' are shared, since the leader would have to keep a larger
+    one for the requests waiting on it. Those are told as soon as the body turns out to be larger, and
+    download it on their own.
+    """
+    future, is_leader = in_flight.join(url)
+    if not is_leader:
+        logger.debug(f"Waiting for the in-flight request of {url}")
+        try:
+            final_url, headers, body = future.result(deadline.remaining())
+        except Exception as e:
+            if not future.done():
+                assert deadline.seconds is not None
+                raise NetworkTimeoutError(url, TOTAL, deadline.seconds) from e
+            # The failure may be specific to the leader (ex. it stopped reading the body), so retry separately
+            logger.debug(f"In-flight request of {url} failed, fetching it again: {e}")
+            return fetch(url, timing, deadline)
+        if timing is not None:
+            timing.source = "in-flight"
+        return Response(final_url, "200", "OK", dict(headers), body=body, timing=timing)
+
+    try:
+        response = fetch(url, timing, deadline)
+    except BaseException as e:
+        in_flight.fail(url, future, e)
+        raise
+
+    if response.body is not None:
+        in_flight.finish(url, future, (response.url, response.headers, response.body))
+    else:
+        response.completion_listeners.append(
+            lambda body: in_flight.finish(url, future, (response.url, response.headers, body))
+        )
+        response.abandon_listeners.append(
+            lambda: in_flight.fail(url, future, ConnectionAbortedError(f"The body of {url} was not kept"))
+        )
+    return response
+
+
+def fetch(url: str, timing: RequestTiming | None = None, deadline: Deadline | None = None) -> Response:
+    """
+    Follows redirects (at most 'MAX_REDIRECTS' of them), the 'url' of the returned response is the one
+    its body was served from. Permanent redirects are remembered, so the next request for the same url
+    goes straight to where it moved.
+    """
+    deadline = deadline if deadline is not None else Deadline(None)
+    url = redirects.lookup(url)
+    for _ in range(MAX_REDIRECTS + 1):
+        response = fetch_without_redirects(url, timing, deadline)
+        if response.status not in REDIRECT_STATUSES:
+            return response
+
+        location = response.headers.get("location")
+        # The body of a redirect is only meant for clients that don't follow it, reading it frees the connection
+        response.read()
+        assert location, f"{response.status} redirect from {url} has no 'Location' header"
+        target = resolve_url(location, url)
+        if response.status in PERMANENT_REDIRECT_STATUSES:
+            redirects.store(url, target)
+        logger.debug(f"Following {response.status} redirect from {url} to {target}")
+        if timing is not None:
+            timing.follow_redirect(target)
+        url = target
+
+    raise AssertionError(f"Too many redirects, gave up after {MAX_REDIRECTS} at {url}")
+
+
+def fetch_without_redirects(
+    url: str, timing: RequestTiming | None = None, deadline: Deadline | None = None
+) -> Response:
+    """
+    Preloaded responses are served from the preload cache, and fresh responses straight from the HTTP cache.
+    Stale ones are revalidated with a conditional request, and if the server answers '304 Not Modified'
+    the cached body is reused.
+    """
+    preloaded_response = preloaded.take(url)
+    if preloaded_response is not None:
+        logger.debug(f"Serving {url} from the preload cache")
+        headers, body = preloaded_response
+        if timing is not None:
+            timing.source = "preload"
+        return Response(url, "200", "OK", headers, body=body, timing=timing)
+
+    entry = cache.lookup(url)
+    if entry is not None and cache.is_fresh(entry):
+        logger.debug(f"Serving {url} from the cache")
+        if timing is not None:
+            timing.source = "cache"
+        return Response(url, "200", "OK", entry.headers, body=entry.body, timing=timing)
+
+    request_headers = entry.conditional_headers() if entry is not None else {}
+    response = open_response(url, request_headers, timing, deadline)
+
+    if response.status == "304" and entry is not None:
+        # A '304' has no body, reading it hands the connection back to the pool. The timing records the
+        # revalidation as it happened on the wire, a '304' with an empty body
+        response.read()
+        entry = cache.refresh(entry, response.headers)
+        return Response(url, "200", "OK", entry.headers, body=entry.body)
+
+    # The body is only stored once it has been completely read. Redirects are not stored, permanent
+    # ones are remembered by the redirect cache instead
+    if response.status == "200":
+        response.completion_listeners.append(lambda body: cache.store(url, response.headers, body))
+    return response
+
+
+def open_response(
+    url: str,
+    request_headers: Dict[str, str],
+    timing: RequestTiming | None = None,
+    deadline: Deadline | None = None,
+) -> Response:
+    """
+    Sends the request over a pooled connection and reads back the status line and headers.
     """
     scheme, host, port, path = parse_url(url)
+    deadline = deadline if deadline is not None else Deadline(None)
 
-    s = socket.socket(family=socket.AF_INET, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP)
-    s.connect((host, port))
+    connection = acquire(scheme, host, port, timing, deadline)
+    was_reused = connection.is_reused
+    try:
+        return exchange(url, connection, host, port, path, request_headers, timing, deadline)
+    except ConnectionError as e:
+        # The server may have closed an idle connection while it was waiting in the pool, retry once on a fresh socket
+        if not was_reused:
+            raise
+        logger.debug(f"Retrying on a new connection after: {e}")
 
-    if scheme == "https":
-        ctx = ssl.create_default_context()
-        s = ctx.wrap_socket(s, server_hostname=host)
+    connection = acquire(scheme, host, port, timing, deadline)
+    return exchange(url, connection, host, port, path, request_headers, timing, deadline)
 
-    message = "GET {} HTTP/1.0\r\n".format(path).encode("utf8") + "Host: {}\r\n\r\n".format(host).encode("utf8")
-    s.send(message)
 
-    # todo 'encoding' should depend on the headers in the response
-    response = s.makefile("r", encoding="utf8", newline="\r\n")
+def acquire(scheme: str, host: str, port: int, timing: RequestTiming | None, deadline: Deadline) -> Connection:
+    """
+    Takes a connection from the pool. The time spent waiting for it is split into the DNS lookup and
+    handshakes (when a new connection had to be opened) and the rest, which is time spent blocked on the pool.
+    """
+    start = time.perf_counter()
+    connection = pool.acquire(scheme, host, port, deadline)
+    if timing is None:
+        return connection
 
-    # Parse the status line
-    status_line = response.readline()
-    version, status, explanation = status_line.split(" ", 2)
-    assert status == "200", "{}: {}".format(status, explanation)
+    waited = time.perf_counter() - start
+    timing.connection_reused = connection.is_reused
+    connect_timings = connection.connect_timings
+    if connect_timings is None:
+        timing.dns = timing.connect = timing.tls = None
+        timing.blocked = waited
+    else:
+        timing.dns = connect_timings.dns
+        timing.connect = connect_timings.connect
+        timing.tls = connect_timings.tls
+        handshakes = connect_timings.dns + connect_timings.connect + (connect_timings.tls or 0)
+        timing.blocked = max(waited - handshakes, 0)
+    return connection
 
-    # Parse the headers line by line
-    headers = {}
-    while True:
-        line = response.readline()
-        if line == "\r\n":
-            break
 
-        header, value = line.split(":", 1)
-        headers[header.lower()] = value.strip()
+def exchange(
+    url: str,
+    connection: Connection,
+    host: str,
+    port: int,
+    path: str,
+    request_headers: Dict[str, str],
+    timing: RequestTiming | None,
+    deadline: Deadline,
+) -> Response:
+    """
+    Sends the request and reads back the status line and headers of the response.
 
-    logger.debug(f"\nHeaders: {json.dumps(headers, indent=4)}\n")
+    If the first byte takes longer than the hedging delay of the origin, the request is sent again on a
+    second connection (GET requests are idempotent), and the response that starts first is used.
+    The connection is handed back to the pool if this fails.
+    """
+    try:
+        send_start = time.perf_counter()
+        headers_sent = send_request(connection, host, port, path, request_headers)
+        sent = time.perf_counter()
 
-    assert "transfer-encoding" not in headers
-    assert "content-encoding" not in headers
+        delay = hedging.delay(connection.key)
+        if delay is not None and not wait_for_first_byte([connection], deadline.limit(delay)):
+            connection, hedged = hedge(url, connection, host, port, path, request_headers, deadline)
+            if timing is not None:
+                timing.hedged = hedged
+        response = read_response(url, connection, timing, deadline)
+    except BaseException:
+        pool.release(connection, reusable=False)
+        raise
 
-    body = response.read()
-    s.close()
+    hedging.record(connection.key, time.perf_counter() - sent)
+    if timing is not None and timing.headers_received_at is not None:
+        timing.send = sent - send_start
+        timing.wait = timing.headers_received_at - sent
+        timing.request_headers = headers_sent
+    return response
 
-    logger.debug(f"\nBody: {body}\n")
 
-    return headers, body
+def send_request(
+    connection: Connection, host: str, port: int, path: str, request_headers: Dict[str, str]
+) -> Dict[str, str]:
+    """
+    Sends a single GET request over the connection, and returns the headers that were sent.
+    """
+    scheme = connection.key[0]
+    # The port is only part of the 'Host' header when it isn't the default port of the scheme
+    if (scheme == "http" and port != 80) or (scheme == "https" and port != 443):
+        host = f"{host}:{port}"
+
+    headers_sent = {
+        "Host": host,
+        "Accept-Encoding": ", ".join(SUPPORTED_CONTENT_ENCODINGS),
+        **request_headers,
+        "Connection": "keep-alive",
+    }
+    message = (
+        "GET {} HTTP/1.1\r\n".format(path)
+        + "".join(f"{name}: {value}\r\n" for name, value in headers_sent.items())
+        + "\r\n"
+    ).encode("utf8")
+    connection.sock.sendall(message)
+    return headers_sent
+
+
+def wait_for_first_byte(connections: list[Connection], timeout: float | None) -> list[Connection]:
+    """
+    Returns the connections that have received the first byte of their response within 'timeout' seconds
+    (possibly none).
+
+    A readable socket isn't enough: a TLS 1.3 server sends its session tickets right after the handshake,
+    so a new HTTPS connection is readable before the server has answered anything.
+    """
+    end = None if timeout is None else time.perf_counter() + timeout
+    waiting = list(connections)
+    while waiting:
+        remaining = None if end is None else max(end - time.perf_counter(), 0)
+        readable, _, _ = select.select([connection.sock for connection in waiting], [], [], remaining)
+        if not readable:
+            return []
+        ready = []
+        for connection in list(waiting):
+            if connection.sock not in readable:
+                continue
+            first_byte = peek_first_byte(connection)
+            if first_byte:
+                ready.append(connection)
+            elif first_byte == b"":
+                # Closed by the server, it will never answer
+                waiting.remove(connection)
+        if ready:
+            return ready
+    return []
+
+
+def peek_first_byte(connection: Connection) -> bytes | None:
+    """
+    Returns the first byte of the response without consuming it, b"" if the connection was closed, or 'None'
+    if nothing but TLS records (ex. session tickets) has arrived yet.
+    """
+    timeout = connection.sock.gettimeout()
+    connection.sock.setblocking(False)
+    try:
+        return connection.file.peek(1)[:1]
+    except (ssl.SSLWantReadError, BlockingIOError):
+        return None
+    finally:
+        connection.sock.settimeout(timeout)
+
+
+def hedge(
+    url: str,
+    connection: Connection,
+    host: str,
+    port: int,
+    path: str,
+    request_headers: Dict[str, str],
+    deadline: Deadline,
+) -> Tuple[Connection, bool]:
+    """
+    Sends the request again on a second connection and returns whichever connection receives its first
+    byte first (and whether the request was sent again). The other one is closed, since its response is never read.
+
+    The request is only hedged if a connection is free right away, when the pool of the origin is full
+    the request keeps waiting on its own connection.
+    """
+    scheme = connection.key[0]
+    try:
+        # Waiting for a connection to be released could take longer than the slow response itself
+        second = pool.try_acquire(scheme, host, port, deadline)
+    except Exception as e:
+        logger.debug(f"Couldn't hedge the request of {url}: {e}")
+        return connection, False
+    if second is None:
+        logger.debug(f"Not hedging the request of {url}, every connection to its origin is in use")
+        return connection, False
+    try:
+        send_request(second, host, port, path, request_headers)
+        ready = wait_for_first_byte([connection, second], deadline.limit(connection.read_timeout))
+    except Exception as e:
+        logger.debug(f"Hedged request of {url} failed: {e}")
+        pool.release(second, reusable=False)
+        return connection, True
+
+    if connection in ready or not ready:
+        pool.release(second, reusable=False)
+        return connection, True
+    logger.debug(f"The hedged request of {url} answered first")
+    pool.release(connection, reusable=False)
+    return second, True
+
+
+def read_response(url: str, connection: Connection, timing: RequestTiming | None, deadline: Deadline) -> Response:
+    """
+    Reads the status line and headers of the response to the request that was sent over the connection.
+    """
+    response = connection.file
+
+    try:
+        connection.arm(deadline, url)
+        # The status line and headers are parsed as bytes, only the values that are kept are decoded
+        status_line = response.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by the server before a response was received")
+        headers = parse_headers(response)
+    except NetworkTimeoutError:
+        raise
+    except TimeoutError as e:
+        raise deadline.timeout_error(url, READ, connection.read_timeout) from e
+
+    version, status, explanation = (status_line.rstrip(b"\r\n").decode("latin-1").split(" ", 2) + [""])[:3]
+    # '304 Not Modified' is the answer to a conditional request for a cached response
+    assert status in ["200", "304"] + REDIRECT_STATUSES, "{}: {}".format(status, explanation)
+
+    logger.debug(f"\nHeaders: {json.dumps(headers, indent=4)}\n")
+
+    if timing is not None:
+        timing.headers_received()
+        timing.http_version = version.strip()
+        # The header names were lowercased, but the size of each line is the same as on the wire (give or take whitespace)
+        timing.header_bytes = len(status_line) + sum(len(f"{name}: {value}\r\n") for name, value in headers.items()) + 2
+
+    keep_alive = version.strip() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+    return Response(
+        url,
+        status,
+        explanation,
+        headers,
+        connection,
+        keep_alive,
+        on_close=pool.release,
+        timing=timing,
+        deadline=deadline,
+    )
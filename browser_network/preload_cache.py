@@ -0,0 +1,61 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+from browser_config import PRELOAD_CACHE_BYTES, PRELOAD_CACHE_TTL
+from loguru import logger
+
+
+class PreloadCache:
+    """
+    Holds the responses fetched because of a '<link rel=preload>' or '<link rel=prefetch>' hint until the
+    page (or the next page) asks for them.
+
+    Unlike the HTTP cache, this keeps responses whatever their 'Cache-Control' says, since the page
+    explicitly asked for them to be fetched ahead of time. Each response is handed out once, and is
+    dropped if it isn't used within 'ttl' seconds.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = PRELOAD_CACHE_BYTES,
+        ttl: float = PRELOAD_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        # url -> (stored_at, headers, body), ordered from the oldest to the newest
+        self.entries: OrderedDict[str, Tuple[float, Dict[str, str], bytes]] = OrderedDict()
+        self.size = 0
+
+    def put(self, url: str, headers: Dict[str, str], body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            self._pop(url)
+            self.entries[url] = (self.clock(), headers, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self.entries)))
+        logger.debug(f"Preloaded {url}")
+
+    def take(self, url: str) -> Tuple[Dict[str, str], bytes] | None:
+        with self.lock:
+            entry = self._pop(url)
+        if entry is None:
+            return None
+        stored_at, headers, body = entry
+        if self.clock() - stored_at > self.ttl:
+            return None
+        return headers, body
+
+    def _pop(self, url: str) -> Tuple[float, Dict[str, str], bytes] | None:
+        """
+        Must be called while holding 'self.lock'.
+        """
+        entry = self.entries.pop(url, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+        return entry
@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+from browser_config import MAX_REDIRECTS, REDIRECT_CACHE_ENTRIES
+from loguru import logger
+
+
+class RedirectCache:
+    """
+    Remembers permanent redirects ('301 Moved Permanently' and '308 Permanent Redirect'), so that later
+    requests for a url that is known to have moved go straight to its new location, without the round
+    trip to the old one.
+
+    At most 'max_entries' redirects are kept, evicting the least recently used ones first.
+    """
+
+    def __init__(self, max_entries: int = REDIRECT_CACHE_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # url -> the url it permanently redirects to
+        self.entries: OrderedDict[str, str] = OrderedDict()
+
+    def lookup(self, url: str) -> str:
+        """
+        Returns where the url ends up after following the known permanent redirects, or the url itself.
+        """
+        with self.lock:
+            seen = {url}
+            # A chain longer than 'MAX_REDIRECTS' (or a loop) is left for the network to fail on
+            for _ in range(MAX_REDIRECTS):
+                target = self.entries.get(url)
+                if target is None or target in seen:
+                    break
+                self.entries.move_to_end(url)
+                seen.add(target)
+                url = target
+        return url
+
+    def store(self, url: str, target: str) -> None:
+        with self.lock:
+            self.entries[url] = target
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        logger.debug(f"Remembered permanent redirect {url} -> {target}")
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
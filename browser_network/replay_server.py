@@ -0,0 +1,145 @@
+import socket
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Tuple
+from browser_network.dns_cache import Resolver
+from browser_network.traffic_archive import TrafficArchive
+from loguru import logger
+
+# Bytes written at a time when the bandwidth is limited, small enough for the rate to be smooth
+SHAPED_WRITE_SIZE = 16 * 1024
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+    Answers every request from the archive, whatever host it was meant for (the 'Host' header tells
+    which one). Urls that are not in the archive get a '404 Not Found'.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server: "ReplayServer"
+
+    def setup(self) -> None:
+        super().setup()
+        # The headers and the body are separate writes. With Nagle's algorithm the body would wait for the
+        # client to acknowledge the headers, which it delays by up to 40ms, hoping to have a reply to send with it
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self) -> None:
+        url = f"{self.server.scheme}://{self.headers.get('Host', '')}{self.path}"
+        response = self.server.archive.get(url)
+        self.server.requests.append(url)
+        # The latency is paid before the response starts, like a round trip to a distant server
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if response is None:
+            logger.debug(f"Not in the archive: {url}")
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        etag = response.headers.get("etag")
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(response.status, response.explanation)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.write_body(response.body)
+
+    def write_body(self, body: bytes) -> None:
+        bandwidth = self.server.bandwidth
+        if bandwidth is None:
+            self.wfile.write(body)
+            return
+
+        for start in range(0, len(body), SHAPED_WRITE_SIZE):
+            chunk = body[start : start + SHAPED_WRITE_SIZE]
+            # Wait for the time the chunk would take to arrive before sending it, so that the last byte is late too
+            time.sleep(len(chunk) / bandwidth)
+            self.wfile.write(chunk)
+            self.wfile.flush()
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    A local stand-in for every host in a 'TrafficArchive'.
+
+    'latency' (seconds) is added before each response, and 'bandwidth' (bytes per second, per connection)
+    limits how fast bodies are sent, so that the replay can approximate a given network. With an
+    'ssl_context' the server speaks HTTPS, and replays the 'https://' urls of the archive.
+
+    The browser is pointed at the server through the DNS cache, with 'replay_resolver'.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        archive: TrafficArchive,
+        latency: float = 0.0,
+        bandwidth: float | None = None,
+        ssl_context: ssl.SSLContext | None = None,
+        address: Tuple[str, int] = ("127.0.0.1", 0),
+    ) -> None:
+        super().__init__(address, ReplayHandler)
+        self.archive = archive
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.scheme = "http" if ssl_context is None else "https"
+        self.ssl_context = ssl_context
+        self.requests: list[str] = []
+        self.thread: threading.Thread | None = None
+
+    def get_request(self) -> Tuple[socket.socket, Any]:
+        sock, address = super().get_request()
+        if self.ssl_context is not None:
+            # The handshake happens on the handler's thread, on first read
+            sock = self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        host, port = self.server_address[:2]
+        return str(host), int(port)
+
+    def start(self) -> "ReplayServer":
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "ReplayServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def replay_resolver(http: ReplayServer, https: ReplayServer | None = None) -> Resolver:
+    """
+    Resolves every host to the replay servers. Connections to port 443 go to the 'https' server, and
+    every other port to the 'http' one.
+    """
+
+    def resolve(host: str, port: int) -> List[Tuple[Any, ...]]:
+        server = https if port == 443 and https is not None else http
+        address = server.address
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", address)]
+
+    return resolve
@@ -0,0 +1,221 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict
+
+
+class ConnectTimings:
+    """
+    Seconds spent opening a connection: resolving the host, the TCP handshake and the TLS handshake
+    ('tls' is 'None' for plain HTTP connections).
+    """
+
+    def __init__(self, dns: float, connect: float, tls: float | None) -> None:
+        self.dns = dns
+        self.connect = connect
+        self.tls = tls
+
+
+class RequestTiming:
+    """
+    Where the time of a single request went, and how many bytes it moved. Durations are in seconds,
+    phases that didn't happen (ex. DNS and connecting on a reused connection) are 'None'.
+
+    The phases follow the HAR timing model:
+        blocked - waiting for a connection from the pool
+        dns     - resolving the host name
+        connect - the TCP handshake
+        tls     - the TLS handshake
+        send    - sending the request
+        wait    - from the request being sent to the status line and headers arriving (time to first byte)
+        receive - from the headers to the last byte of the body. For a streamed body this includes the time
+                  the consumer (ex. the HTML parser) spends on each chunk.
+    """
+
+    def __init__(self, url: str, pageref: str | None = None) -> None:
+        self.url = url
+        # The urls that redirected to 'url', in order
+        self.redirects: list[str] = []
+        self.pageref = pageref
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end: float | None = None
+        # Where the response came from: "network", "cache", "preload", "in-flight" (shared with another request),
+        # or "file" and "data" for local urls
+        self.source = "network"
+        self.request_headers: Dict[str, str] = {}
+        self.status = 0
+        self.status_text = ""
+        self.http_version = "HTTP/1.1"
+        self.response_headers: Dict[str, str] = {}
+        self.connection_reused = False
+        # Whether the request was sent a second time because its first byte was late (see 'HedgingPolicy')
+        self.hedged = False
+        # Why the request failed, if it did
+        self.error: str | None = None
+
+        self.blocked: float | None = None
+        self.dns: float | None = None
+        self.connect: float | None = None
+        self.tls: float | None = None
+        self.send: float | None = None
+        self.wait: float | None = None
+        self.receive: float | None = None
+        self.headers_received_at: float | None = None
+
+        # Size of the status line and headers, and of the body as it was sent (possibly compressed)
+        self.header_bytes = -1
+        self.body_bytes = 0
+        # Size of the decoded body
+        self.content_bytes = 0
+
+    @property
+    def total(self) -> float | None:
+        return self.end - self.start if self.end is not None else None
+
+    @property
+    def time_to_first_byte(self) -> float | None:
+        return self.headers_received_at - self.start if self.headers_received_at is not None else None
+
+    def follow_redirect(self, url: str) -> None:
+        """
+        Starts timing the next hop of a redirect chain. The phases describe the last hop, while the total
+        keeps counting from the first request.
+        """
+        self.redirects.append(self.url)
+        self.url = url
+        self.end = None
+        self.source = "network"
+        self.hedged = False
+        self.blocked = self.dns = self.connect = self.tls = None
+        self.send = self.wait = self.receive = self.headers_received_at = None
+        self.header_bytes = -1
+        self.body_bytes = self.content_bytes = 0
+
+    def headers_received(self) -> None:
+        self.headers_received_at = time.perf_counter()
+
+    def finish(self, content_bytes: int, body_bytes: int) -> None:
+        if self.end is not None:
+            return
+        self.end = time.perf_counter()
+        self.content_bytes = content_bytes
+        self.body_bytes = body_bytes
+        if self.headers_received_at is not None:
+            self.receive = self.end - self.headers_received_at
+
+    def fail(self, error: BaseException) -> None:
+        if self.error is None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.finish(self.content_bytes, self.body_bytes)
+
+    def to_har(self) -> dict:
+        def milliseconds(seconds: float | None) -> float:
+            # HAR uses -1 for phases that don't apply to the request
+            return round(seconds * 1000, 3) if seconds is not None else -1
+
+        entry = {
+            "startedDateTime": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "time": milliseconds(self.total) if self.total is not None else 0,
+            "request": {
+                "method": "GET",
+                "url": self.url,
+                "httpVersion": "HTTP/1.1",
+                "cookies": [],
+                "headers": [{"name": name, "value": value} for name, value in self.request_headers.items()],
+                "queryString": [],
+                "headersSize": -1,
+                "bodySize": 0,
+            },
+            "response": {
+                "status": self.status,
+                "statusText": self.status_text,
+                "httpVersion": self.http_version,
+                "cookies": [],
+                "headers": [{"name": name, "value": value} for name, value in self.response_headers.items()],
+                "content": {
+                    "size": self.content_bytes,
+                    "mimeType": self.response_headers.get("content-type", ""),
+                },
+                "redirectURL": self.response_headers.get("location", ""),
+                "headersSize": self.header_bytes,
+                "bodySize": self.body_bytes if self.source == "network" else 0,
+            },
+            "cache": {},
+            "timings": {
+                "blocked": milliseconds(self.blocked),
+                "dns": milliseconds(self.dns),
+                "connect": milliseconds(self.connect),
+                "ssl": milliseconds(self.tls),
+                "send": milliseconds(self.send) if self.send is not None else 0,
+                "wait": milliseconds(self.wait) if self.wait is not None else 0,
+                "receive": milliseconds(self.receive) if self.receive is not None else 0,
+            },
+            "_source": self.source,
+            "_redirects": self.redirects,
+            "_connectionReused": self.connection_reused,
+            "_hedged": self.hedged,
+        }
+        if self.pageref is not None:
+            entry["pageref"] = self.pageref
+        if self.error is not None:
+            entry["_error"] = self.error
+        return entry
+
+    def __repr__(self) -> str:
+        total = f"{self.total * 1000:.1f}ms" if self.total is not None else "pending"
+        return f"< RequestTiming {self.url} source={self.source} total={total} bytes={self.body_bytes} >"
+
+
+class NetworkLog:
+    """
+    The requests made on behalf of one tab, grouped by the page (navigation) that made them.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.pages: list[dict] = []
+        self.entries: list[RequestTiming] = []
+
+    def start_page(self, url: str) -> None:
+        with self.lock:
+            self.pages.append(
+                {
+                    "startedDateTime": datetime.now(timezone.utc).isoformat(),
+                    "id": f"page_{len(self.pages) + 1}",
+                    "title": url,
+                    "pageTimings": {},
+                }
+            )
+
+    def record(self, url: str) -> RequestTiming:
+        """
+        Returns a new timing for a request of the current page, to be filled in by the network stack.
+        """
+        timing = RequestTiming(url)
+        self.add(timing)
+        return timing
+
+    def add(self, timing: RequestTiming) -> None:
+        """
+        Adds a timing that was recorded elsewhere (ex. by a speculative load) to the current page.
+        """
+        with self.lock:
+            timing.pageref = self.pages[-1]["id"] if self.pages else None
+            self.entries.append(timing)
+
+    def to_har(self) -> dict:
+        with self.lock:
+            return {
+                "log": {
+                    "version": "1.2",
+                    "creator": {"name": "browser", "version": "0.1"},
+                    "pages": list(self.pages),
+                    "entries": [timing.to_har() for timing in self.entries],
+                }
+            }
+
+    def export_har(self, file_name: str) -> None:
+        with open(file_name, "w") as file:
+            json.dump(self.to_har(), file, indent=2)
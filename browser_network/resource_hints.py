@@ -0,0 +1,66 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from browser_config import RESOURCE_HINT_WORKERS
+from browser_network import network
+from browser_network.fetch_scheduler import FetchScheduler, Priority, fetch_scheduler
+from browser_network.http_cache import HOP_BY_HOP_HEADERS
+from loguru import logger
+
+# The 'rel' values of a '<link>' that ask the browser to do some work ahead of time
+RESOURCE_HINTS = ["dns-prefetch", "preconnect", "preload", "prefetch"]
+
+
+class ResourceHints:
+    """
+    Acts on the resource hints of a page:
+    - dns-prefetch: resolves the host, so the DNS cache already has it when the first request is made.
+    - preconnect:   opens a connection (including the TLS handshake) and parks it in the connection pool.
+    - preload:      fetches a resource the current page is going to need into the preload cache.
+    - prefetch:     fetches a resource the next page is likely to need into the preload cache.
+
+    Preloads and prefetches go through the fetch scheduler at a low priority, so they never hold up the
+    documents and stylesheets the page needs to render. Resolving and connecting run on their own small
+    pool of threads.
+    """
+
+    def __init__(self, workers: int = RESOURCE_HINT_WORKERS, scheduler: FetchScheduler = fetch_scheduler) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="resource-hint")
+        self.scheduler = scheduler
+
+    def hint(self, rel: str, url: str) -> "Future[None]":
+        assert rel in RESOURCE_HINTS, f"Unknown resource hint: {rel}"
+        logger.debug(f"Resource hint {rel}: {url}")
+        if rel == "dns-prefetch":
+            return self.executor.submit(self._run, self.dns_prefetch, url)
+        elif rel == "preconnect":
+            return self.executor.submit(self._run, self.preconnect, url)
+        elif rel == "preload":
+            return self.scheduler.submit(Priority.LOW, url, self._run, self.preload, url)
+        else:
+            return self.scheduler.submit(Priority.SPECULATIVE, url, self._run, self.preload, url)
+
+    def dns_prefetch(self, url: str) -> None:
+        scheme, host, port, path = network.parse_url(url)
+        network.dns_cache.resolve(host, port)
+
+    def preconnect(self, url: str) -> None:
+        scheme, host, port, path = network.parse_url(url)
+        network.pool.preconnect(scheme, host, port)
+
+    def preload(self, url: str) -> None:
+        with network.stream(url) as response:
+            body = response.read()
+        # The body is stored decoded, so the headers describing how it was sent no longer apply
+        headers = {name: value for name, value in response.headers.items() if name not in HOP_BY_HOP_HEADERS}
+        # Stored under the url the body came from, a redirect to it is still followed when the page asks for it
+        network.preloaded.put(response.url, headers, bytes(body))
+
+    def _run(self, action, url: str) -> None:
+        # A hint that fails is not an error for the page, the resource is fetched again when it is needed
+        try:
+            action(url)
+        except Exception as e:
+            logger.debug(f"Resource hint for {url} failed: {e}")
+
+
+# Shared by every tab
+resource_hints = ResourceHints()
@@ -0,0 +1,501 @@
+import codecs
+import itertools
+import mmap
+import re
+import zlib
+from typing import BinaryIO, Callable, Dict, Iterator
+from browser_config import SPILL_THRESHOLD_BYTES
+from browser_network.connection_pool import Connection
+from browser_network.request_timing import RequestTiming
+from browser_network.spill_file import MappedText
+from browser_network.timeouts import READ, Deadline, NetworkTimeoutError
+from loguru import logger
+
+# Number of body bytes handed out at a time when streaming a response
+CHUNK_SIZE = 64 * 1024
+
+# The content codings sent in 'Accept-Encoding', these are the ones 'ContentDecoder' knows how to decompress
+SUPPORTED_CONTENT_ENCODINGS = ["gzip", "deflate"]
+
+
+# Used when neither the 'Content-Type' header nor the document declare a charset
+DEFAULT_CHARSET = "utf8"
+# '<meta charset>' has to appear within the first 1024 bytes of the document
+CHARSET_SNIFF_BYTES = 1024
+
+# Charsets that don't encode ASCII characters as single bytes
+WIDE_CHARSETS = ("utf-16", "utf-32")
+
+BYTE_ORDER_MARKS = [(codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+BYTE_ORDER_MARK_BYTES = max(len(bom) for bom, charset in BYTE_ORDER_MARKS)
+CONTENT_TYPE_CHARSET = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+# Matches both '<meta charset="...">' and '<meta http-equiv="Content-Type" content="text/html; charset=...">'
+META_CHARSET = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+def parse_headers(file: BinaryIO) -> Dict[str, str]:
+    """
+    Reads header lines up to the empty line that ends them. Header names are case-insensitive, so they are lowercased.
+    """
+    headers = {}
+    while True:
+        line = file.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+
+        header, value = line.split(b":", 1)
+        headers[header.strip().lower().decode("latin-1")] = value.strip().decode("latin-1")
+    return headers
+
+
+def detect_charset(headers: Dict[str, str], prefix: bytes) -> str:
+    """
+    Picks the encoding of a text body from (in order of precedence) a byte order mark, the charset parameter
+    of the 'Content-Type' header, and a '<meta charset>' declaration in the first bytes of the document.
+    """
+    for bom, charset in BYTE_ORDER_MARKS:
+        if prefix.startswith(bom):
+            return charset
+
+    candidates = []
+    match = CONTENT_TYPE_CHARSET.search(headers.get("content-type", ""))
+    if match:
+        candidates.append(match.group(1))
+    match = META_CHARSET.search(prefix[:CHARSET_SNIFF_BYTES])
+    if match:
+        candidates.append(match.group(1).decode("ascii", errors="ignore"))
+
+    for candidate in candidates:
+        try:
+            return codecs.lookup(candidate).name
+        except LookupError:
+            continue
+    return DEFAULT_CHARSET
+
+
+class ContentDecoder:
+    """
+    Incrementally decompresses a 'Content-Encoding: gzip' or 'Content-Encoding: deflate' body, one chunk at a time.
+
+    'deflate' is supposed to be zlib-wrapped, but some servers send a raw deflate stream instead, so the
+    wrapping is detected from the 2 byte zlib header, once it has arrived.
+    """
+
+    def __init__(self, encoding: str) -> None:
+        assert encoding in SUPPORTED_CONTENT_ENCODINGS, f"Unsupported content-encoding: {encoding}"
+        self.encoding = encoding
+        self.decompressor: "zlib._Decompress | None" = None
+        # The start of a 'deflate' body, until there is enough of it to tell how it is wrapped
+        self.pending = b""
+        if encoding == "gzip":
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.decompressor is None:
+            self.pending += data
+            if len(self.pending) < 2:
+                return b""
+            data, self.pending = self.pending, b""
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+            try:
+                return self.decompressor.decompress(data)
+            except zlib.error:
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.decompressor.decompress(data)
+
+    def flush(self) -> bytes:
+        if self.decompressor is None:
+            # A body too short for a zlib header can only be raw deflate
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return decompressor.decompress(self.pending) + decompressor.flush()
+        return self.decompressor.flush()
+
+
+class Response:
+    """
+    An HTTP response whose body is read from the connection as it is consumed, rather than being
+    buffered in memory before it is returned.
+
+    The body is framed in one of three ways:
+    1. 'Transfer-Encoding: chunked' - the body is a sequence of '<hex size>\\r\\n<data>\\r\\n' chunks,
+                                      terminated by a chunk of size 0 (optionally followed by trailers).
+    2. 'Content-Length'             - the body is exactly that many bytes.
+    3. Neither                      - the body ends when the server closes the connection.
+
+    Only the first two leave the connection in a state where it can carry another request, so the
+    connection is handed back to the pool through 'on_close' once the body has been fully read.
+
+    A compressed body ('Content-Encoding') is decompressed as it is read, so 'iter_bytes' always
+    yields the decoded content.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        status: str,
+        explanation: str,
+        headers: Dict[str, str],
+        connection: Connection | None = None,
+        keep_alive: bool = False,
+        on_close: Callable[[Connection, bool], None] | None = None,
+        body: bytes | mmap.mmap | None = None,
+        timing: RequestTiming | None = None,
+        deadline: Deadline | None = None,
+    ) -> None:
+        """
+        A response is either read from a 'connection', or already has its whole (decoded) 'body', which is
+        the case for responses that come from the HTTP cache, and for local files (which are memory-mapped).
+
+        'timing' is finished once the body has been read (or the response is closed without reading it).
+        Reading the body fails with a 'NetworkTimeoutError' if a read takes longer than the connection's
+        read timeout, or if the body isn't done by the 'deadline'.
+        """
+        self.url = url
+        self.status = status
+        self.explanation = explanation
+        self.headers = headers
+        self.connection = connection
+        self.keep_alive = keep_alive
+        self.on_close = on_close
+        self.body = body
+        self.is_consumed = False
+        self.is_complete = False
+        # Called with the whole decoded body once it has been read (ex. to store it in the HTTP cache)
+        self.completion_listeners: list[Callable[[bytes], None]] = []
+        # Called if the whole body won't be handed to the completion listeners: the response is closed before
+        # its body was read, or the body turns out to be too large to be kept ('spill_threshold')
+        self.abandon_listeners: list[Callable[[], None]] = []
+        self.timing = timing
+        self.deadline = deadline if deadline is not None else Deadline(None)
+        # Body bytes read from the connection (before decompression), and body bytes handed out (after)
+        self.received_bytes = 0
+        self.decoded_bytes = 0
+        # Bodies larger than this are not kept in memory, neither for the completion listeners nor by 'read_text'
+        self.spill_threshold = SPILL_THRESHOLD_BYTES
+        if timing is not None:
+            timing.status = int(status)
+            timing.status_text = explanation.strip()
+            timing.response_headers = headers
+
+    def iter_bytes(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Yields the (decompressed) body as it arrives.
+        """
+        if not self.completion_listeners:
+            for chunk in self._iter_decoded_bytes(chunk_size):
+                self.decoded_bytes += len(chunk)
+                yield chunk
+            self.is_complete = True
+            self._finish_timing()
+            return
+
+        # The listeners get the whole body, which is only kept while it is small enough to be held in memory
+        chunks: list[bytes] | None = []
+        for chunk in self._iter_decoded_bytes(chunk_size):
+            self.decoded_bytes += len(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+                if self.spill_threshold is not None and self.decoded_bytes > self.spill_threshold:
+                    logger.debug(f"The body of {self.url} is too large to be kept for the completion listeners")
+                    chunks = None
+                    # Right away, rather than once the body is read, so that whoever waits for it can move on
+                    self._abandon()
+            yield chunk
+
+        if chunks is not None:
+            self._complete(b"".join(chunks))
+            return
+        self.is_complete = True
+        self._finish_timing()
+
+    def iter_raw_bytes(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Yields the body as it was sent over the wire, in pieces of at most 'chunk_size' bytes.
+        """
+        assert not self.is_consumed, "The body of a response can only be read once"
+        self.is_consumed = True
+
+        if self.body is not None:
+            for start in range(0, len(self.body), chunk_size):
+                yield self.body[start : start + chunk_size]
+            return
+
+        assert self.connection is not None, "Tried to read the body of a closed response"
+        try:
+            # These responses never have a body, whatever their headers say
+            if self.status in ["204", "304"]:
+                reusable = self.keep_alive
+            elif self.headers.get("transfer-encoding", "").lower() == "chunked":
+                yield from self._count_received(self._read_chunked(chunk_size))
+                reusable = self.keep_alive
+            elif "content-length" in self.headers:
+                yield from self._count_received(self._read_length(int(self.headers["content-length"]), chunk_size))
+                reusable = self.keep_alive
+            else:
+                yield from self._count_received(self._read_until_closed(chunk_size))
+                reusable = False
+        except NetworkTimeoutError as e:
+            self._release(reusable=False)
+            self._fail_timing(e)
+            raise
+        except TimeoutError as e:
+            error = self._timeout_error()
+            self._release(reusable=False)
+            self._fail_timing(error)
+            raise error from e
+        except BaseException:
+            self._release(reusable=False)
+            raise
+        self._release(reusable)
+
+    def iter_text(self, encoding: str | None = None, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+        """
+        Decodes the body incrementally, so that multi-byte characters split across chunks are kept whole.
+
+        Without an explicit 'encoding', the first 'CHARSET_SNIFF_BYTES' bytes are buffered to detect the charset.
+        """
+        return self._decode(self.iter_bytes(chunk_size), encoding)
+
+    def read_text(self) -> str | MappedText:
+        """
+        Reads and decodes the whole body. A body larger than 'spill_threshold' bytes is decoded into a
+        temporary file as it arrives, and returned as a 'MappedText' instead of a 'str'.
+        """
+        length = self.headers.get("content-length")
+        if self.spill_threshold is None:
+            is_small = True
+        elif self.body is not None:
+            is_small = len(self.body) <= self.spill_threshold
+        else:
+            is_small = (
+                length is not None
+                and int(length) <= self.spill_threshold
+                and self.headers.get("content-encoding", "identity").lower() == "identity"
+            )
+        if is_small:
+            raw_body = self.read()
+            # The whole body is decoded in one go, using the charset declared by the server or the document
+            return raw_body.decode(self.charset(raw_body), errors="replace")
+
+        # A memory-mapped body (ex. a local file) that is ASCII can be used as the text as it is, without copying it
+        if isinstance(self.body, mmap.mmap) and not self.charset(self.body[:CHARSET_SNIFF_BYTES]).startswith(
+            WIDE_CHARSETS
+        ):
+            text = MappedText.wrap(self.body)
+            if text is not None:
+                self.is_consumed = True
+                self.decoded_bytes = len(self.body)
+                self._complete(self.body)
+                return text
+
+        # The size isn't known up front (or the body is compressed), so it is buffered until it turns out to be large
+        chunks = self.iter_bytes()
+        buffered: list[bytes] = []
+        size = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size > self.spill_threshold:
+                break
+        else:
+            raw_body = b"".join(buffered)
+            return raw_body.decode(self.charset(raw_body), errors="replace")
+
+        logger.debug(f"Spilling the body of {self.url} to a temporary file")
+        return MappedText.spill(self._decode(itertools.chain(buffered, chunks), None))
+
+    def _decode(self, chunks: Iterator[bytes], encoding: str | None) -> Iterator[str]:
+        prefix = b""
+        if encoding is None:
+            # A charset in the 'Content-Type' header can only be overridden by a byte order mark, so the text
+            # starts as soon as that's ruled out, instead of waiting for enough bytes to find a '<meta charset>'
+            declared = CONTENT_TYPE_CHARSET.search(self.headers.get("content-type", ""))
+            sniff_bytes = BYTE_ORDER_MARK_BYTES if declared else CHARSET_SNIFF_BYTES
+            for chunk in chunks:
+                prefix += chunk
+                if len(prefix) >= sniff_bytes:
+                    break
+            encoding = self.charset(prefix)
+
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        text = decoder.decode(prefix)
+        if text:
+            yield text
+        for chunk in chunks:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+
+    def charset(self, prefix: bytes) -> str:
+        return detect_charset(self.headers, prefix)
+
+    def read(self) -> bytes:
+        """
+        Reads the whole body. When its size is known up front, it is read straight into a preallocated
+        buffer, instead of joining the chunks together at the end.
+        """
+        encoding = self.headers.get("content-encoding", "identity").lower()
+        is_framed_by_length = (
+            self.body is None
+            and encoding == "identity"
+            and "content-length" in self.headers
+            and "chunked" not in self.headers.get("transfer-encoding", "").lower()
+            and self.status not in ["204", "304"]
+        )
+        if not is_framed_by_length:
+            return b"".join(self.iter_bytes())
+
+        assert self.connection is not None, "Tried to read the body of a closed response"
+        assert not self.is_consumed, "The body of a response can only be read once"
+        self.is_consumed = True
+
+        length = int(self.headers["content-length"])
+        body = bytearray(length)
+        view = memoryview(body)
+        received = 0
+        try:
+            while received < length:
+                self.connection.arm(self.deadline, self.url)
+                count = self.connection.file.readinto(view[received:])
+                if not count:
+                    raise ConnectionResetError(f"Connection closed after {received} of {length} body bytes")
+                received += count
+                self.received_bytes += count
+        except NetworkTimeoutError as e:
+            self._release(reusable=False)
+            self._fail_timing(e)
+            raise
+        except TimeoutError as e:
+            error = self._timeout_error()
+            self._release(reusable=False)
+            self._fail_timing(error)
+            raise error from e
+        except BaseException:
+            self._release(reusable=False)
+            raise
+        finally:
+            view.release()
+        self._release(self.keep_alive)
+
+        self.decoded_bytes = length
+        self._complete(body)
+        return body
+
+    def close(self) -> None:
+        """
+        A response that is closed before its body was read leaves unread bytes on the socket, so its
+        connection can't be reused.
+        """
+        self._release(reusable=False)
+        if not self.is_complete:
+            self._abandon()
+        self._finish_timing()
+
+    def _release(self, reusable: bool) -> None:
+        """
+        Hands the connection back to the pool.
+        """
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        if self.on_close is not None:
+            self.on_close(connection, reusable)
+
+    def _complete(self, body: bytes) -> None:
+        self.is_complete = True
+        self._finish_timing()
+        for listener in self.completion_listeners:
+            listener(body)
+
+    def _abandon(self) -> None:
+        listeners, self.abandon_listeners = self.abandon_listeners, []
+        for listener in listeners:
+            listener()
+
+    def _timeout_error(self) -> NetworkTimeoutError:
+        read_timeout = self.connection.read_timeout if self.connection is not None else None
+        return self.deadline.timeout_error(self.url, READ, read_timeout)
+
+    def _fail_timing(self, error: BaseException) -> None:
+        if self.timing is not None:
+            self.timing.fail(error)
+
+    def _finish_timing(self) -> None:
+        if self.timing is not None:
+            self.timing.finish(self.decoded_bytes, self.received_bytes)
+
+    def _count_received(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            self.received_bytes += len(chunk)
+            yield chunk
+
+    def __enter__(self) -> "Response":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _iter_decoded_bytes(self, chunk_size: int) -> Iterator[bytes]:
+        encoding = self.headers.get("content-encoding", "identity").lower()
+        if encoding == "identity" or self.body is not None:
+            yield from self.iter_raw_bytes(chunk_size)
+            return
+
+        decoder = ContentDecoder(encoding)
+        for chunk in self.iter_raw_bytes(chunk_size):
+            data = decoder.decompress(chunk)
+            if data:
+                yield data
+        data = decoder.flush()
+        if data:
+            yield data
+
+    def _read_chunked(self, chunk_size: int) -> Iterator[bytes]:
+        assert self.connection is not None
+        file = self.connection.file
+        while True:
+            self.connection.arm(self.deadline, self.url)
+            size_line = file.readline()
+            if not size_line:
+                raise ConnectionResetError("Connection closed in the middle of a chunked body")
+            # Chunk extensions ('1a;name=value') are allowed after the size, and are ignored
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                break
+            yield from self._read_length(size, chunk_size)
+            # Every chunk's data is followed by a CRLF
+            self.connection.arm(self.deadline, self.url)
+            file.readline()
+
+        # Skip the (optional) trailer headers, up to the empty line that ends the body
+        trailers = parse_headers(file)
+        if trailers:
+            logger.debug(f"Ignoring trailers: {trailers}")
+
+    def _read_length(self, length: int, chunk_size: int) -> Iterator[bytes]:
+        assert self.connection is not None
+        file = self.connection.file
+        remaining = length
+        while remaining > 0:
+            self.connection.arm(self.deadline, self.url)
+            data = file.read(min(remaining, chunk_size))
+            if not data:
+                raise ConnectionResetError(f"Connection closed after {length - remaining} of {length} body bytes")
+            remaining -= len(data)
+            yield data
+
+    def _read_until_closed(self, chunk_size: int) -> Iterator[bytes]:
+        assert self.connection is not None
+        file = self.connection.file
+        while True:
+            self.connection.arm(self.deadline, self.url)
+            data = file.read1(chunk_size)
+            if not data:
+                break
+            yield data
+
+    def __repr__(self) -> str:
+        return f"< Response {self.status} {self.explanation.strip()} url={self.url} >"
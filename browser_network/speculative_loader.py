@@ -0,0 +1,141 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+from browser_config import SPECULATIVE_BUDGET_BYTES
+from browser_network import network
+from browser_network.fetch_scheduler import FetchScheduler, Priority, fetch_scheduler
+from browser_network.request_timing import RequestTiming
+from loguru import logger
+
+
+class PrefetchedDocument:
+    """
+    A document that was downloaded (and, optionally, parsed) before the user navigated to it. Its 'url' is
+    the one it was served from, after following redirects.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        text: str,
+        size: int,
+        tree: Any = None,
+        timing: RequestTiming | None = None,
+    ) -> None:
+        self.url = url
+        self.headers = headers
+        self.text = text
+        # Number of body bytes, which is what counts against the memory budget
+        self.size = size
+        self.tree = tree
+        # How the download went, added to the network log of the tab that ends up using the document
+        self.timing = timing
+
+    def __repr__(self) -> str:
+        return f"< PrefetchedDocument url={self.url} size={self.size} parsed={self.tree is not None} >"
+
+
+class SpeculativeLoader:
+    """
+    Downloads the documents the user is likely to navigate to next (links under the pointer or in the
+    viewport), so that following one of those links doesn't have to wait on the network.
+
+    Prefetched documents are kept within 'budget_bytes', evicting the oldest ones first. 'parse' is
+    optionally run on the downloaded text on the worker thread, so that the parsed tree is ready too.
+
+    'cancel' abandons every prefetch that hasn't finished, ex. when the tab navigates away from the page
+    whose links were being prefetched. Downloads that are already running stop at their next chunk, except
+    the one of the page being navigated to ('keep'), which the navigation joins instead (see 'in_flight').
+    """
+
+    def __init__(
+        self,
+        budget_bytes: int = SPECULATIVE_BUDGET_BYTES,
+        parse: Callable[[str], Any] | None = None,
+        scheduler: FetchScheduler = fetch_scheduler,
+    ) -> None:
+        self.budget_bytes = budget_bytes
+        self.parse = parse
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.documents: OrderedDict[str, PrefetchedDocument] = OrderedDict()
+        self.size = 0
+        # url -> the prefetch and the event that stops its download. A prefetch that is no longer in here
+        # when it finishes throws its result away
+        self.pending: dict[str, tuple[Future, threading.Event]] = {}
+
+    def prefetch(self, url: str) -> "Future[None] | None":
+        if not url.startswith(("http://", "https://")):
+            return None
+        with self.lock:
+            if url in self.documents or url in self.pending:
+                return None
+            stop = threading.Event()
+            # Speculative loads have the lowest priority, they never hold up what the current page needs
+            future = self.scheduler.submit(Priority.SPECULATIVE, url, self._prefetch, url, stop)
+            self.pending[url] = (future, stop)
+        return future
+
+    def take(self, url: str) -> PrefetchedDocument | None:
+        with self.lock:
+            document = self.documents.pop(url, None)
+            if document is not None:
+                self.size -= document.size
+        if document is not None:
+            logger.debug(f"Using speculatively loaded {document}")
+        return document
+
+    def cancel(self, keep: str | None = None) -> None:
+        """
+        A download of 'keep' that is already running isn't stopped, the navigation to it gets its body
+        from the download rather than starting over. Its result isn't kept, the navigation has it already.
+        """
+        with self.lock:
+            for url, (future, stop) in self.pending.items():
+                # 'cancel' fails once the download has started
+                if not future.cancel() and url == keep:
+                    logger.debug(f"Letting the speculative load of {url} finish for the navigation to it")
+                    continue
+                stop.set()
+            self.pending.clear()
+
+    def _prefetch(self, url: str, stop: threading.Event) -> None:
+        try:
+            document = self._load(url, stop)
+        except Exception as e:
+            logger.debug(f"Speculative load of {url} failed: {e}")
+            document = None
+
+        with self.lock:
+            is_pending = url in self.pending and self.pending[url][1] is stop
+            if is_pending:
+                del self.pending[url]
+            if document is None or not is_pending or document.size > self.budget_bytes:
+                return
+            self.documents[url] = document
+            self.size += document.size
+            while self.size > self.budget_bytes:
+                _, evicted = self.documents.popitem(last=False)
+                self.size -= evicted.size
+        logger.debug(f"Speculatively loaded {document}")
+
+    def _load(self, url: str, stop: threading.Event) -> PrefetchedDocument | None:
+        chunks = []
+        size = 0
+        timing = RequestTiming(url)
+        with network.stream(url, timing) as response:
+            for chunk in response.iter_bytes():
+                if stop.is_set():
+                    return None
+                size += len(chunk)
+                # Stop early rather than download a document that can't be kept anyway
+                if size > self.budget_bytes:
+                    return None
+                chunks.append(chunk)
+
+        body = b"".join(chunks)
+        text = body.decode(response.charset(body), errors="replace")
+        tree = self.parse(text) if self.parse is not None and not stop.is_set() else None
+        return PrefetchedDocument(response.url, response.headers, text, size, tree, timing)
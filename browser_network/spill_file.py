@@ -0,0 +1,158 @@
+import mmap
+import re
+import tempfile
+from typing import BinaryIO, Iterable, Iterator
+
+# Characters handed out at a time when iterating over the text
+TEXT_CHUNK_SIZE = 64 * 1024
+
+# Bytes per character -> the codec storing every character in exactly that many bytes
+FIXED_WIDTH_CODECS = {1: "latin-1", 2: "utf-16-le", 4: "utf-32-le"}
+
+NON_ASCII_BYTE = re.compile(rb"[\x80-\xff]")
+
+
+def character_width(text: str) -> int:
+    """
+    The narrowest fixed width every character of the text fits in.
+    """
+    if not text or text.isascii():
+        return 1
+    highest = ord(max(text))
+    if highest < 0x100:
+        return 1
+    if highest < 0x10000:
+        return 2
+    return 4
+
+
+class MappedText:
+    """
+    Text kept in a file and read through a memory map, for documents too large to be held in memory as
+    a single 'str'. The operating system pages the parts that are being read in and out, so the memory
+    used stays bounded whatever the size of the text.
+
+    It supports what the parsers need from a 'str': 'len', indexing and slicing (which return a 'str'),
+    and iterating over it, which yields the text in chunks.
+
+    Every character is stored with the same width, so that indexing is a lookup rather than a scan:
+    1 byte per character (latin-1), 2 (UTF-16 without surrogate pairs) or 4 (UTF-32), whichever is the
+    narrowest that fits the whole text, like CPython does for 'str'.
+
+    'spill' writes text to a temporary file (deleted once the text is closed or garbage collected), and
+    'wrap' maps a file that already holds the text (ex. a local document) without copying it.
+    """
+
+    def __init__(self, map: mmap.mmap | bytes, width: int = 1, file: BinaryIO | None = None) -> None:
+        self.map = map
+        self.width = width
+        self.length = len(map) // width
+        # The temporary file the text was spilled to, if any
+        self.file = file
+
+    @staticmethod
+    def spill(chunks: Iterable[str], directory: str | None = None) -> "MappedText":
+        """
+        Writes the text to a temporary file as the chunks arrive. The width is picked as the text is written,
+        and what was written so far is rewritten if a later chunk needs a wider one.
+        """
+        width = 1
+        file = tempfile.TemporaryFile(dir=directory)
+        try:
+            for chunk in chunks:
+                chunk_width = character_width(chunk)
+                if chunk_width > width:
+                    file = widen(file, width, chunk_width, directory)
+                    width = chunk_width
+                file.write(chunk.encode(FIXED_WIDTH_CODECS[width], errors="surrogatepass"))
+            file.flush()
+            # An empty file can't be mapped
+            map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if file.tell() else b""
+        except BaseException:
+            file.close()
+            raise
+        return MappedText(map, width, file)
+
+    @staticmethod
+    def wrap(buffer: mmap.mmap) -> "MappedText | None":
+        """
+        Uses mapped bytes as the text, which only works when every byte is a character of its own, so this
+        returns 'None' unless the bytes are ASCII (which reads the same in every ASCII compatible charset).
+        """
+        if NON_ASCII_BYTE.search(buffer):
+            return None
+        return MappedText(buffer)
+
+    @property
+    def codec(self) -> str:
+        return FIXED_WIDTH_CODECS[self.width]
+
+    @property
+    def size(self) -> int:
+        """
+        Bytes taken by the text on disk.
+        """
+        return self.length * self.width
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: int | slice) -> str:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return self[start:stop][::step] if step > 0 else self[stop + 1 : start + 1][::step]
+            if start >= stop:
+                return ""
+            return self._decode(start, stop)
+
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("MappedText index out of range")
+        return self._decode(index, index + 1)
+
+    def __iter__(self) -> Iterator[str]:
+        return self.chunks()
+
+    def chunks(self, chunk_size: int = TEXT_CHUNK_SIZE) -> Iterator[str]:
+        for start in range(0, self.length, chunk_size):
+            yield self._decode(start, min(start + chunk_size, self.length))
+
+    def _decode(self, start: int, stop: int) -> str:
+        return self.map[start * self.width : stop * self.width].decode(self.codec, errors="surrogatepass")
+
+    def close(self) -> None:
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self) -> "MappedText":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"< MappedText length={self.length} width={self.width} >"
+
+
+def widen(file: BinaryIO, width: int, wider: int, directory: str | None = None) -> BinaryIO:
+    """
+    Rewrites the characters written to the file so far with a wider width, and returns the new file.
+    """
+    widened = tempfile.TemporaryFile(dir=directory)
+    try:
+        file.seek(0)
+        # A multiple of every width, so a block never ends in the middle of a character
+        block_size = 4 * TEXT_CHUNK_SIZE
+        while block := file.read(block_size):
+            text = block.decode(FIXED_WIDTH_CODECS[width], errors="surrogatepass")
+            widened.write(text.encode(FIXED_WIDTH_CODECS[wider], errors="surrogatepass"))
+    except BaseException:
+        widened.close()
+        raise
+    finally:
+        file.close()
+    return widened
@@ -0,0 +1,72 @@
+import socket
+import pytest
+from browser_network.connection_pool import ConnectionPool
+from browser_network.dns_cache import DNSCache
+
+
+class StandInResolver:
+    """
+    Answers lookups from a fixed table instead of the network, and counts how often it is asked.
+    """
+
+    def __init__(self, hosts: dict[str, str]) -> None:
+        self.hosts = hosts
+        self.lookups: list[str] = []
+
+    def __call__(self, host: str, port: int):
+        self.lookups.append(host)
+        if host not in self.hosts:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (self.hosts[host], port))]
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lookups_are_cached_until_the_ttl_expires():
+    resolver, clock = StandInResolver({"example.test": "10.0.0.1"}), Clock()
+    cache = DNSCache(resolver, ttl=60, clock=clock)
+
+    assert cache.resolve("example.test", 80) == [(socket.AF_INET, ("10.0.0.1", 80))]
+    clock.now = 59
+    cache.resolve("example.test", 80)
+    assert resolver.lookups == ["example.test"]
+
+    clock.now = 61
+    cache.resolve("example.test", 80)
+    assert resolver.lookups == ["example.test", "example.test"]
+
+
+def test_failed_lookups_are_cached_for_the_negative_ttl():
+    resolver, clock = StandInResolver({}), Clock()
+    cache = DNSCache(resolver, ttl=60, negative_ttl=5, clock=clock)
+
+    for _ in range(3):
+        with pytest.raises(socket.gaierror):
+            cache.resolve("missing.test", 80)
+    assert resolver.lookups == ["missing.test"]
+
+    clock.now = 6
+    with pytest.raises(socket.gaierror):
+        cache.resolve("missing.test", 80)
+    assert resolver.lookups == ["missing.test", "missing.test"]
+
+
+def test_connections_use_the_cached_addresses():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+
+    resolver = StandInResolver({"example.test": "127.0.0.1"})
+    pool = ConnectionPool(DNSCache(resolver), idle_timeout=0)
+    for _ in range(2):
+        pool.release(pool.acquire("http", "example.test", port), reusable=False)
+
+    assert resolver.lookups == ["example.test"]
+    listener.close()
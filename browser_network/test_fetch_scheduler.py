@@ -0,0 +1,109 @@
+import threading
+import pytest
+from browser_network.fetch_scheduler import FetchScheduler, Priority
+
+
+class Gate:
+    """
+    Stand-in for a fetch, records when it starts and blocks until it is released.
+    """
+
+    def __init__(self) -> None:
+        self.started: list[str] = []
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+
+    def fetch(self, name: str) -> str:
+        with self.lock:
+            self.started.append(name)
+        assert self.release.wait(5)
+        return name
+
+
+def wait_for(condition) -> None:
+    for _ in range(500):
+        if condition():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("Timed out")
+
+
+def test_queued_fetches_start_in_priority_order():
+    scheduler = FetchScheduler(max_total=2, max_per_host=2, max_low_priority=1)
+    gate = Gate()
+    blockers = [scheduler.submit(Priority.DOCUMENT, "http://a.test/", gate.fetch, f"blocker {i}") for i in range(2)]
+    wait_for(lambda: len(gate.started) == 2)
+
+    futures = [
+        scheduler.submit(Priority.SPECULATIVE, "http://b.test/next", gate.fetch, "speculative"),
+        scheduler.submit(Priority.LOW, "http://b.test/image", gate.fetch, "low"),
+        scheduler.submit(Priority.RENDER_BLOCKING, "http://b.test/style.css", gate.fetch, "stylesheet"),
+        scheduler.submit(Priority.DOCUMENT, "http://b.test/", gate.fetch, "document"),
+    ]
+    gate.release.set()
+    assert [future.result(5) for future in blockers + futures] == ["blocker 0", "blocker 1"] + [
+        "speculative",
+        "low",
+        "stylesheet",
+        "document",
+    ]
+    assert gate.started[2:4] == ["document", "stylesheet"]
+
+
+def test_fetches_to_the_same_origin_are_limited():
+    scheduler = FetchScheduler(max_total=8, max_per_host=2, max_low_priority=4)
+    gate = Gate()
+    for i in range(3):
+        scheduler.submit(Priority.RENDER_BLOCKING, "http://a.test/", gate.fetch, f"a {i}")
+    scheduler.submit(Priority.RENDER_BLOCKING, "http://b.test/", gate.fetch, "b")
+
+    wait_for(lambda: len(gate.started) == 3)
+    assert sorted(gate.started) == ["a 0", "a 1", "b"]
+    assert scheduler.pending == 1
+    gate.release.set()
+    wait_for(lambda: len(gate.started) == 4)
+
+
+def test_critical_fetches_never_wait_behind_speculative_ones():
+    scheduler = FetchScheduler(max_total=4, max_per_host=3, max_low_priority=3)
+    gate = Gate()
+    for i in range(6):
+        scheduler.submit(Priority.SPECULATIVE, f"http://{i % 2}.test/", gate.fetch, f"speculative {i}")
+    # Every speculative fetch leaves a slot on its origin free, and together they leave a slot free overall
+    wait_for(lambda: len(gate.started) == 3)
+    assert scheduler.pending == 3
+
+    stylesheet = scheduler.submit(Priority.RENDER_BLOCKING, "http://0.test/style.css", gate.fetch, "stylesheet")
+    wait_for(lambda: "stylesheet" in gate.started)
+    gate.release.set()
+    assert stylesheet.result(5) == "stylesheet"
+
+
+def test_cancel_drops_the_queued_fetches_of_an_owner():
+    scheduler = FetchScheduler(max_total=2, max_per_host=1, max_low_priority=1)
+    gate = Gate()
+    tab, other_tab = object(), object()
+    running = scheduler.submit(Priority.DOCUMENT, "http://a.test/", gate.fetch, "running", owner=tab)
+    wait_for(lambda: gate.started == ["running"])
+    queued = scheduler.submit(Priority.RENDER_BLOCKING, "http://a.test/a.css", gate.fetch, "queued", owner=tab)
+    other = scheduler.submit(Priority.RENDER_BLOCKING, "http://a.test/b.css", gate.fetch, "other", owner=other_tab)
+
+    assert scheduler.cancel(tab) == 1
+    assert queued.cancelled()
+    gate.release.set()
+    assert running.result(5) == "running"
+    assert other.result(5) == "other"
+    assert gate.started == ["running", "other"]
+
+
+def test_failures_are_reported_through_the_future():
+    scheduler = FetchScheduler()
+    with pytest.raises(AssertionError):
+        scheduler.submit(Priority.LOW, "httpx://a.test/", print).result(5)
+
+    def fail() -> None:
+        raise ConnectionResetError("reset")
+
+    with pytest.raises(ConnectionResetError):
+        scheduler.submit(Priority.LOW, "http://a.test/", fail).result(5)
+    wait_for(lambda: scheduler.running == 0)
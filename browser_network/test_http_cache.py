@@ -0,0 +1,54 @@
+from browser_network.http_cache import HTTPCache
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = HTTPCache(memory_bytes=10, directory=None)
+    headers = {"cache-control": "max-age=60"}
+
+    cache.store("http://a.com/1.css", headers, b"12345")
+    cache.store("http://a.com/2.css", headers, b"12345")
+    cache.lookup("http://a.com/1.css")
+    cache.store("http://a.com/3.css", headers, b"12345")
+
+    assert list(cache.memory) == ["http://a.com/1.css", "http://a.com/3.css"]
+    assert cache.memory_size == 10
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    headers = {"cache-control": "max-age=60", "content-encoding": "gzip", "etag": '"v1"'}
+    HTTPCache(directory=str(tmp_path)).store("http://a.com/style.css", headers, b"p { color: red; }")
+
+    entry = HTTPCache(directory=str(tmp_path)).lookup("http://a.com/style.css")
+
+    assert entry is not None
+    assert entry.body == b"p { color: red; }"
+    # The cached body is already decompressed
+    assert entry.headers == {"cache-control": "max-age=60", "etag": '"v1"'}
+    assert entry.conditional_headers() == {"If-None-Match": '"v1"'}
+
+
+def test_disk_tier_is_bounded_by_bytes(tmp_path):
+    cache = HTTPCache(memory_bytes=0, disk_bytes=10, directory=str(tmp_path))
+    headers = {"cache-control": "max-age=60"}
+
+    cache.store("http://a.com/1.css", headers, b"12345")
+    cache.store("http://a.com/2.css", headers, b"12345")
+    cache.store("http://a.com/3.css", headers, b"12345")
+
+    assert cache.lookup("http://a.com/1.css") is None
+    assert cache.lookup("http://a.com/3.css") is not None
+    assert len(list(tmp_path.glob("*.body"))) == 2
+
+
+def test_max_age_and_no_store():
+    now = 1000.0
+    cache = HTTPCache(directory=None, clock=lambda: now)
+
+    assert cache.store("http://a.com/a", {"cache-control": "no-store"}, b"a") is None
+    # Nothing to revalidate with and no lifetime, so there is no point in storing it
+    assert cache.store("http://a.com/b", {}, b"b") is None
+
+    entry = cache.store("http://a.com/c", {"cache-control": "max-age=60"}, b"c")
+    assert entry is not None and cache.is_fresh(entry)
+    now += 61
+    assert not cache.is_fresh(entry)
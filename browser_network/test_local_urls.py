@@ -0,0 +1,72 @@
+import base64
+import pytest
+from browser_network import network
+from browser_network.fetch_scheduler import FetchScheduler, Priority
+from browser_network.local_urls import file_path, file_url, parse_data_url
+from browser_network.request_timing import RequestTiming
+from browser_network.spill_file import MappedText
+
+
+def test_data_urls_are_decoded():
+    headers, body = parse_data_url("data:text/css,p%20%7B%20color%3A%20red%3B%20%7D")
+    assert headers["content-type"] == "text/css"
+    assert body == b"p { color: red; }"
+
+    encoded = base64.b64encode("<p>10 €</p>".encode("utf8")).decode("ascii")
+    headers, body = parse_data_url(f"data:text/html;charset=utf-8;base64,{encoded}")
+    assert headers["content-type"] == "text/html;charset=utf-8"
+    assert body.decode("utf8") == "<p>10 €</p>"
+
+    headers, body = parse_data_url("data:,Hello")
+    assert headers["content-type"] == "text/plain;charset=US-ASCII"
+    assert body == b"Hello"
+
+    with pytest.raises(AssertionError):
+        parse_data_url("data:text/plain")
+
+
+def test_file_urls_round_trip(tmp_path):
+    page = tmp_path / "my page.html"
+    url = file_url(str(page))
+    assert url.startswith("file:///") and "my%20page.html" in url
+    assert file_path(url + "#top") == str(page)
+
+    with pytest.raises(AssertionError):
+        file_path("file://example.org/index.html")
+
+
+def test_local_urls_load_like_network_urls(tmp_path):
+    (tmp_path / "index.html").write_text("<p>10 €</p>", encoding="utf8")
+    (tmp_path / "style.css").write_text("p { color: red; }")
+    url = file_url(str(tmp_path / "index.html"))
+
+    timing = RequestTiming(url)
+    final_url, headers, body = network.download(url, timing)
+    assert (final_url, body) == (url, "<p>10 €</p>")
+    assert headers["content-type"] == "text/html"
+    assert timing.source == "file" and timing.end is not None
+
+    # Relative stylesheets resolve next to the document
+    headers, body = network.request(network.resolve_url("style.css", url))
+    assert body == "p { color: red; }"
+    headers, body = network.request(network.resolve_url("data:text/css,p{}", url))
+    assert body == "p{}"
+
+    scheduler = FetchScheduler(max_total=2, max_per_host=1, max_low_priority=1)
+    future = scheduler.submit(Priority.RENDER_BLOCKING, url, network.request, url)
+    assert future.result(timeout=5)[1] == "<p>10 €</p>"
+
+
+def test_large_files_are_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr("browser_network.response.SPILL_THRESHOLD_BYTES", 16)
+    (tmp_path / "ascii.html").write_text("<p>" + "a" * 100 + "</p>")
+    (tmp_path / "latin.html").write_text("<p>" + "é" * 100 + "</p>", encoding="utf8")
+
+    final_url, headers, body = network.download(file_url(str(tmp_path / "ascii.html")))
+    # An ASCII file is used as it is, instead of being copied to a spill file
+    assert isinstance(body, MappedText) and body.file is None
+    assert body[0 : len(body)] == "<p>" + "a" * 100 + "</p>"
+
+    final_url, headers, body = network.download(file_url(str(tmp_path / "latin.html")))
+    assert isinstance(body, MappedText) and body.width == 1
+    assert body[0 : len(body)] == "<p>" + "é" * 100 + "</p>"
@@ -0,0 +1,658 @@
+import asyncio
+import gzip
+import json
+import random
+import socket
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from browser_config import MAX_REDIRECTS
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from browser_network import network
+from browser_network.async_network import async_download, async_request
+from browser_network.connection_pool import ConnectionPool
+from browser_network.http_cache import HTTPCache
+from browser_network.preload_cache import PreloadCache
+from browser_network.redirect_cache import RedirectCache
+from browser_network.timeouts import HedgingPolicy, NetworkTimeoutError
+from browser_network.request_timing import NetworkLog
+from browser_network.resource_hints import ResourceHints
+from browser_network.speculative_loader import SpeculativeLoader
+from browser_network.spill_file import MappedText
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves 'self.server.pages' (path -> body) over HTTP/1.1 and counts the TCP connections it accepts.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self) -> None:
+        self.server.requests.append(self.path)
+        time.sleep(self.server.delays.get(self.path, 0))
+        if self.path in self.server.stall_once:
+            self.server.stall_once.remove(self.path)
+            time.sleep(1)
+        if self.path in self.server.redirects:
+            status, location = self.server.redirects[self.path]
+            body = b"Moved"
+            self.send_response(status)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path in self.server.validators:
+            etag = self.server.validators[self.path]
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+        if self.path in self.server.chunked_pages:
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            if self.path in self.server.content_types:
+                self.send_header("Content-Type", self.server.content_types[self.path])
+            self.end_headers()
+            for chunk in self.server.chunked_pages[self.path]:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+                time.sleep(self.server.chunk_delays.get(self.path, 0))
+            self.wfile.write(b"0\r\n\r\n")
+            return
+
+        body = self.server.pages.get(self.path, b"")
+        self.send_response(200 if self.path in self.server.pages else 404)
+        # Compress the response like a real server would, when the client says it can decompress it
+        accepted = self.headers.get("Accept-Encoding", "")
+        if self.path.endswith(".css") and "gzip" in accepted:
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        elif self.path.endswith(".html") and "deflate" in accepted:
+            body = zlib.compress(body)
+            self.send_header("Content-Encoding", "deflate")
+        self.send_header("Content-Length", str(len(body)))
+        if self.path in self.server.validators:
+            self.send_header("ETag", self.server.validators[self.path])
+        if self.path in self.server.content_types:
+            self.send_header("Content-Type", self.server.content_types[self.path])
+        if self.path in self.server.cache_control:
+            self.send_header("Cache-Control", self.server.cache_control[self.path])
+        if self.path.startswith("/close"):
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    # Clients hang up on purpose in some tests (ex. the losing side of a hedged request)
+    server.handle_error = lambda request, client_address: None
+    server.connections = 0
+    server.requests = []
+    server.validators = {}
+    server.cache_control = {}
+    server.content_types = {}
+    server.delays = {}
+    server.chunk_delays = {}
+    server.redirects = {}
+    server.stall_once = set()
+    server.pages = {
+        "/index.html": b"<html><body>Hello</body></html>",
+        "/style.css": b"p { color: red; }",
+        "/close.html": b"<p>bye</p>",
+    }
+    # The euro sign is split across two chunks
+    server.chunked_pages = {"/chunked.html": [b"<p>", b"10 \xe2\x82", b"\xac</p>"]}
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool(monkeypatch):
+    pool = ConnectionPool()
+    monkeypatch.setattr(network, "pool", pool)
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture(autouse=True)
+def fresh_preload_cache(monkeypatch):
+    preloaded = PreloadCache()
+    monkeypatch.setattr(network, "preloaded", preloaded)
+    return preloaded
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch, tmp_path):
+    cache = HTTPCache(directory=str(tmp_path / "http"))
+    monkeypatch.setattr(network, "cache", cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_redirects(monkeypatch):
+    redirects = RedirectCache()
+    monkeypatch.setattr(network, "redirects", redirects)
+    return redirects
+
+
+@pytest.fixture(autouse=True)
+def fresh_hedging(monkeypatch):
+    hedging = HedgingPolicy()
+    monkeypatch.setattr(network, "hedging", hedging)
+    return hedging
+
+
+def url(server, path: str) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def test_requests_to_the_same_host_reuse_the_connection(server):
+    headers, body = network.request(url(server, "/index.html"))
+    assert body == "<html><body>Hello</body></html>"
+
+    headers, body = network.request(url(server, "/style.css"))
+    assert body == "p { color: red; }"
+
+    assert server.connections == 1
+
+
+def test_connection_close_is_not_reused(server, fresh_pool):
+    network.request(url(server, "/close.html"))
+    network.request(url(server, "/close.html"))
+
+    assert server.connections == 2
+    assert fresh_pool.open_count[("http", "127.0.0.1", server.server_address[1])] == 0
+
+
+def test_idle_connections_expire(server, fresh_pool):
+    fresh_pool.idle_timeout = 0
+    network.request(url(server, "/index.html"))
+    network.request(url(server, "/index.html"))
+
+    assert server.connections == 2
+
+
+def test_max_connections_per_host(server, fresh_pool):
+    fresh_pool.max_per_host = 1
+    port = server.server_address[1]
+    first = fresh_pool.acquire("http", "127.0.0.1", port)
+
+    acquired = threading.Event()
+
+    def acquire_second():
+        fresh_pool.release(fresh_pool.acquire("http", "127.0.0.1", port), reusable=True)
+        acquired.set()
+
+    threading.Thread(target=acquire_second, daemon=True).start()
+    # The second caller has to wait until the only allowed connection is released
+    assert not acquired.wait(0.1)
+
+    fresh_pool.release(first, reusable=True)
+    assert acquired.wait(1)
+    assert server.connections == 1
+
+
+def test_chunked_body_is_decoded(server):
+    headers, body = network.request(url(server, "/chunked.html"))
+
+    assert headers["transfer-encoding"] == "chunked"
+    assert body == "<p>10 \u20ac</p>"
+
+
+def test_streamed_body_arrives_in_chunks(server):
+    with network.stream(url(server, "/chunked.html")) as response:
+        chunks = list(response.iter_bytes())
+        assert chunks == [b"<p>", b"10 \xe2\x82", b"\xac</p>"]
+
+    # A fully read chunked body leaves the connection ready for the next request
+    network.request(url(server, "/index.html"))
+    assert server.connections == 1
+
+
+def test_streamed_text_keeps_split_characters_whole(server):
+    with network.stream(url(server, "/chunked.html")) as response:
+        assert "".join(response.iter_text()) == "<p>10 \u20ac</p>"
+
+
+def test_streamed_text_starts_before_the_body_is_complete(server):
+    server.chunked_pages["/slow.html"] = [b"<html><head>", b"<body>tail</body></html>"]
+    server.chunk_delays["/slow.html"] = 0.5
+    server.content_types["/slow.html"] = "text/html; charset=utf-8"
+
+    start = time.monotonic()
+    with network.stream(url(server, "/slow.html")) as response:
+        chunks = response.iter_text()
+        assert next(chunks) == "<html><head>"
+        # The charset comes from the headers, so the first chunk isn't held back to look for a '<meta charset>'
+        assert time.monotonic() - start < 0.4
+        assert "".join(chunks) == "<body>tail</body></html>"
+
+
+def test_gzip_body_is_decompressed(server):
+    headers, body = network.request(url(server, "/style.css"))
+
+    assert headers["content-encoding"] == "gzip"
+    assert int(headers["content-length"]) == len(gzip.compress(b"p { color: red; }"))
+    assert body == "p { color: red; }"
+
+
+def test_deflate_body_is_decompressed_while_streaming(server):
+    server.pages["/large.html"] = b"<p>" + random.Random(0).randbytes(20_000).hex().encode() + b"</p>"
+
+    with network.stream(url(server, "/large.html")) as response:
+        assert response.headers["content-encoding"] == "deflate"
+        chunks = list(response.iter_bytes(chunk_size=1024))
+
+    assert len(chunks) > 1
+    assert b"".join(chunks) == server.pages["/large.html"]
+
+
+def test_raw_deflate_body_is_decompressed():
+    from browser_network.response import ContentDecoder
+
+    for wbits in [-zlib.MAX_WBITS, zlib.MAX_WBITS]:
+        compressor = zlib.compressobj(wbits=wbits)
+        data = compressor.compress(b"<p>raw deflate</p>") + compressor.flush()
+
+        decoder = ContentDecoder("deflate")
+        assert decoder.decompress(data[:5]) + decoder.decompress(data[5:]) + decoder.flush() == b"<p>raw deflate</p>"
+        # A first chunk of a single byte is too short to tell whether there is a zlib header
+        decoder = ContentDecoder("deflate")
+        decoded = decoder.decompress(data[:1]) + decoder.decompress(data[1:]) + decoder.flush()
+        assert decoded == b"<p>raw deflate</p>"
+    assert ContentDecoder("deflate").flush() == b""
+
+
+def test_fresh_responses_are_served_from_the_cache(server):
+    server.cache_control["/style.css"] = "max-age=60"
+
+    assert network.request(url(server, "/style.css"))[1] == "p { color: red; }"
+    assert network.request(url(server, "/style.css"))[1] == "p { color: red; }"
+
+    assert server.requests == ["/style.css"]
+
+
+def test_no_store_responses_are_refetched(server):
+    server.cache_control["/style.css"] = "no-store, max-age=60"
+
+    network.request(url(server, "/style.css"))
+    network.request(url(server, "/style.css"))
+
+    assert server.requests == ["/style.css", "/style.css"]
+
+
+def test_stale_responses_are_revalidated(server, fresh_cache):
+    server.validators["/index.html"] = '"v1"'
+
+    network.request(url(server, "/index.html"))
+    # The body isn't sent again, the cached one is used
+    server.pages["/index.html"] = b""
+    headers, body = network.request(url(server, "/index.html"))
+
+    assert body == "<html><body>Hello</body></html>"
+    assert headers["etag"] == '"v1"'
+    assert server.requests == ["/index.html", "/index.html"]
+    # Both requests went over the same connection, since the '304' has no body
+    assert server.connections == 1
+
+
+def test_body_is_decoded_with_the_content_type_charset(server):
+    server.pages["/latin.txt"] = "caf\u00e9".encode("latin-1")
+    server.content_types["/latin.txt"] = "text/plain; charset=ISO-8859-1"
+
+    assert network.request(url(server, "/latin.txt"))[1] == "caf\u00e9"
+
+
+def test_body_is_decoded_with_the_meta_charset(server):
+    server.pages["/sjis.txt"] = '<meta charset="shift_jis"><p>\u3053\u3093\u306b\u3061\u306f</p>'.encode("shift_jis")
+
+    assert network.request(url(server, "/sjis.txt"))[1].endswith("<p>\u3053\u3093\u306b\u3061\u306f</p>")
+    with network.stream(url(server, "/sjis.txt")) as response:
+        assert "".join(response.iter_text()).endswith("<p>\u3053\u3093\u306b\u3061\u306f</p>")
+
+
+def test_invalid_bytes_do_not_fail_the_page(server):
+    server.pages["/broken.txt"] = b"<p>\xff</p>"
+
+    assert network.request(url(server, "/broken.txt"))[1] == "<p>\ufffd</p>"
+
+
+def test_concurrent_requests_for_the_same_url_share_one_download(server):
+    server.delays["/style.css"] = 0.2
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(network.request, [url(server, "/style.css")] * 4))
+
+    assert [body for headers, body in results] == ["p { color: red; }"] * 4
+    assert server.requests == ["/style.css"]
+
+
+def test_requests_wait_for_an_in_flight_stream(server):
+    with network.stream(url(server, "/index.html")) as response:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            joined = executor.submit(network.request, url(server, "/index.html"))
+            # Give the second request time to find the in-flight one before its body is read
+            time.sleep(0.1)
+            assert "".join(response.iter_text()) == "<html><body>Hello</body></html>"
+            assert joined.result()[1] == "<html><body>Hello</body></html>"
+
+    assert server.requests == ["/index.html"]
+    # Once a download is finished, the next request for the url goes to the network again
+    network.request(url(server, "/index.html"))
+    assert server.requests == ["/index.html", "/index.html"]
+
+
+def test_async_requests_run_while_the_event_loop_keeps_going(server):
+    server.delays["/style.css"] = 0.2
+    server.redirects["/old.html"] = (302, "/index.html")
+    ticks = []
+
+    async def tick() -> None:
+        while True:
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def load():
+        ticking = asyncio.create_task(tick())
+        try:
+            return await asyncio.gather(
+                async_request(url(server, "/style.css")), async_download(url(server, "/old.html"))
+            )
+        finally:
+            ticking.cancel()
+
+    (headers, stylesheet), (final_url, _, document) = asyncio.run(load())
+
+    assert stylesheet == "p { color: red; }"
+    assert final_url == url(server, "/index.html") and document == "<html><body>Hello</body></html>"
+    # The loop wasn't blocked while the stylesheet was on its way
+    assert len(ticks) > 5
+
+
+def test_requests_waiting_for_a_large_body_fetch_it_themselves(server, monkeypatch):
+    monkeypatch.setattr("browser_network.response.SPILL_THRESHOLD_BYTES", 1024)
+    body = "<p>" + "x" * 4000 + "</p>"
+    server.pages["/large.html"] = body.encode("utf8")
+
+    with network.stream(url(server, "/large.html")) as response:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            joined = executor.submit(network.download, url(server, "/large.html"))
+            # Give the second request time to find the in-flight one before its body is read
+            time.sleep(0.1)
+            chunks = response.iter_bytes(512)
+            read = []
+            while response.decoded_bytes <= 1024:
+                read.append(next(chunks))
+            # The body is too large to be shared, the waiting request gets it on its own, without waiting
+            # for the first one to be read
+            final_url, headers, text = joined.result(timeout=5)
+            assert text[0 : len(text)] == body
+            assert isinstance(text, MappedText)
+            text.close()
+        read.extend(chunks)
+        assert b"".join(read) == body.encode("utf8")
+
+    assert server.requests == ["/large.html", "/large.html"]
+
+
+def test_preconnect_parks_a_connection_in_the_pool(server):
+    ResourceHints().hint("preconnect", url(server, "/")).result()
+    # The connection is open once the client is connected, which can be before the server thread accepted it
+    deadline = time.monotonic() + 5
+    while server.connections == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert server.connections == 1
+    assert server.requests == []
+
+    network.request(url(server, "/index.html"))
+    assert server.connections == 1
+
+
+def test_preloaded_responses_are_used_once(server):
+    server.cache_control["/style.css"] = "no-store"
+
+    ResourceHints().hint("preload", url(server, "/style.css")).result()
+    assert network.request(url(server, "/style.css"))[1] == "p { color: red; }"
+    assert server.requests == ["/style.css"]
+
+    network.request(url(server, "/style.css"))
+    assert server.requests == ["/style.css", "/style.css"]
+
+
+def test_speculative_loads_are_taken_once(server):
+    loader = SpeculativeLoader(parse=len)
+    loader.prefetch(url(server, "/index.html")).result()
+
+    document = loader.take(url(server, "/index.html"))
+    assert document is not None
+    assert document.text == "<html><body>Hello</body></html>"
+    assert document.tree == len(document.text)
+    assert loader.take(url(server, "/index.html")) is None
+    assert server.requests == ["/index.html"]
+
+
+def test_cancelled_speculative_loads_are_dropped(server):
+    server.delays["/index.html"] = 0.2
+    loader = SpeculativeLoader()
+    future = loader.prefetch(url(server, "/index.html"))
+
+    loader.cancel()
+    if not future.cancelled():
+        future.result()
+    assert loader.take(url(server, "/index.html")) is None
+
+
+def test_speculative_loads_stay_within_the_budget(server):
+    loader = SpeculativeLoader(budget_bytes=40)
+    loader.prefetch(url(server, "/index.html")).result()
+    loader.prefetch(url(server, "/close.html")).result()
+
+    assert list(loader.documents) == [url(server, "/close.html")]
+    assert loader.size == len(b"<p>bye</p>")
+
+
+def test_requests_record_their_timing(server):
+    server.delays["/index.html"] = 0.05
+    server.cache_control["/index.html"] = "max-age=60"
+    log = NetworkLog()
+    log.start_page(url(server, "/index.html"))
+
+    network.request(url(server, "/index.html"), log.record(url(server, "/index.html")))
+    network.request(url(server, "/index.html"), log.record(url(server, "/index.html")))
+
+    first, second = log.entries
+    assert first.source == "network"
+    assert first.status == 200
+    assert first.dns is not None and first.connect is not None and first.tls is None
+    assert first.wait >= 0.05
+    assert first.time_to_first_byte >= first.wait
+    assert first.body_bytes == len(zlib.compress(server.pages["/index.html"]))
+    assert first.content_bytes == len(server.pages["/index.html"])
+    assert first.total >= first.time_to_first_byte
+
+    assert second.source == "cache"
+    assert second.dns is None and second.wait is None
+    assert second.body_bytes == 0
+    assert second.content_bytes == len(server.pages["/index.html"])
+
+
+def test_reused_connections_skip_the_handshake_timings(server):
+    log = NetworkLog()
+    network.request(url(server, "/index.html"), log.record(url(server, "/index.html")))
+    network.request(url(server, "/style.css"), log.record(url(server, "/style.css")))
+
+    assert not log.entries[0].connection_reused
+    assert log.entries[1].connection_reused
+    assert log.entries[1].dns is None and log.entries[1].connect is None
+
+
+def test_network_log_exports_har(server, tmp_path):
+    log = NetworkLog()
+    log.start_page(url(server, "/index.html"))
+    with network.stream(url(server, "/chunked.html"), log.record(url(server, "/chunked.html"))) as response:
+        "".join(response.iter_text())
+
+    log.export_har(str(tmp_path / "page.har"))
+    with open(tmp_path / "page.har") as file:
+        har = json.load(file)
+
+    assert har["log"]["version"] == "1.2"
+    assert [page["id"] for page in har["log"]["pages"]] == ["page_1"]
+    (entry,) = har["log"]["entries"]
+    assert entry["pageref"] == "page_1"
+    assert entry["request"]["url"] == url(server, "/chunked.html")
+    assert {"name": "Connection", "value": "keep-alive"} in entry["request"]["headers"]
+    assert entry["response"]["status"] == 200
+    assert entry["response"]["content"]["size"] == len("<p>10 €</p>".encode("utf8"))
+    assert entry["timings"]["ssl"] == -1
+    assert all(entry["timings"][phase] >= 0 for phase in ["dns", "connect", "send", "wait", "receive"])
+
+
+def test_redirects_are_followed(server):
+    server.redirects["/old.html"] = (302, "/index.html")
+
+    final_url, headers, body = network.download(url(server, "/old.html"))
+    assert final_url == url(server, "/index.html")
+    assert body == "<html><body>Hello</body></html>"
+    assert server.connections == 1
+
+    network.request(url(server, "/old.html"))
+    assert server.requests == ["/old.html", "/index.html", "/old.html", "/index.html"]
+
+
+def test_permanent_redirects_skip_the_round_trip(server):
+    server.redirects["/old.html"] = (301, url(server, "/older.html"))
+    server.redirects["/older.html"] = (308, "index.html")
+
+    log = NetworkLog()
+    network.request(url(server, "/old.html"), log.record(url(server, "/old.html")))
+    assert server.requests == ["/old.html", "/older.html", "/index.html"]
+    assert log.entries[0].url == url(server, "/index.html")
+    assert log.entries[0].redirects == [url(server, "/old.html"), url(server, "/older.html")]
+
+    final_url, headers, body = network.download(url(server, "/old.html"))
+    assert final_url == url(server, "/index.html")
+    assert server.requests == ["/old.html", "/older.html", "/index.html", "/index.html"]
+
+
+def test_redirect_loops_give_up(server):
+    server.redirects["/a.html"] = (302, "/b.html")
+    server.redirects["/b.html"] = (302, "/a.html")
+
+    with pytest.raises(AssertionError, match="Too many redirects"):
+        network.request(url(server, "/a.html"))
+    assert len(server.requests) == MAX_REDIRECTS + 1
+
+
+def test_stalled_responses_time_out(server, monkeypatch):
+    pool = ConnectionPool(read_timeout=0.1)
+    monkeypatch.setattr(network, "pool", pool)
+    server.delays["/index.html"] = 0.5
+
+    log = NetworkLog()
+    with pytest.raises(NetworkTimeoutError) as error:
+        network.request(url(server, "/index.html"), log.record(url(server, "/index.html")))
+    assert (error.value.phase, error.value.timeout, error.value.url) == ("read", 0.1, url(server, "/index.html"))
+    assert log.entries[0].error.startswith("NetworkTimeoutError")
+    pool.close_all()
+
+
+def test_requests_time_out_as_a_whole(server):
+    server.chunked_pages["/slow.html"] = [b"<p>"] * 5
+    server.delays["/slow.html"] = 0.3
+
+    start = time.perf_counter()
+    with pytest.raises(NetworkTimeoutError) as error:
+        network.request(url(server, "/slow.html"), timeout=0.1)
+    assert error.value.phase == "total"
+    assert time.perf_counter() - start < 0.3
+
+
+def test_stalled_handshakes_time_out(monkeypatch):
+    pool = ConnectionPool(connect_timeout=0.1)
+    monkeypatch.setattr(network, "pool", pool)
+    # Accepts connections (through the listen backlog) but never answers the TLS handshake
+    listener = socket.create_server(("127.0.0.1", 0))
+    try:
+        with pytest.raises(NetworkTimeoutError) as error:
+            network.request(f"https://127.0.0.1:{listener.getsockname()[1]}/")
+        assert error.value.phase == "connect"
+    finally:
+        listener.close()
+        pool.close_all()
+
+
+def test_late_first_bytes_are_hedged(server, monkeypatch):
+    monkeypatch.setattr(network, "hedging", HedgingPolicy(percentile=0.5, min_samples=1))
+    server.cache_control["/index.html"] = "no-store"
+    network.request(url(server, "/index.html"))
+
+    server.stall_once.add("/index.html")
+    log = NetworkLog()
+    start = time.perf_counter()
+    headers, body = network.request(url(server, "/index.html"), log.record(url(server, "/index.html")))
+    assert body == "<html><body>Hello</body></html>"
+    assert time.perf_counter() - start < 0.5
+    assert log.entries[0].hedged
+    assert server.requests == ["/index.html"] * 3
+
+
+def test_requests_are_not_hedged_when_the_pool_is_full(server, monkeypatch):
+    pool = ConnectionPool(max_per_host=1)
+    monkeypatch.setattr(network, "pool", pool)
+    monkeypatch.setattr(network, "hedging", HedgingPolicy(percentile=0.5, min_samples=1))
+    server.cache_control["/index.html"] = "no-store"
+    network.request(url(server, "/index.html"))
+
+    # Later than the hedging delay, but well within the timeout
+    server.delays["/index.html"] = 0.2
+    log = NetworkLog()
+    start = time.perf_counter()
+    try:
+        headers, body = network.request(url(server, "/index.html"), log.record(url(server, "/index.html")), timeout=3)
+    finally:
+        pool.close_all()
+    assert body == "<html><body>Hello</body></html>"
+    assert time.perf_counter() - start < 1
+    assert not log.entries[0].hedged
+    assert server.requests == ["/index.html"] * 2
+
+
+def test_large_bodies_are_spilled_to_disk(server, monkeypatch, fresh_cache):
+    monkeypatch.setattr("browser_network.response.SPILL_THRESHOLD_BYTES", 1024)
+    body = "<p>" + "é" * 2000 + "</p>"
+    encoded = body.encode("utf8")
+    server.pages["/large.html"] = encoded
+    # The chunks split some of the characters in two
+    server.chunked_pages["/large-chunked.html"] = [encoded[i : i + 701] for i in range(0, len(encoded), 701)]
+    server.cache_control["/large.html"] = "max-age=60"
+
+    for path in ["/large.html", "/large-chunked.html"]:
+        final_url, headers, text = network.download(url(server, path))
+        assert isinstance(text, MappedText)
+        assert text[0 : len(text)] == body
+        text.close()
+    # Keeping the body for the cache would hold it in memory
+    assert fresh_cache.lookup(url(server, "/large.html")) is None
+
+    headers, text = network.request(url(server, "/index.html"))
+    assert text == "<html><body>Hello</body></html>"
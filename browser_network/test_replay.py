@@ -0,0 +1,130 @@
+import time
+import pytest
+import browser_tab
+from benchmarks.replay_benchmark import replay
+from browser_html.dom_cache import DOMCache
+from browser_network import network
+from browser_network.connection_pool import ConnectionPool
+from browser_network.dns_cache import DNSCache
+from browser_network.http_cache import HTTPCache
+from browser_network.preload_cache import PreloadCache
+from browser_network.redirect_cache import RedirectCache
+from browser_network.replay_server import ReplayServer, replay_resolver
+from browser_network.traffic_archive import ArchivedResponse, TrafficArchive, TrafficRecorder
+
+
+@pytest.fixture
+def archive():
+    archive = TrafficArchive()
+    archive.add(
+        ArchivedResponse(
+            "http://example.test",
+            200,
+            "OK",
+            {"content-type": "text/html", "etag": '"v1"'},
+            b"<link rel=stylesheet href=style.css><p>Hi</p>",
+        )
+    )
+    archive.add(ArchivedResponse("http://example.test/style.css", 200, "OK", {}, b"p { color: red; }"))
+    archive.add(ArchivedResponse("http://example.test/old", 301, "Moved Permanently", {"location": "/"}, b""))
+    archive.add(ArchivedResponse("http://example.test/large", 200, "OK", {}, b"x" * 32 * 1024))
+    return archive
+
+
+@pytest.fixture
+def route_to(monkeypatch):
+    """
+    Sends every request made through 'network' to the given replay server.
+    """
+
+    def route(server: ReplayServer) -> None:
+        dns_cache = DNSCache(replay_resolver(server))
+        pool = ConnectionPool(dns_cache)
+        monkeypatch.setattr(network, "dns_cache", dns_cache)
+        monkeypatch.setattr(network, "pool", pool)
+        monkeypatch.setattr(network, "cache", HTTPCache(directory=None))
+        monkeypatch.setattr(network, "preloaded", PreloadCache())
+        monkeypatch.setattr(network, "redirects", RedirectCache())
+
+    yield route
+    network.pool.close_all()
+
+
+def test_urls_share_an_entry_with_their_normalized_form(archive):
+    assert archive.get("http://example.test:80/").body.startswith(b"<link")
+    assert archive.get("http://example.test:80/style.css") is archive.get("http://example.test/style.css")
+    assert archive.get("http://example.test:8080/style.css") is None
+
+
+def test_archives_are_saved_and_loaded(archive, tmp_path):
+    archive.save(str(tmp_path / "archive.json"))
+    loaded = TrafficArchive.load(str(tmp_path / "archive.json"))
+
+    assert len(loaded) == len(archive)
+    response = loaded.get("http://example.test/old")
+    assert (response.status, response.explanation, response.headers) == (301, "Moved Permanently", {"location": "/"})
+    assert loaded.get("http://example.test/large").body == b"x" * 32 * 1024
+
+
+def test_requests_are_answered_from_the_archive(archive, route_to):
+    with ReplayServer(archive) as server:
+        route_to(server)
+        final_url, headers, body = network.download("http://example.test/old")
+        headers, stylesheet = network.request("http://example.test/style.css")
+
+    assert final_url == "http://example.test/"
+    assert body == "<link rel=stylesheet href=style.css><p>Hi</p>"
+    assert stylesheet == "p { color: red; }"
+    assert server.requests == ["http://example.test/old", "http://example.test/", "http://example.test/style.css"]
+
+
+def test_urls_missing_from_the_archive_fail(archive, route_to):
+    with ReplayServer(archive) as server:
+        route_to(server)
+        with pytest.raises(AssertionError, match="404"):
+            network.request("http://example.test/missing.css")
+
+
+def test_latency_and_bandwidth_are_applied(archive, route_to):
+    with ReplayServer(archive, latency=0.05, bandwidth=320 * 1024) as server:
+        route_to(server)
+        start = time.perf_counter()
+        network.request("http://example.test/style.css")
+        assert time.perf_counter() - start >= 0.05
+
+        start = time.perf_counter()
+        network.request("http://example.test/large")
+        # 32KB at 320KB/s
+        assert time.perf_counter() - start >= 0.05 + 0.1
+
+
+def test_recordings_replay_the_same_responses(archive, route_to):
+    recorded = TrafficArchive()
+    with ReplayServer(archive) as server:
+        route_to(server)
+        final_url, body = TrafficRecorder(recorded).record("http://example.test/old")
+
+    assert final_url == "http://example.test/"
+    assert body == archive.get("http://example.test/").body
+    assert recorded.get("http://example.test/old").status == 301
+    assert recorded.get("http://example.test/").headers["etag"] == '"v1"'
+
+
+def test_pages_are_replayed_end_to_end(archive, monkeypatch):
+    # 'replay' starts every run from a new network stack, which is put back once the test is done
+    for name in ["dns_cache", "tls_sessions", "pool", "cache", "preloaded", "in_flight", "redirects"]:
+        monkeypatch.setattr(network, name, getattr(network, name))
+    monkeypatch.setattr(browser_tab, "dom_cache", DOMCache(directory=None))
+    page = b"<html><head><link rel=stylesheet href=style.css></head><body><p>Hi</p></body></html>"
+    archive.add(ArchivedResponse("http://example.test/page.html", 200, "OK", {"content-type": "text/html"}, page))
+    archive.add(
+        ArchivedResponse("http://example.test/moved", 301, "Moved Permanently", {"location": "/page.html"}, b"")
+    )
+
+    results = replay(archive, ["http://example.test/moved"], runs=5)
+
+    summary = results["http://example.test/moved"]
+    assert summary["runs"] == 5
+    # A redirect, the document and its stylesheet on a local connection take a few milliseconds, unless
+    # a response waits for the acknowledgement of the previous write (Nagle's algorithm, ~40ms)
+    assert summary["median"] < 40
@@ -0,0 +1,40 @@
+import pytest
+from browser_css.css_parser import CSSParser
+from browser_html.html_parser import HTMLParser
+from browser_network.spill_file import MappedText
+
+
+def test_indexing_and_slicing_match_the_text():
+    text = "<p>Hello, world</p>"
+    with MappedText.spill([text[:5], text[5:]]) as mapped:
+        assert len(mapped) == len(text)
+        assert mapped.width == 1
+        assert [mapped[i] for i in range(len(text))] == list(text)
+        assert mapped[-1] == text[-1]
+        assert mapped[3:8] == text[3:8]
+        assert mapped[::-3] == text[::-3]
+        assert mapped[10:2] == ""
+        with pytest.raises(IndexError):
+            mapped[len(text)]
+
+
+def test_wider_characters_rewrite_the_file():
+    # Latin-1, then a character that needs 2 bytes, then one that needs 4
+    chunks = ["café ", "10 €", " 🙂 done"]
+    text = "".join(chunks)
+    with MappedText.spill(chunks) as mapped:
+        assert mapped.width == 4
+        assert mapped.size == 4 * len(text)
+        assert mapped[0 : len(text)] == text
+        assert mapped[text.index("🙂")] == "🙂"
+        assert "".join(mapped.chunks(3)) == text
+
+
+def test_parsers_read_through_the_mapped_text():
+    with MappedText.spill(["  p { color: red; }\n", "div { font-weight: bold; }  "]) as mapped:
+        rules = CSSParser(mapped).parse_css_file()
+    assert [body for selector, body in rules] == [{"color": "red"}, {"font-weight": "bold"}]
+
+    with MappedText.spill(["<html><body><p>Hel", "lo</p></body></html>"]) as mapped:
+        tree = HTMLParser(mapped).parse()
+    assert tree.children[0].children[0].children[0].text == "Hello"
@@ -0,0 +1,104 @@
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from browser_network import network
+from browser_network.connection_pool import ConnectionPool
+from browser_network.http_cache import HTTPCache
+from browser_network.request_timing import NetworkLog
+from browser_network.timeouts import HedgingPolicy
+from browser_network.tls import TLSSessionCache
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        self.server.requests.append(self.path)
+        if self.path in self.server.stall_once:
+            self.server.stall_once.remove(self.path)
+            time.sleep(1)
+        body = b"<p>secure</p>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def certificate(tmp_path):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is needed to create a self-signed certificate")
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1"]
+        + ["-addext", "subjectAltName=IP:127.0.0.1", "-keyout", str(key), "-out", str(cert)],
+        check=True,
+        capture_output=True,
+    )
+    return str(cert), str(key)
+
+
+@pytest.fixture
+def server(certificate):
+    cert, key = certificate
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.daemon_threads = True
+    # Clients hang up on purpose in some tests (ex. the losing side of a hedged request)
+    server.handle_error = lambda request, client_address: None
+    server.requests = []
+    server.stall_once = set()
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def tls(monkeypatch, certificate):
+    cert, _ = certificate
+    tls = TLSSessionCache(ssl.create_default_context(cafile=cert))
+    # Every request opens a new connection, so that each one goes through a handshake
+    pool = ConnectionPool(tls=tls, idle_timeout=0)
+    monkeypatch.setattr(network, "pool", pool)
+    monkeypatch.setattr(network, "cache", HTTPCache(directory=None))
+    yield tls
+    pool.close_all()
+
+
+def test_reconnects_resume_the_tls_session(server, tls):
+    url = f"https://127.0.0.1:{server.server_address[1]}/index.html"
+
+    for _ in range(3):
+        headers, body = network.request(url)
+        assert body == "<p>secure</p>"
+
+    assert tls.stats.full_handshakes == 1
+    assert tls.stats.resumed_handshakes == 2
+
+
+def test_late_first_bytes_are_hedged(server, tls, monkeypatch):
+    # The session tickets a TLS 1.3 server sends after the handshake make a new connection readable before
+    # the response starts, which mustn't count as its first byte
+    monkeypatch.setattr(network, "hedging", HedgingPolicy(percentile=0.5, min_samples=1))
+    url = f"https://127.0.0.1:{server.server_address[1]}/index.html"
+    network.request(url)
+
+    server.stall_once.add("/index.html")
+    log = NetworkLog()
+    start = time.perf_counter()
+    headers, body = network.request(url, log.record(url))
+    assert body == "<p>secure</p>"
+    assert time.perf_counter() - start < 0.5
+    assert log.entries[0].hedged
+    assert server.requests == ["/index.html"] * 3
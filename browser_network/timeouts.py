@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Hashable
+from browser_config import HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_WINDOW, HEDGE_MIN_DELAY
+
+# The phases a request can run out of time in
+CONNECT = "connect"
+READ = "read"
+TOTAL = "total"
+
+
+class NetworkTimeoutError(TimeoutError):
+    """
+    A request took longer than one of its deadlines:
+        connect - opening the connection (TCP and TLS handshakes)
+        read    - waiting for the next bytes of the response
+        total   - the whole request, from sending it to reading the last byte of the body
+    """
+
+    def __init__(self, url: str, phase: str, timeout: float) -> None:
+        super().__init__(f"{phase} timeout after {timeout:g}s: {url}")
+        self.url = url
+        self.phase = phase
+        self.timeout = timeout
+
+
+class Deadline:
+    """
+    The point in time by which a request has to be done, 'None' seconds means there is no limit.
+    """
+
+    def __init__(self, seconds: float | None, clock: Callable[[], float] = time.monotonic) -> None:
+        self.seconds = seconds
+        self.clock = clock
+        self.expires_at = clock() + seconds if seconds is not None else None
+
+    def remaining(self) -> float | None:
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - self.clock(), 0)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.clock() >= self.expires_at
+
+    def limit(self, timeout: float | None) -> float | None:
+        """
+        The smaller of 'timeout' and the time that is left.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+    def check(self, url: str) -> None:
+        if self.expired:
+            assert self.seconds is not None
+            raise NetworkTimeoutError(url, TOTAL, self.seconds)
+
+    def timeout_error(self, url: str, phase: str, timeout: float | None) -> NetworkTimeoutError:
+        """
+        The error for a socket operation that timed out, which was either its own timeout or the deadline running out.
+        """
+        if self.expired or timeout is None:
+            assert self.seconds is not None
+            return NetworkTimeoutError(url, TOTAL, self.seconds)
+        return NetworkTimeoutError(url, phase, timeout)
+
+
+class HedgingPolicy:
+    """
+    Decides when a request that hasn't received its first byte yet should be sent a second time, on another
+    connection (whichever response starts first is used). Slow responses are often stuck behind something
+    specific to one connection or server process, so a second try caps the latency of the slowest requests.
+
+    The delay is the 'percentile' of the recent times to first byte of the origin, so only the slowest requests
+    (ex. 5% of them with the 0.95 percentile) get a second one. Until 'min_samples' times have been recorded
+    for the origin, requests are not hedged.
+    """
+
+    def __init__(
+        self,
+        percentile: float | None = HEDGE_PERCENTILE,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        window: int = HEDGE_WINDOW,
+        min_delay: float = HEDGE_MIN_DELAY,
+    ) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+        self.samples: dict[Hashable, deque[float]] = {}
+
+    def record(self, origin: Hashable, time_to_first_byte: float) -> None:
+        with self.lock:
+            samples = self.samples.get(origin)
+            if samples is None:
+                samples = self.samples[origin] = deque(maxlen=self.window)
+            samples.append(time_to_first_byte)
+
+    def delay(self, origin: Hashable) -> float | None:
+        """
+        Seconds to wait for the first byte before sending a hedged request, or 'None' to not hedge.
+        """
+        if self.percentile is None:
+            return None
+        with self.lock:
+            samples = self.samples.get(origin)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(int(self.percentile * len(ordered)), len(ordered) - 1)
+        return max(ordered[index], self.min_delay)
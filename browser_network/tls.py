@@ -0,0 +1,96 @@
+import socket
+import ssl
+import threading
+import time
+from typing import Tuple
+from loguru import logger
+
+# Building a context loads the whole CA bundle from disk, so it is done once and shared by every connection
+_ssl_context: ssl.SSLContext | None = None
+_ssl_context_lock = threading.Lock()
+
+
+def get_ssl_context() -> ssl.SSLContext:
+    global _ssl_context
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context()
+        return _ssl_context
+
+
+class TLSStats:
+    """
+    Counts full and resumed handshakes and the time spent in each, which shows what session resumption saves.
+    """
+
+    def __init__(self) -> None:
+        self.full_handshakes = 0
+        self.resumed_handshakes = 0
+        self.full_handshake_seconds = 0.0
+        self.resumed_handshake_seconds = 0.0
+
+    @property
+    def average_full_handshake_seconds(self) -> float:
+        return self.full_handshake_seconds / self.full_handshakes if self.full_handshakes else 0.0
+
+    @property
+    def average_resumed_handshake_seconds(self) -> float:
+        return self.resumed_handshake_seconds / self.resumed_handshakes if self.resumed_handshakes else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"< TLSStats full={self.full_handshakes} ({self.average_full_handshake_seconds * 1000:.2f}ms avg)"
+            f" resumed={self.resumed_handshakes} ({self.average_resumed_handshake_seconds * 1000:.2f}ms avg) >"
+        )
+
+
+class TLSSessionCache:
+    """
+    Wraps sockets in TLS, resuming the last session negotiated with the same (host, port) when there is one.
+
+    A resumed handshake skips the certificate exchange and verification, which saves a round trip in
+    TLS 1.2 and most of the CPU cost of the handshake in both TLS 1.2 and 1.3.
+
+    With TLS 1.3 the server sends its session tickets after the handshake, so a session can only be
+    remembered once some data has been read from the connection, which is why 'remember' is called
+    when a connection is released rather than right after it is opened.
+    """
+
+    def __init__(self, context: ssl.SSLContext | None = None) -> None:
+        # 'None' means the lazily built, process-wide default context
+        self.context = context
+        self.sessions: dict[Tuple[str, int], ssl.SSLSession] = {}
+        self.lock = threading.Lock()
+        self.stats = TLSStats()
+
+    def wrap(self, sock: socket.socket, host: str, port: int) -> ssl.SSLSocket:
+        context = self.context if self.context is not None else get_ssl_context()
+        with self.lock:
+            session = self.sessions.get((host, port))
+
+        start = time.perf_counter()
+        tls_sock = context.wrap_socket(sock, server_hostname=host, session=session)
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            if tls_sock.session_reused:
+                self.stats.resumed_handshakes += 1
+                self.stats.resumed_handshake_seconds += elapsed
+            else:
+                self.stats.full_handshakes += 1
+                self.stats.full_handshake_seconds += elapsed
+        logger.debug(f"TLS handshake with {host}:{port} took {elapsed * 1000:.2f}ms, {self.stats}")
+        return tls_sock
+
+    def remember(self, sock: socket.socket, host: str, port: int) -> None:
+        if not isinstance(sock, ssl.SSLSocket):
+            return
+        session = sock.session
+        if session is None or not session.has_ticket:
+            return
+        with self.lock:
+            self.sessions[(host, port)] = session
+
+    def clear(self) -> None:
+        with self.lock:
+            self.sessions.clear()
@@ -0,0 +1,124 @@
+import base64
+import json
+import threading
+from typing import Dict, Tuple
+from browser_network import network
+from browser_network.http_cache import HOP_BY_HOP_HEADERS
+from browser_config import MAX_REDIRECTS
+from loguru import logger
+
+ARCHIVE_VERSION = 1
+
+
+class ArchivedResponse:
+    """
+    A response as it was recorded. The 'body' is decoded (any 'Content-Encoding' removed), so the
+    headers describing how it was sent over the wire are not kept.
+    """
+
+    def __init__(self, url: str, status: int, explanation: str, headers: Dict[str, str], body: bytes) -> None:
+        self.url = url
+        self.status = status
+        self.explanation = explanation
+        self.headers = headers
+        self.body = body
+
+    def to_json(self) -> dict:
+        return {
+            "url": self.url,
+            "status": self.status,
+            "explanation": self.explanation,
+            "headers": self.headers,
+            "body": base64.b64encode(self.body).decode("ascii"),
+        }
+
+    @staticmethod
+    def from_json(entry: dict) -> "ArchivedResponse":
+        return ArchivedResponse(
+            entry["url"], entry["status"], entry["explanation"], entry["headers"], base64.b64decode(entry["body"])
+        )
+
+    def __repr__(self) -> str:
+        return f"< ArchivedResponse {self.status} url={self.url} size={len(self.body)} >"
+
+
+class TrafficArchive:
+    """
+    Responses captured from live hosts, keyed by url, that 'ReplayServer' serves back later so that
+    page loads can be measured without depending on the network.
+
+    Archives are stored as JSON, with the bodies base64 encoded.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.responses: dict[str, ArchivedResponse] = {}
+
+    @staticmethod
+    def key(url: str) -> str:
+        """
+        'http://example.org' and 'http://example.org:80/' are the same request, so they share an entry.
+        """
+        scheme, host, port, path = network.parse_url(url)
+        if (scheme == "http" and port != 80) or (scheme == "https" and port != 443):
+            host = f"{host}:{port}"
+        return f"{scheme}://{host}{path}"
+
+    def add(self, response: ArchivedResponse) -> None:
+        with self.lock:
+            self.responses[self.key(response.url)] = response
+
+    def get(self, url: str) -> ArchivedResponse | None:
+        with self.lock:
+            return self.responses.get(self.key(url))
+
+    def __len__(self) -> int:
+        return len(self.responses)
+
+    def save(self, file_name: str) -> None:
+        with self.lock:
+            entries = [response.to_json() for response in self.responses.values()]
+        with open(file_name, "w") as file:
+            json.dump({"version": ARCHIVE_VERSION, "entries": entries}, file)
+
+    @staticmethod
+    def load(file_name: str) -> "TrafficArchive":
+        with open(file_name, "r") as file:
+            data = json.load(file)
+        assert data.get("version") == ARCHIVE_VERSION, f"Unsupported archive version: {data.get('version')}"
+
+        archive = TrafficArchive()
+        for entry in data["entries"]:
+            archive.add(ArchivedResponse.from_json(entry))
+        return archive
+
+
+class TrafficRecorder:
+    """
+    Fetches urls from the live hosts and adds the responses to an archive.
+
+    The requests go over the connection pool, but skip the HTTP cache (and the other caches in front
+    of it), since the archive has to hold what the server sends. Redirects are followed, and every hop
+    is recorded, so that replaying the archive goes through the same redirects.
+    """
+
+    def __init__(self, archive: TrafficArchive) -> None:
+        self.archive = archive
+
+    def record(self, url: str) -> Tuple[str, bytes]:
+        """
+        Returns the url the body was served from (after redirects) and the decoded body.
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            with network.open_response(url, {}) as response:
+                body = response.read()
+            headers = {name: value for name, value in response.headers.items() if name not in HOP_BY_HOP_HEADERS}
+            self.archive.add(ArchivedResponse(url, int(response.status), response.explanation, headers, bytes(body)))
+            logger.debug(f"Recorded {response}")
+
+            if response.status not in network.REDIRECT_STATUSES:
+                return url, bytes(body)
+            assert "location" in headers, f"{response.status} redirect from {url} has no 'Location' header"
+            url = network.resolve_url(headers["location"], url)
+
+        raise AssertionError(f"Too many redirects, gave up after {MAX_REDIRECTS} at {url}")
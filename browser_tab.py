@@ -1,29 +1,66 @@
+import asyncio
+import html
 import tkinter
 import tkinter.font
+from concurrent.futures import Future
+from typing import Callable, Iterable, Tuple, TYPE_CHECKING
 from browser_layout.layout import Layout
 from browser_layout.document_layout import DocumentLayout
 from browser_html.html_parser import HTMLParser, Node, Element
+from browser_html.dom_cache import content_key, dom_cache
 from draw_commands import DrawCommand
 from browser_css.css_parser import CSSParser
 from browser_css.css_rules import sort_rules_by_priority, add_css_to_html_node
-from browser_network.network import request, resolve_url
+from browser_network.network import request, resolve_url, stream
+from browser_network.async_network import async_fetch
+from browser_network.fetch_scheduler import Priority, fetch_scheduler
+from browser_network.resource_hints import resource_hints, RESOURCE_HINTS
+from browser_network.request_timing import NetworkLog
+from browser_network.timeouts import NetworkTimeoutError
+from browser_network.spill_file import MappedText
+from browser_network.local_urls import file_url
+from browser_network.speculative_loader import SpeculativeLoader
 from utils.utils import tree_to_list
 from browser_html.html_nodes import Text
-from browser_config import WINDOW_HEIGHT, SCROLL_STEP, CHROME_PX
+from browser_config import (
+    WINDOW_HEIGHT,
+    SCROLL_STEP,
+    CHROME_PX,
+    SPECULATIVE_VIEWPORT_LINKS,
+)
 from utils.utils import stringify_tree
 from loguru import logger
 
+if TYPE_CHECKING:
+    from utils.tk_event_loop import TkEventLoop
+
 # todo find another solution for dealing with potetial 'None' state (
 # * maybe intialize Tab in a valid state, although a tab without a url is a valid state)
 # * another option is to not define the state in the '__init__' method, the downside of that is that is obscures which properties a class has
 
 
 class Tab:
-    def __init__(self) -> None:
+    def __init__(self, event_loop: "TkEventLoop | None" = None, on_load: Callable[[], None] | None = None) -> None:
+        """
+        When the tab is given an 'event_loop', navigations run in the background and 'on_load' is called
+        once the new page is ready to be drawn. Without one, navigations block until the page is loaded.
+        """
         self.scroll = 0
         self.url: str | None = None
         self.history: list[str] = []
         self.display_list: list[DrawCommand] = []
+        # Set once the first page has rendered, until then there is nothing to scroll, click or hover
+        self.layout_tree: DocumentLayout | None = None
+        self.event_loop = event_loop
+        self.on_load = on_load
+        self.navigation: asyncio.Task | None = None
+        # Counts the navigations, a document that is still loading for an older one has been abandoned
+        self.navigations = 0
+        self.speculative_loader = SpeculativeLoader(parse=dom_cache.parse)
+        # The timing of every request made for the pages loaded in this tab
+        self.network_log = NetworkLog()
+        # The requests of the current page that ran out of time, including the stylesheets that were skipped because of it
+        self.errors: list[NetworkTimeoutError] = []
 
         with open("./browser_css/browser_defaults.css", "r") as file:
             file_content = file.read()
@@ -34,19 +71,20 @@ class Tab:
 
     def scroll_up(self) -> None:
         self.scroll = max(self.scroll - SCROLL_STEP, 0)
+        self.prefetch_visible_links()
 
     def scroll_down(self) -> None:
+        if self.layout_tree is None:
+            return
         # Use the total page height to avoid scrolling past the bottom of the page
         max_y = self.layout_tree.block_height - (WINDOW_HEIGHT - CHROME_PX)
         self.scroll = min(self.scroll + SCROLL_STEP, max_y)
+        self.prefetch_visible_links()
 
     def go_back(self) -> None:
         if len(self.history) > 1:
-            # Remove current url from the list
-            self.history.pop()
-            # Remove previous url from the list
-            previous_url = self.history.pop()
-            self.load(previous_url)
+            # The history only changes once the previous page has loaded (see 'show_page')
+            self.navigate(self.history[-2], back=True)
 
     def click(self, x_coordinate: int, y_coordinate: int) -> None:
         """
@@ -54,25 +92,45 @@ class Tab:
         the top-left corner of the window, those are also the x and y coordinates relative to the
         canvas. We want the coordinates relative to the web page, so we need to account for scrolling.
         """
+        url = self.find_link(x_coordinate, y_coordinate + self.scroll)
+        if url is not None:
+            self.navigate(url)
 
-        click_x, click_y = x_coordinate, y_coordinate + self.scroll
+    def hover(self, x_coordinate: int, y_coordinate: int) -> None:
+        """
+        The pointer resting on a link is a good hint that the user is about to click it, so its document
+        is loaded ahead of time. Coordinates are relative to the canvas, like in 'click'.
+        """
+        url = self.find_link(x_coordinate, y_coordinate + self.scroll)
+        if url is not None:
+            self.speculative_loader.prefetch(url)
 
+    def find_link(self, page_x: float, page_y: float) -> str | None:
+        """
+        Returns the url of the link at the given coordinates of the web page, if there is one.
+        """
+        if self.layout_tree is None:
+            return None
         # Figure out which elements are at that location
         objs: list[Layout] = []
         for obj in tree_to_list(self.layout_tree, []):
-            within_block_width = obj.abs_x <= click_x < obj.abs_x + obj.block_width
-            within_block_height = obj.abs_y < click_y < obj.abs_y + obj.block_height
+            within_block_width = obj.abs_x <= page_x < obj.abs_x + obj.block_width
+            within_block_height = obj.abs_y < page_y < obj.abs_y + obj.block_height
             if within_block_width and within_block_height:
                 objs.append(obj)
 
-        if not obj:
-            return
+        if not objs:
+            return None
 
         # When clicking on some text, you’re also clicking on the paragraph it’s in, and the section that that paragraph is in, and so on.
         # We want the most specific node which is the last object in the list.
-        html_element: Node | None = objs[-1].node
-        # For a link node, the most specific node that was clicked (i.e. element) is a text node.
-        # But since we want to know the actual URL the user clicked on, we need to climb back up the HTML tree to find the link element.
+        return self.link_of(objs[-1].node)
+
+    def link_of(self, html_element: Node | None) -> str | None:
+        """
+        For a link node, the most specific node that was clicked (i.e. element) is a text node.
+        But since we want to know the actual URL the user clicked on, we need to climb back up the HTML tree to find the link element.
+        """
         while html_element:
             if isinstance(html_element, Text):
                 pass
@@ -80,11 +138,32 @@ class Tab:
                 # todo find another solution for dealing with potetial 'None' state (maybe intialize Tab in a valid state, although a tab without a url is a valid state)
                 assert self.url is not None, "Tried to access url when url is not set"
 
-                url = resolve_url(html_element.attributes["href"], self.url)
-                # Clear the current layout tree when fetching a new resource
-                self.display_list = []
-                return self.load_url(url)
+                return resolve_url(html_element.attributes["href"], self.url)
             html_element = html_element.parent
+        return None
+
+    def prefetch_visible_links(self) -> None:
+        """
+        Links that are on screen are the next most likely navigations after hovered ones, so the first few
+        of them are loaded ahead of time as well.
+        """
+        if self.layout_tree is None:
+            return
+        top, bottom = self.scroll, self.scroll + WINDOW_HEIGHT - CHROME_PX
+        urls: list[str] = []
+        for obj in tree_to_list(self.layout_tree, []):
+            if obj.abs_y + obj.block_height < top or obj.abs_y > bottom:
+                continue
+            if not (isinstance(obj.node, Element) and obj.node.tag == "a") and not isinstance(obj.node, Text):
+                continue
+            url = self.link_of(obj.node)
+            if url is not None and url not in urls:
+                urls.append(url)
+                if len(urls) == SPECULATIVE_VIEWPORT_LINKS:
+                    break
+
+        for url in urls:
+            self.speculative_loader.prefetch(url)
 
     def draw(self, canvas: tkinter.Canvas):
         canvas.delete("all")
@@ -95,51 +174,261 @@ class Tab:
                 continue
             cmd.execute(self.scroll - CHROME_PX, canvas)
 
-    def load_url(self, url: str):
+    def navigate(self, url: str, back: bool = False) -> None:
+        """
+        Loads the url in the background if the tab runs on an event loop. The current page stays on
+        screen until the new one is ready, and a navigation that is still loading is abandoned.
+
+        'back' is set when going back to the previous page in the history.
+        """
+        self.navigations += 1
+        if self.event_loop is None:
+            self.load_url(url, back)
+            return
+
+        if self.navigation is not None and not self.navigation.done():
+            self.navigation.cancel()
+        # The fetches of the page that is being left are not needed anymore. The ones that are already running
+        # can't be stopped from here, a document that is still streaming stops once it sees it is out of date
+        fetch_scheduler.cancel(self)
+        self.navigation = self.event_loop.create_task(self.load_url_async(url, back), on_done=self.on_load)
+
+    def load_url(self, url: str, back: bool = False):
+        self.network_log.start_page(url)
+        self.errors = []
+        prefetched = self.take_prefetched(url)
+        if prefetched is not None:
+            final_url, html_tree = prefetched
+            self.load_tree(html_tree, final_url, back)
+            return
+
+        try:
+            final_url, html_tree, stylesheets = self.stream_document(url, self.navigations)
+        except NetworkTimeoutError as e:
+            self.show_error(e, url, back)
+            return
+        # Collected in document order, like in 'load_tree'
+        self.show_page(final_url, html_tree, [future.result() for future in stylesheets], back)
+
+    async def load_url_async(self, url: str, back: bool = False) -> None:
+        self.network_log.start_page(url)
+        self.errors = []
+        prefetched = self.take_prefetched(url)
+        if prefetched is None:
+            try:
+                final_url, html_tree, stylesheet_futures = await async_fetch(
+                    Priority.DOCUMENT, url, self.stream_document, url, self.navigations, owner=self
+                )
+            except NetworkTimeoutError as e:
+                self.show_error(e, url, back)
+                return
+        else:
+            final_url, html_tree = prefetched
+            self.apply_resource_hints(html_tree, final_url)
+            stylesheet_futures = self.fetch_stylesheets(html_tree, final_url)
+
+        stylesheets = await asyncio.gather(*[asyncio.wrap_future(future) for future in stylesheet_futures])
+        self.show_page(final_url, html_tree, stylesheets, back)
+
+    def stream_document(self, url: str, navigation: int) -> Tuple[str, Node, list["Future[str | MappedText | None]"]]:
+        """
+        Feeds the body to the parser as it is downloaded, instead of waiting for the whole document. The
+        stylesheets and resource hints are acted on as soon as their '<link>' has been parsed, so they load
+        while the rest of the document is still arriving.
+
+        A document whose body is already here (ex. from the HTTP cache, or a local file) isn't parsed again
+        if the DOM cache has its tree. Downloaded documents are added to the DOM cache once they are parsed.
+
+        Returns the url the document was served from, its tree, and its stylesheets (in document order).
+        Runs on a worker thread of the fetch scheduler when the tab has an event loop. If the tab navigates
+        again in the meantime ('navigation' is no longer the latest), the download stops at its next chunk,
+        and what was parsed so far is returned.
+        """
+        with stream(url, self.network_log.record(url)) as response:
+            stylesheets: list["Future[str | MappedText | None]"] = []
+            if response.body is not None:
+                key = content_key(response.body)
+                html_tree = dom_cache.lookup(key)
+                if html_tree is not None:
+                    for node in tree_to_list(html_tree, []):
+                        if isinstance(node, Element):
+                            self.load_link(node, response.url, stylesheets, navigation)
+                    return response.url, html_tree, stylesheets
+                keys = [key]
+            else:
+                # Hashed once the whole body has arrived (unless it was too large to be kept in memory)
+                keys = []
+                response.completion_listeners.append(lambda body: keys.append(content_key(body)))
+
+            parser = HTMLParser()
+            parser.element_listeners.append(
+                lambda element: self.load_link(element, response.url, stylesheets, navigation)
+            )
+            for chunk in response.iter_text():
+                if navigation != self.navigations:
+                    logger.debug(f"Abandoning the download of {url}, the tab navigated away")
+                    # Not added to the DOM cache, the tree is incomplete
+                    return response.url, parser.close(), stylesheets
+                parser.feed(chunk)
+            html_tree = parser.close()
+            if keys:
+                dom_cache.store(keys[0], response.decoded_bytes, html_tree)
+        return response.url, html_tree, stylesheets
+
+    def load_link(
+        self, element: Element, base_url: str, stylesheets: list["Future[str | MappedText | None]"], navigation: int
+    ) -> None:
+        """
+        Starts loading what a '<link>' asks for, a stylesheet (added to 'stylesheets') or the work of a resource hint.
+        A '<style>' is added to 'stylesheets' as well, in document order. Nothing is loaded for a document of an
+        older 'navigation', which the tab has navigated away from.
+        """
+        if navigation != self.navigations:
+            return
+        stylesheet = self.stylesheet_of(element, base_url)
+        if stylesheet is not None:
+            stylesheets.append(stylesheet)
+        if element.tag == "link" and "href" in element.attributes:
+            self.apply_resource_hint(element, resolve_url(element.attributes["href"], base_url))
+
+    def take_prefetched(self, url: str) -> Tuple[str, Node] | None:
+        """
+        Returns the url the document was served from and its tree if it was loaded speculatively, and abandons
+        the speculative loads of the page that is being left, since its links are no longer likely navigations.
+        """
+        prefetched = self.speculative_loader.take(url)
+        # A prefetch of the url that is still downloading is joined by the navigation ('network.join_or_fetch')
+        self.speculative_loader.cancel(keep=url)
+        if prefetched is None:
+            return None
+        if prefetched.timing is not None:
+            self.network_log.add(prefetched.timing)
+        if prefetched.tree is not None:
+            return prefetched.url, prefetched.tree
+        return prefetched.url, HTMLParser(prefetched.text).parse()
+
+    def show_page(
+        self, url: str, html_tree: Node, stylesheets: Iterable[str | MappedText | None], back: bool = False
+    ) -> None:
+        """
+        Replaces the page on screen with the one that finished loading from 'url' (the url it was served from,
+        after redirects). Only now do the tab's url and history change: until then the old page is still on
+        screen, and its relative links have to keep resolving against its own url.
+        """
+        if url != self.url:
+            logger.debug(f"Showing {url} instead of {self.url}")
+        if back:
+            # Going back replaces the page that is left with the previous one
+            self.history.pop()
+            self.history[-1] = url
+        else:
+            self.history.append(url)
         self.url = url
-        self.history.append(url)
-        headers, body = request(url)
-        self.load(body)
+        self.render(html_tree, stylesheets)
 
     def load_file(self, file_name: str) -> None:
-        self.url = file_name
-        with open(file_name, "r") as file:
-            raw_html = file.read()
-        self.load(raw_html)
+        """
+        Local files are loaded through their 'file://' url, like any other page.
+        """
+        self.navigate(file_url(file_name))
 
-    def load(self, raw_html: str):
-        html_tree = HTMLParser(raw_html).parse()
+    def fetch_stylesheet(self, url: str) -> str | MappedText | None:
+        """
+        Runs on a worker thread of the fetch scheduler. A stylesheet that fails to load is skipped.
+        """
+        try:
+            header, body = request(url, self.network_log.record(url))
+            logger.debug(f"Link: {url}")
+            logger.debug(f"\n\n{body}")
+            return body
+        except NetworkTimeoutError as e:
+            logger.debug(f"Skipping stylesheet: {e}")
+            self.errors.append(e)
+            return None
+        # todo make the exception more sepcific
+        except Exception as e:
+            logger.exception(e)
+            return None
 
-        # ? Why do a shallow copy of the list?
-        rules = self.default_style_sheet.copy()
+    def show_error(self, error: NetworkTimeoutError, url: str, back: bool = False) -> None:
+        """
+        Replaces the page that couldn't be loaded with one explaining why. The error is kept in 'errors'.
+        """
+        logger.debug(f"Failed to load {url}: {error}")
+        self.errors.append(error)
+        page = (
+            "<html><body>"
+            f"<h1>{html.escape(error.url)} took too long to respond</h1>"
+            f"<p>No response within the {error.phase} timeout of {error.timeout:g} seconds.</p>"
+            "</body></html>"
+        )
+        self.show_page(url, HTMLParser(page).parse(), [], back)
 
-        links = [
-            node.attributes["href"]
-            for node in tree_to_list(html_tree, [])
-            if isinstance(node, Element)
-            and node.tag == "link"
-            and "href" in node.attributes
-            and node.attributes.get("rel") == "stylesheet"
-        ]
+    def export_har(self, file_name: str) -> None:
+        """
+        Writes the timings of the requests made by this tab to a HAR file, which can be opened by the
+        network panel of most browser developer tools.
+        """
+        self.network_log.export_har(file_name)
 
-        # with open("./examples/parse.css", "r") as file:
-        #     file_content = file.read()
-        #     rules.extend(CSSParser(file_content).parse_css_file())
+    def load_tree(self, html_tree: Node, url: str, back: bool = False) -> None:
+        self.apply_resource_hints(html_tree, url)
 
-        for link in links:
-            try:
-                # todo find another solution for dealing with potetial 'None' state (maybe intialize Tab in a valid state, although a tab without a url is a valid state)
-                assert self.url is not None, "Tried to access url when url is not set"
+        # The stylesheets are downloaded concurrently, but collected in document order, which keeps
+        # the cascade (where later files win ties) deterministic
+        stylesheets = [future.result() for future in self.fetch_stylesheets(html_tree, url)]
+        self.show_page(url, html_tree, stylesheets, back)
 
-                header, body = request(resolve_url(link, self.url))
-                logger.debug(f"Link: {link}")
-                logger.debug(f"\n\n{body}")
+    def fetch_stylesheets(self, html_tree: Node, base_url: str) -> list["Future[str | MappedText | None]"]:
+        """
+        Schedules the download of the document's stylesheets, which block rendering, so they go ahead
+        of everything but documents. Their urls are relative to 'base_url', the url of the document.
+        """
+        stylesheets = [
+            self.stylesheet_of(node, base_url) for node in tree_to_list(html_tree, []) if isinstance(node, Element)
+        ]
+        return [stylesheet for stylesheet in stylesheets if stylesheet is not None]
 
-            # todo make the exception more sepcific
-            except Exception as e:
-                logger.exception(e)
+    def stylesheet_of(self, element: Element, base_url: str) -> "Future[str | MappedText | None] | None":
+        """
+        The stylesheet of a '<link rel=stylesheet>' (which starts loading) or of a '<style>', if the element is one.
+        """
+        if element.tag == "style":
+            return inline_stylesheet(element)
+        url = linked_stylesheet(element, base_url)
+        if url is not None:
+            return self.schedule_stylesheet(url)
+        return None
+
+    def schedule_stylesheet(self, url: str) -> "Future[str | MappedText | None]":
+        return fetch_scheduler.submit(Priority.RENDER_BLOCKING, url, self.fetch_stylesheet, url, owner=self)
+
+    def apply_resource_hints(self, html_tree: Node, base_url: str) -> None:
+        """
+        Starts the work asked for by '<link rel=preconnect|dns-prefetch|preload|prefetch>' in the background.
+        """
+        for node in tree_to_list(html_tree, []):
+            if not (isinstance(node, Element) and node.tag == "link" and "href" in node.attributes):
                 continue
+            self.apply_resource_hint(node, resolve_url(node.attributes["href"], base_url))
+
+    def apply_resource_hint(self, link: Element, url: str) -> None:
+        # 'rel' is a space separated list of link types
+        for rel in link.attributes.get("rel", "").lower().split():
+            if rel in RESOURCE_HINTS:
+                resource_hints.hint(rel, url)
 
+    def render(self, html_tree: Node, stylesheets: Iterable[str | MappedText | None]) -> None:
+        """
+        Applies the stylesheets (in document order, skipping the ones that failed to load) to the
+        document and lays it out. Must run on the Tk thread, since layout measures text with Tk fonts.
+        """
+        # ? Why do a shallow copy of the list?
+        rules = self.default_style_sheet.copy()
+
+        for body in stylesheets:
+            if body is None:
+                continue
             rules.extend(CSSParser(body).parse_css_file())
 
         sorted_rules = sort_rules_by_priority(rules)
@@ -148,4 +437,27 @@ class Tab:
 
         self.layout_tree = DocumentLayout(html_tree)
         self.layout_tree.layout()
+        # Clear the display list of the previous page
+        self.display_list = []
         self.layout_tree.paint(self.display_list)
+        self.prefetch_visible_links()
+
+
+def linked_stylesheet(link: Element, base_url: str) -> str | None:
+    """
+    The url of the stylesheet a '<link rel=stylesheet>' points to, if the element is one.
+    """
+    if link.tag == "link" and "href" in link.attributes and link.attributes.get("rel") == "stylesheet":
+        return resolve_url(link.attributes["href"], base_url)
+    return None
+
+
+def inline_stylesheet(style: Element) -> "Future[str | MappedText | None]":
+    """
+    The contents of a '<style>' are a stylesheet that is already loaded. It is still returned as a future, so
+    it takes its place among the linked stylesheets, in document order (where later stylesheets win ties).
+    """
+    future: "Future[str | MappedText | None]" = Future()
+    body = "".join(child.text for child in style.children if isinstance(child, Text))
+    future.set_result(body if body.strip() else None)
+    return future
@@ -8,7 +8,9 @@ from browser_chrome.back_button import BackButton
 from browser_chrome.address_bar import AddressBar
 from browser_chrome.new_tab_button import NewTabButton
 from browser_chrome.tab_header import TabHeader
+from browser_config import HOVER_DELAY_MS
 from logger_config import setup_logger
+from utils.tk_event_loop import TkEventLoop
 from loguru import logger
 
 
@@ -26,11 +28,14 @@ class Browser:
         self.window.bind("<Up>", self.handle_up)
         self.window.bind("<Down>", self.handle_down)
         self.window.bind("<Button-1>", self.handle_click)
+        self.window.bind("<Motion>", self.handle_motion)
         self.window.bind("<Key>", self.handle_key)
         self.window.bind("<Return>", self.handle_enter)
         self.window.bind("<BackSpace>", self.handle_backspace)
         self.window.bind("<Control-v>", self.handle_paste)
         self.window.bind("<Command-v>", self.handle_paste)
+        # Pages load in the background, so that scrolling and typing keep working while waiting on the network
+        self.event_loop = TkEventLoop(self.window)
 
         self.tabs: list[Tab] = []
         self.active_tab: int = 0
@@ -42,6 +47,8 @@ class Browser:
 
         self.focus: Literal["address bar"] | None = None
         self.address_bar_value = ""
+        # The pending 'after()' callback that reports the pointer resting on the page
+        self.hover_callback: str | None = None
 
     def handle_paste(self, event: tkinter.Event):
         if self.focus == "address bar":
@@ -55,7 +62,7 @@ class Browser:
 
     def handle_enter(self, event: tkinter.Event):
         if self.focus == "address bar":
-            self.tabs[self.active_tab].load_url(self.address_bar_value)
+            self.tabs[self.active_tab].navigate(self.address_bar_value)
             self.focus = None
             self.draw()
 
@@ -105,6 +112,24 @@ class Browser:
             self.tabs[self.active_tab].click(event.x, event.y - self.CHROME_PX)
         self.draw()
 
+    def handle_motion(self, event: tkinter.Event) -> None:
+        """
+        The tab is only told about the pointer once it rests in one place for 'HOVER_DELAY_MS', so that
+        sweeping the pointer across the page doesn't prefetch every link on the way.
+        """
+        if self.hover_callback is not None:
+            self.window.after_cancel(self.hover_callback)
+            self.hover_callback = None
+
+        if event.y < self.CHROME_PX or not self.tabs:
+            return
+
+        def hover() -> None:
+            self.hover_callback = None
+            self.tabs[self.active_tab].hover(event.x, event.y - self.CHROME_PX)
+
+        self.hover_callback = self.window.after(HOVER_DELAY_MS, hover)
+
     def draw(self) -> None:
         # self.canvas.delete("all")
         active_tab = self.tabs[self.active_tab]
@@ -127,14 +152,14 @@ class Browser:
             self.address_bar.draw(self.canvas, active_tab.url, self.focus, self.address_bar_value, button_font)
 
     def load_url(self, url: str) -> None:
-        new_tab = Tab()
-        new_tab.load_url(url)
+        new_tab = Tab(self.event_loop, on_load=self.draw)
+        new_tab.navigate(url)
         self.active_tab = len(self.tabs)
         self.tabs.append(new_tab)
         self.draw()
 
     def load_file(self, file_name: str) -> None:
-        new_tab = Tab()
+        new_tab = Tab(self.event_loop, on_load=self.draw)
         new_tab.load_file(file_name)
         self.active_tab = len(self.tabs)
         self.tabs.append(new_tab)
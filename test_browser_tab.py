@@ -0,0 +1,228 @@
+import asyncio
+import time
+from typing import Callable, Iterable
+import pytest
+import browser_tab
+from browser_html.dom_cache import DOMCache
+from browser_html.html_nodes import Element, Node, Text
+from browser_network import network
+from browser_network.connection_pool import ConnectionPool
+from browser_network.http_cache import HTTPCache
+from browser_network.in_flight import InFlightRequests
+from browser_network.local_urls import file_url
+from browser_network.preload_cache import PreloadCache
+from browser_network.redirect_cache import RedirectCache
+from browser_network.spill_file import MappedText
+from browser_network.test_network import server, url  # noqa: F401 (the 'server' fixture)
+from browser_tab import Tab
+from utils.utils import tree_to_list
+from utils.tk_event_loop import TkEventLoop
+
+
+class StandInWindow:
+    """
+    Collects the callbacks 'TkEventLoop' schedules with 'after()', which 'run_until' calls the way Tk's
+    'mainloop' would.
+    """
+
+    def __init__(self) -> None:
+        self.callbacks: list[Callable[[], None]] = []
+
+    def after(self, ms: int, callback: Callable[[], None]) -> None:
+        self.callbacks.append(callback)
+
+    def run_once(self) -> None:
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def run_until(self, condition: Callable[[], bool], timeout: float = 5) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "Timed out waiting for the event loop"
+            self.run_once()
+            time.sleep(0.001)
+
+
+class HeadlessTab(Tab):
+    """
+    A tab that stops before layout, which needs a display.
+    """
+
+    def render(self, html_tree: Node, stylesheets: Iterable[str | MappedText | None]) -> None:
+        self.html_tree = html_tree
+        self.stylesheets = list(stylesheets)
+
+
+@pytest.fixture(autouse=True)
+def stand_in_dom_cache(monkeypatch):
+    monkeypatch.setattr(browser_tab, "dom_cache", DOMCache(directory=None))
+
+
+@pytest.fixture(autouse=True)
+def fresh_network(monkeypatch):
+    pool = ConnectionPool()
+    monkeypatch.setattr(network, "pool", pool)
+    monkeypatch.setattr(network, "cache", HTTPCache(directory=None))
+    monkeypatch.setattr(network, "preloaded", PreloadCache())
+    monkeypatch.setattr(network, "in_flight", InFlightRequests())
+    monkeypatch.setattr(network, "redirects", RedirectCache())
+    yield
+    pool.close_all()
+
+
+@pytest.fixture
+def event_loop():
+    window = StandInWindow()
+    event_loop = TkEventLoop(window)  # type: ignore[arg-type]
+    yield window, event_loop
+    event_loop.loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def pages(tmp_path):
+    """
+    Three pages in the same directory, each linking to the next one with a relative url.
+    """
+    for name, link in [("first", "second"), ("second", "third"), ("third", "first")]:
+        (tmp_path / f"{name}.html").write_text(f'<html><body><a href="{link}.html">{name}</a></body></html>')
+    return {name: file_url(str(tmp_path / f"{name}.html")) for name in ["first", "second", "third"]}
+
+
+def first_link(tab: HeadlessTab) -> Element:
+    return next(node for node in tree_to_list(tab.html_tree, []) if isinstance(node, Element) and node.tag == "a")
+
+
+def test_a_tab_without_a_page_ignores_the_pointer():
+    tab = Tab()
+    # The Tk loop keeps handling events while the first page of a new tab is loading
+    tab.hover(10, 10)
+    tab.click(10, 10)
+    tab.scroll_down()
+    tab.scroll_up()
+    assert tab.layout_tree is None and tab.scroll == 0
+
+
+def test_event_loop_runs_tasks_between_tk_callbacks(event_loop):
+    window, loop = event_loop
+    done = []
+
+    async def task() -> str:
+        await asyncio.sleep(0)
+        return "result"
+
+    finished = loop.create_task(task(), on_done=lambda: done.append("finished"))
+    cancelled = loop.create_task(task(), on_done=lambda: done.append("cancelled"))
+    cancelled.cancel()
+    # Done callbacks run on the iteration after the task finished
+    window.run_until(lambda: finished.done() and cancelled.done() and len(done) == 1)
+    for _ in range(3):
+        window.run_once()
+
+    assert finished.result() == "result"
+    # Abandoned tasks don't call back
+    assert done == ["finished"]
+    # The loop keeps rescheduling itself
+    assert len(window.callbacks) == 1
+
+
+def test_tab_keeps_its_url_until_the_new_page_is_shown(event_loop, pages):
+    window, loop = event_loop
+    loads = []
+    tab = HeadlessTab(loop, on_load=lambda: loads.append(tab.url))
+    tab.navigate(pages["first"])
+    window.run_until(lambda: len(loads) == 1)
+    first_page = tab.html_tree
+
+    tab.navigate(pages["second"])
+    window.run_once()
+    # The old page is still on screen, so its links still resolve against its url
+    assert tab.url == pages["first"] and tab.history == [pages["first"]]
+    assert tab.link_of(first_link(tab)) == pages["second"]
+    assert tab.html_tree is first_page
+
+    window.run_until(lambda: len(loads) == 2)
+    assert loads == [pages["first"], pages["second"]]
+    assert tab.history == [pages["first"], pages["second"]]
+    assert tab.link_of(first_link(tab)) == pages["third"]
+
+
+def test_a_new_navigation_abandons_the_pending_one(event_loop, pages):
+    window, loop = event_loop
+    loads = []
+    tab = HeadlessTab(loop, on_load=lambda: loads.append(tab.url))
+    tab.navigate(pages["first"])
+    window.run_until(lambda: len(loads) == 1)
+
+    tab.navigate(pages["second"])
+    tab.navigate(pages["third"])
+    window.run_until(lambda: len(loads) == 2)
+    # Give the abandoned navigation a chance to show up, if it were still running
+    for _ in range(10):
+        window.run_once()
+        time.sleep(0.001)
+
+    assert loads == [pages["first"], pages["third"]]
+    assert tab.history == [pages["first"], pages["third"]]
+
+    tab.go_back()
+    assert tab.url == pages["third"]
+    window.run_until(lambda: len(loads) == 3)
+    assert tab.url == pages["first"] and tab.history == [pages["first"]]
+
+
+def test_following_a_link_joins_its_speculative_load(server):
+    server.chunked_pages["/slow.html"] = [b"<html><body>", b"<p>slow</p>", b"</body></html>"]
+    server.chunk_delays["/slow.html"] = 0.1
+    tab = HeadlessTab()
+    # The pointer went over the link, which started loading it
+    tab.speculative_loader.prefetch(url(server, "/slow.html"))
+    deadline = time.monotonic() + 5
+    while not server.requests:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+    # The link is followed while its body is still arriving
+    tab.navigate(url(server, "/slow.html"))
+
+    assert tab.url == url(server, "/slow.html")
+    assert [node.text for node in tree_to_list(tab.html_tree, []) if isinstance(node, Text)] == ["slow"]
+    assert server.requests == ["/slow.html"]
+
+
+def test_a_document_that_is_navigated_away_from_stops_loading(event_loop, server):
+    window, loop = event_loop
+    # The stylesheet is linked in the part of the document that arrives last
+    server.chunked_pages["/first.html"] = [b"<html><head>", b"<link rel=stylesheet href=first.css></head></html>"]
+    server.chunk_delays["/first.html"] = 0.2
+    loads = []
+    tab = HeadlessTab(loop, on_load=lambda: loads.append(tab.url))
+
+    tab.navigate(url(server, "/first.html"))
+    window.run_until(lambda: "/first.html" in server.requests)
+    tab.navigate(url(server, "/index.html"))
+    window.run_until(lambda: len(loads) == 1)
+    # Long enough for the rest of the first document to arrive
+    time.sleep(0.5)
+
+    assert loads == [url(server, "/index.html")]
+    assert "/first.css" not in server.requests
+
+
+def test_stylesheets_load_concurrently_and_apply_in_document_order(server):
+    links = "".join(f"<link rel=stylesheet href={name}.css>" for name in ["first", "second", "third"])
+    server.pages["/styled.html"] = f"<html><head>{links}</head><body>styled</body></html>".encode("utf8")
+    # The later a stylesheet is in the document, the sooner it arrives
+    for name, delay in [("first", 0.3), ("second", 0.2), ("third", 0.1)]:
+        server.pages[f"/{name}.css"] = f"p {{ font-family: {name}; }}".encode("utf8")
+        server.delays[f"/{name}.css"] = delay
+    tab = HeadlessTab()
+
+    start = time.perf_counter()
+    tab.navigate(url(server, "/styled.html"))
+    elapsed = time.perf_counter() - start
+
+    assert tab.stylesheets == [f"p {{ font-family: {name}; }}" for name in ["first", "second", "third"]]
+    # As long as the slowest one, rather than all of them one after the other (0.6s)
+    assert 0.3 <= elapsed < 0.45
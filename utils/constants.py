@@ -15,6 +15,12 @@ SELF_CLOSING_TAGS = [
     "wbr",
 ]
 
+"""
+The elements whose contents are text, even when it looks like markup (ex. 'if (a < b)' in a script).
+The parser takes everything up to their close tag as it is, instead of tokenizing it.
+"""
+RAW_TEXT_ELEMENTS = ["script", "style", "textarea"]
+
 
 """
 A list of all the tags that describe parts of a page instead of formatting.
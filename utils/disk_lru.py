@@ -0,0 +1,85 @@
+import os
+from collections import OrderedDict
+
+
+class DiskLRU:
+    """
+    The index of a cache directory, bounded by the bytes of its entries ('max_bytes'), which evicts the least
+    recently used entries first.
+
+    An entry is one file per suffix, named after its key ('<key><suffix>'). The file with the first suffix is
+    the one the entry is found by, and its modification time doubles as the last access time when the index is
+    rebuilt, when the browser starts. The caller writes and reads the files, and tells the index about it.
+
+    The index isn't thread safe, the caches using it call it while holding their own lock.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffixes: list[str]) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffixes = suffixes
+        # key -> size, ordered from the least to the most recently used
+        self.index: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        self._load_index()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def paths(self, key: str) -> list[str]:
+        """
+        The files of an entry, in the order of 'suffixes'.
+        """
+        return [os.path.join(self.directory, key + suffix) for suffix in self.suffixes]
+
+    def touch(self, key: str) -> None:
+        """
+        Marks an entry that was just read as the most recently used one.
+        """
+        os.utime(self.paths(key)[0])
+        self.index.move_to_end(key)
+
+    def add(self, key: str, size: int) -> None:
+        """
+        Adds an entry once its files are written, and evicts entries until the directory fits in 'max_bytes' again.
+        """
+        self.size -= self.index.pop(key, 0)
+        self.index[key] = size
+        self.size += size
+        self._evict()
+
+    def remove(self, key: str) -> None:
+        size = self.index.pop(key, None)
+        if size is None:
+            return
+        self.size -= size
+        for path in self.paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        for key in list(self.index):
+            self.remove(key)
+
+    def _load_index(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+
+        entries = []
+        suffix = self.suffixes[0]
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(suffix):
+                continue
+            stat = os.stat(os.path.join(self.directory, file_name))
+            entries.append((stat.st_mtime, file_name.removesuffix(suffix), stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.size += size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.size > self.max_bytes and self.index:
+            self.remove(next(iter(self.index)))
@@ -0,0 +1,44 @@
+import asyncio
+import tkinter
+from typing import Any, Callable, Coroutine
+from loguru import logger
+
+
+class TkEventLoop:
+    """
+    Runs an asyncio event loop on the Tk thread.
+
+    Tk owns the thread through 'mainloop', so the asyncio loop can't run forever. Instead, every
+    'interval_ms' an 'after()' callback lets the asyncio loop run a single iteration, which resumes
+    every coroutine whose awaited result has arrived (ex. a page that finished downloading on a worker
+    thread) and returns to Tk right away. Coroutines therefore run on the Tk thread and can safely draw.
+    """
+
+    def __init__(self, window: tkinter.Misc, interval_ms: int = 10) -> None:
+        self.window = window
+        self.interval_ms = interval_ms
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.window.after(self.interval_ms, self._run_once)
+
+    def _run_once(self) -> None:
+        # 'stop' is processed after the callbacks that are already ready, so this runs exactly one iteration
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+        self.window.after(self.interval_ms, self._run_once)
+
+    def create_task(
+        self, coroutine: Coroutine[Any, Any, Any], on_done: Callable[[], None] | None = None
+    ) -> "asyncio.Task[Any]":
+        task = self.loop.create_task(coroutine)
+        task.add_done_callback(lambda task: self._task_done(task, on_done))
+        return task
+
+    def _task_done(self, task: "asyncio.Task[Any]", on_done: Callable[[], None] | None) -> None:
+        if task.cancelled():
+            return
+        exception = task.exception()
+        if exception is not None:
+            logger.opt(exception=exception).error(f"Background task failed: {exception}")
+        if on_done is not None:
+            on_done()